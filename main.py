@@ -1,18 +1,47 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.models import (
     ChatRequest, ChatResponse, 
     LinkingRequest, OTPVerificationRequest, LinkingResponse,
-    KCAF_RecordCreate, KCAF_RecordResponse
+    KCAF_RecordCreate, KCAF_RecordResponse, KCAF_BulkResponse
+)
+from src.database import get_db, get_async_db, create_tables, engine, SessionLocal, AsyncSessionLocal, Citizens
+from src.engine_profile import print_engine_report
+from src.services import (
+    AuthService, DataService, LoggingService,
+    AsyncAuthService, AsyncDataService, AsyncLoggingService, ASYNC_INTENT_HANDLERS,
+    context_cache, identity_cache
+)
+from src.model import (
+    generate_answer_async, stream_answer_async, generate_lead_async, get_intent_async, get_intent_and_answer_async, INTENT_CATEGORIES,
+    get_cached_answer, cache_answer, answer_cache, intent_cache, load_intent_cache, is_degraded_answer,
+    classify_without_llm, StreamInterrupted
 )
-from src.database import get_db, create_tables, Citizens, LinkedUsers
-from src.services import AuthService, DataService, LoggingService, INTENT_HANDLERS
-from src.model import generate_answer, get_intent
 from src.kodibot import Kodibot
-from src.prompts import build_contextualized_prompt
+from src.prompts import build_contextualized_prompt, build_combined_prompt, build_lead_prompt
+from src.templates import answer_mode, render_answer
 from src.logger import logger, log_info, log_error, log_chat
+from src.intent_classifier import load_local_classifier
+from src.log_writer import chat_log_writer
+from src.conversation_store import conversation_store
+from src.request_guard import phone_locks, reply_cache, idempotency_key, get_stored_reply, store_reply
+from src.context_serializer import serializer_stats
+from src.rollups import popular_intents, intent_summary, daily_intents
+from src.metrics import (
+    llm_usage, set_llm_context, llm_endpoint, llm_intent, render_prometheus,
+    CallbackMetric, CHAT_STAGE_SECONDS, CHAT_REQUEST_SECONDS, CHAT_REQUESTS
+)
 import json
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
 from typing import Optional
 
 app = FastAPI(title="KodiBOT API", description="Assistant WhatsApp pour services gouvernementaux RDC")
@@ -32,125 +61,199 @@ app.add_middleware(
 
 # Initialize database
 create_tables()
+print_engine_report(engine)
+
+# Load the local intent classifier (trained with scripts/train_intent_classifier.py)
+load_local_classifier()
+
+# Warm the intent memo cache from SQLite when persistence is enabled
+load_intent_cache()
 
 # Initialize Kodibot
 kodibot = Kodibot()
 
+# In-process caches, exported on /cache/stats and /metrics
+CACHES = (answer_cache, intent_cache, context_cache, identity_cache, reply_cache)
+
+CallbackMetric("kodibot_cache_entries", "Entries held by each in-process cache", ("cache",),
+               lambda: [((cache.name,), len(cache)) for cache in CACHES])
+CallbackMetric("kodibot_cache_hits_total", "Cache hits", ("cache",),
+               lambda: [((cache.name,), cache.hits) for cache in CACHES], type_name="counter")
+CallbackMetric("kodibot_cache_misses_total", "Cache misses", ("cache",),
+               lambda: [((cache.name,), cache.misses) for cache in CACHES], type_name="counter")
+CallbackMetric("kodibot_conversation_phones", "Phones with recent turns in the conversation store", (),
+               lambda: [((), len(conversation_store))])
+CallbackMetric("kodibot_chat_log_queue_depth", "Chat log rows waiting for the write-behind writer", (),
+               lambda: [((), chat_log_writer.stats()["queue_depth"])])
+CallbackMetric("kodibot_chat_log_dropped_total", "Chat log rows dropped because the write-behind queue was full", (),
+               lambda: [((), chat_log_writer.dropped)], type_name="counter")
+
+@app.on_event("shutdown")
+def flush_chat_logs():
+    """Write the chat logs still queued in the write-behind writer"""
+    chat_log_writer.stop()
+
+# Chat pipeline mode: "classic" (intent call + answer call) or "combined" (one LLM round trip)
+CHAT_PIPELINE = os.getenv("CHAT_PIPELINE", "classic").lower()
+
+# Intents the combined answer can be trusted for: the prefetch holds the profile and
+# tax totals only (parcel detail, procedures and E-Tax go through their handlers)
+COMBINED_ANSWER_INTENTS = {"greeting", "goodbye", "profile", "tax_info"}
+
+def _accept_combined_answer(intent: str, answer: Optional[str]) -> bool:
+    """Use the combined answer unless the prefetch does not cover the intent or a template answers it"""
+    return bool(answer) and intent in COMBINED_ANSWER_INTENTS and answer_mode(intent) != "template"
+
 @app.get("/")
 async def health_check():
     return {"status": "KodiBOT is running", "message": "Votre assistant WhatsApp pour tous vos services gouvernementaux"}
 
-@app.post('/chat', response_model=ChatResponse)
-async def chat(request: ChatRequest, db: Session = Depends(get_db)):
+@dataclass
+class PendingAnswer:
+    """Everything needed to generate (or stream) the LLM answer of a chat turn"""
+    citizen_id: str
+    intent: str
+    context_data: Optional[dict]
+    system_prompt: str
+    user_prompt: str
+    history: list  # Conversation history when the turn started (part of the answer cache key)
+
+# Outcome of the current chat request, read when deciding whether its reply can be replayed
+chat_outcome: ContextVar[Optional[str]] = ContextVar("chat_outcome", default=None)
+
+def _count_request(outcome: str):
+    chat_outcome.set(outcome)
+    CHAT_REQUESTS.inc(llm_endpoint.get(), llm_intent.get(), outcome)
+
+async def _reply(phone_number: str, response_message: Optional[str], db: AsyncSession,
+                 citizen_id: Optional[str] = None, outcome: str = "answered", **response_fields) -> ChatResponse:
+    """Log the outbound message and build the ChatResponse"""
+    with CHAT_STAGE_SECONDS.time("log_outbound"):
+        await AsyncLoggingService.log_message(
+            phone_number=phone_number,
+            message_text=response_message or "Erreur: Réponse vide",
+            direction="OUT",
+            citizen_id=citizen_id,
+            db=db
+        )
+    _count_request(outcome)
+    return ChatResponse(response=response_message, **response_fields)
+
+async def _chat_error(phone_number: str, db: AsyncSession) -> ChatResponse:
+    error_message = "Une erreur s'est produite. Veuillez réessayer."
+    
+    # Log error (reset the session first in case the failure came from the DB)
+    await db.rollback()
+    await AsyncLoggingService.log_message(
+        phone_number=phone_number,
+        message_text=error_message,
+        direction="OUT",
+        db=db
+    )
+    
+    _count_request("error")
+    return ChatResponse(error=error_message)
+
+async def _prepare_chat(phone_number: str, message_text: str, db: AsyncSession):
     """
-    Main chat endpoint following KodiBOT Detailed Chat Flow
+    Steps 1-8 of the KodiBOT chat flow, shared by /chat and /chat/stream
+    Returns a finished (logged) ChatResponse, or a PendingAnswer when the LLM must write the answer
     """
-    phone_number = request.phone_number
-    message_text = request.message
-    
-    try:
-        # Step 1 & 2: Receive Message & Extract & Log Inbound
-        inbound_log = LoggingService.log_message(
+    # Step 1 & 2: Receive Message & Extract & Log Inbound
+    with CHAT_STAGE_SECONDS.time("log_inbound"):
+        inbound_log = await AsyncLoggingService.log_message(
             phone_number=phone_number,
             message_text=message_text,
             direction="IN",
             db=db
         )
-        
-        # Step 3: Check Link Status
-        is_linked = AuthService.is_user_linked(phone_number, db)
-        
-        if not is_linked:
-            # Step 4a: KYC Onboarding for unlinked numbers
-            # Check if the message is a citizen ID to initiate linking
-            if message_text.strip().upper().startswith("CIT") and len(message_text.strip()) > 10:
-                citizen_id = message_text.strip().upper()
-                linking_result = AuthService.initiate_linking(phone_number, citizen_id, db)
-                
-                # Log the linking attempt
-                LoggingService.log_message(
-                    phone_number=phone_number,
-                    message_text=f"Tentative de liaison avec ID: {citizen_id}",
-                    direction="IN",
-                    db=db
-                )
-                
-                response_message = linking_result["message"]
-                
-                LoggingService.log_message(
-                    phone_number=phone_number,
-                    message_text=response_message,
-                    direction="OUT",
-                    db=db
-                )
-                
-                return ChatResponse(
-                    response=response_message,
-                    requires_linking=True
-                )
+    
+    # Step 3: Check Link Status
+    # One joined query (or an identity cache hit) gives link status and citizen
+    with CHAT_STAGE_SECONDS.time("link_check"):
+        linked_citizen = await AsyncAuthService.resolve_linked_citizen(phone_number, db)
+    
+    if linked_citizen is None:
+        # Step 4a: KYC Onboarding for unlinked numbers
+        # Check if the message is a citizen ID to initiate linking
+        if message_text.strip().upper().startswith("CIT") and len(message_text.strip()) > 10:
+            citizen_id = message_text.strip().upper()
+            linking_result = await AsyncAuthService.initiate_linking(phone_number, citizen_id, db)
+            
+            # Log the linking attempt
+            await AsyncLoggingService.log_message(
+                phone_number=phone_number,
+                message_text=f"Tentative de liaison avec ID: {citizen_id}",
+                direction="IN",
+                db=db
+            )
+            
+            return await _reply(phone_number, linking_result["message"], db, outcome="linking", requires_linking=True)
 
-            # Check if the message is an OTP for verification
-            if message_text.strip().isdigit() and len(message_text.strip()) == 6:
-                otp_code = message_text.strip()
-                verification_result = AuthService.verify_otp(phone_number, otp_code, db)
+        # Check if the message is an OTP for verification
+        if message_text.strip().isdigit() and len(message_text.strip()) == 6:
+            otp_code = message_text.strip()
+            verification_result = await AsyncAuthService.verify_otp(phone_number, otp_code, db)
 
-                # Log the OTP verification attempt
-                LoggingService.log_message(
-                    phone_number=phone_number,
-                    message_text=f"Tentative de vérification OTP: {'succès' if verification_result['success'] else 'échec'}",
-                    direction="IN",
-                    db=db
-                )
-                
-                response_message = verification_result["message"]
-                
-                LoggingService.log_message(
-                    phone_number=phone_number,
-                    message_text=response_message,
-                    direction="OUT",
-                    db=db
-                )
-                
-                return ChatResponse(
-                    response=response_message,
-                    requires_linking=not verification_result["success"]
-                )
-
-            # If not a citizen ID or OTP, ask for linking
-            response_message = kodibot.handle_linking_required()
-            
-            # Log outbound response
-            LoggingService.log_message(
+            # Log the OTP verification attempt
+            await AsyncLoggingService.log_message(
                 phone_number=phone_number,
-                message_text=response_message,
-                direction="OUT",
+                message_text=f"Tentative de vérification OTP: {'succès' if verification_result['success'] else 'échec'}",
+                direction="IN",
                 db=db
             )
             
-            return ChatResponse(
-                response=response_message,
-                requires_linking=True
+            return await _reply(
+                phone_number, verification_result["message"], db, outcome="linking",
+                requires_linking=not verification_result["success"]
             )
-        
-        # Get citizen information for linked user
-        citizen = AuthService.get_citizen_by_phone(phone_number, db)
-        if not citizen:
-            return ChatResponse(error="Erreur: Utilisateur lié mais citoyen non trouvé")
-        
-        # Step 5: Intent Extraction
-        intent_result = get_intent(message_text)
-        intent = intent_result["intent"]
-        confidence = intent_result["confidence"]
-        slots = intent_result.get("slots", {})
-        
-        # Update inbound log with intent and confidence
-        inbound_log.intent = intent
-        inbound_log.confidence = confidence
-        db.commit()
-        
-        # Step 6: Confidence Check
-        if confidence < 0.6 or intent == "fallback":
-            fallback_message = """
+
+        # If not a citizen ID or OTP, ask for linking
+        return await _reply(phone_number, kodibot.handle_linking_required(), db, outcome="linking", requires_linking=True)
+    
+    # Get citizen information for linked user
+    if not linked_citizen.citizen_found:
+        _count_request("error")
+        return ChatResponse(error="Erreur: Utilisateur lié mais citoyen non trouvé")
+    
+    citizen_id = linked_citizen.citizen_id
+    citizen_name = linked_citizen.full_name
+    
+    # Step 5: Intent Extraction
+    combined_answer = None
+    if CHAT_PIPELINE == "combined":
+        # The local classifier and the intent memo are free: the combined call only runs on a miss
+        with CHAT_STAGE_SECONDS.time("intent"):
+            intent_result = classify_without_llm(message_text)
+        if intent_result is None:
+            # Single round trip: prefetch cheap citizen context, get intent + answer together
+            with CHAT_STAGE_SECONDS.time("data_fetch"):
+                prefetched = await AsyncDataService.get_prefetch_context(citizen_id, db)
+            with CHAT_STAGE_SECONDS.time("prompt_build"):
+                combined_prompt = build_combined_prompt(
+                    citizen_name=citizen_name,
+                    citizen_id=citizen_id,
+                    context_data=prefetched,
+                    categories=INTENT_CATEGORIES
+                )
+            with CHAT_STAGE_SECONDS.time("intent"):
+                intent_result = await get_intent_and_answer_async(message_text, combined_prompt)
+            combined_answer = intent_result.get("answer")
+    else:
+        with CHAT_STAGE_SECONDS.time("intent"):
+            intent_result = await get_intent_async(message_text)
+    
+    intent = intent_result["intent"]
+    confidence = intent_result["confidence"]
+    slots = intent_result.get("slots", {})
+    set_llm_context(intent=intent)
+    
+    # Update inbound log with intent and confidence
+    await AsyncLoggingService.update_intent(inbound_log, intent, confidence, db, source=intent_result.get("source"))
+    
+    # Step 6: Confidence Check
+    if confidence < 0.6 or intent == "fallback":
+        fallback_message = """
 Je ne comprends pas bien votre demande. 
 Voici ce que je peux vous aider à faire:
 
@@ -160,158 +263,426 @@ Voici ce que je peux vous aider à faire:
 📋 **Procédures**: "Comment renouveler mon permis?"
 
 Reformulez votre question ou choisissez une option ci-dessus.
-            """
-            
-            LoggingService.log_message(
-                phone_number=phone_number,
-                message_text=fallback_message.strip(),
-                direction="OUT",
-                db=db
-            )
-            
-            return ChatResponse(response=fallback_message.strip())
-        
-        # Handle basic intents
-        if intent == "greeting":
-            response_message = kodibot.handle_greeting()
-        elif intent == "goodbye":
-            response_message = kodibot.handle_goodbye()
-        else:
-            # Step 7: Fetch Data by Intent
-            context_data = None
-            
-            if intent in INTENT_HANDLERS:
-                handler = INTENT_HANDLERS[intent]
-                context_data = handler(citizen.citizen_id, db, slots)
-            
-            if not context_data and intent != "procedures":
-                response_message = "Désolé, je n'ai pas pu récupérer ces informations pour le moment."
-            else:
-                # Step 8: Assemble LLM Prompt using centralized prompt system
-                system_prompt = build_contextualized_prompt(
-                    citizen_name=f"{citizen.first_name} {citizen.last_name}",
-                    citizen_id=str(citizen.citizen_id),
-                    context_data=context_data or {}
-                )
-                
-                user_prompt = f"Requête utilisateur: {message_text}"
-                
-                # Step 9: Generate LLM Response
-                response_message = generate_answer(user_prompt, system_prompt)
+        """
         
-        # Step 10: Return & Log Outbound
-        LoggingService.log_message(
-            phone_number=phone_number,
-            message_text=response_message or "Erreur: Réponse vide",
-            direction="OUT",
-            citizen_id=str(citizen.citizen_id) if citizen else "",
-            db=db
+        return await _reply(phone_number, fallback_message.strip(), db, outcome="fallback")
+    
+    # Handle basic intents
+    if _accept_combined_answer(intent, combined_answer):
+        return await _reply(phone_number, combined_answer, db, citizen_id=citizen_id, outcome="combined")
+    if intent == "greeting":
+        return await _reply(phone_number, kodibot.handle_greeting(), db, citizen_id=citizen_id, outcome="canned")
+    if intent == "goodbye":
+        return await _reply(phone_number, kodibot.handle_goodbye(), db, citizen_id=citizen_id, outcome="canned")
+    
+    # Step 7: Fetch Data by Intent
+    context_data = None
+    
+    if intent in ASYNC_INTENT_HANDLERS:
+        handler = ASYNC_INTENT_HANDLERS[intent]
+        with CHAT_STAGE_SECONDS.time("data_fetch"):
+            context_data = await handler(citizen_id, db, slots)
+    
+    if not context_data and intent != "procedures":
+        return await _reply(
+            phone_number, "Désolé, je n'ai pas pu récupérer ces informations pour le moment.", db,
+            citizen_id=citizen_id, outcome="no_data"
         )
+    
+    user_prompt = f"Requête utilisateur: {message_text}"
+    
+    # Data-lookup intents can be rendered from a template: instant, exact amounts
+    mode = answer_mode(intent)
+    if mode == "template":
+        with CHAT_STAGE_SECONDS.time("template"):
+            templated = render_answer(intent, context_data, citizen_name)
+        if templated is not None:
+            conversation_store.record_exchange(phone_number, user_prompt, templated)
+            return await _reply(phone_number, templated, db, citizen_id=citizen_id, outcome="template")
+    
+    # Cached answer is reused while the citizen data and the conversation behind it are unchanged
+    history = conversation_store.history(phone_number)
+    cached_answer = get_cached_answer(citizen_id, intent, message_text, context_data, history)
+    if cached_answer is not None:
+        conversation_store.record_exchange(phone_number, user_prompt, cached_answer)
+        return await _reply(phone_number, cached_answer, db, citizen_id=citizen_id, outcome="cached")
+    
+    # Hybrid: the LLM only writes a lead sentence, the template carries the figures
+    if mode == "hybrid":
+        with CHAT_STAGE_SECONDS.time("template"):
+            templated = render_answer(intent, context_data, citizen_name)
+        if templated is not None:
+            with CHAT_STAGE_SECONDS.time("llm"):
+                lead = await generate_lead_async(message_text, build_lead_prompt(citizen_name))
+            hybrid_answer = f"{lead}\n\n{templated}" if lead else templated
+            cache_answer(citizen_id, intent, message_text, context_data, hybrid_answer, history)
+            conversation_store.record_exchange(phone_number, user_prompt, hybrid_answer)
+            return await _reply(phone_number, hybrid_answer, db, citizen_id=citizen_id, outcome="hybrid")
+    
+    # Step 8: Assemble LLM Prompt using centralized prompt system
+    with CHAT_STAGE_SECONDS.time("prompt_build"):
+        system_prompt = build_contextualized_prompt(
+            citizen_name=citizen_name,
+            citizen_id=citizen_id,
+            context_data=context_data or {}
+        )
+    
+    return PendingAnswer(
+        citizen_id=citizen_id,
+        intent=intent,
+        context_data=context_data,
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        history=history
+    )
+
+async def _run_chat(phone_number: str, message_text: str, db: AsyncSession) -> ChatResponse:
+    try:
+        prepared = await _prepare_chat(phone_number, message_text, db)
+        if isinstance(prepared, ChatResponse):
+            return prepared
         
-        return ChatResponse(response=response_message)
+        # Step 9: Generate LLM Response
+        with CHAT_STAGE_SECONDS.time("llm"):
+            response_message = await generate_answer_async(
+                prepared.user_prompt, prepared.system_prompt, phone_number=phone_number
+            )
+        cache_answer(prepared.citizen_id, prepared.intent, message_text, prepared.context_data,
+                     response_message, prepared.history)
         
-    except Exception as e:
-        error_message = "Une erreur s'est produite. Veuillez réessayer."
+        # Step 10: Return & Log Outbound
+        return await _reply(phone_number, response_message, db, citizen_id=prepared.citizen_id,
+                            outcome="degraded" if is_degraded_answer(response_message) else "answered")
         
-        # Log error
-        LoggingService.log_message(
-            phone_number=phone_number,
-            message_text=error_message,
-            direction="OUT",
-            db=db
-        )
+    except Exception as e:
+        return await _chat_error(phone_number, db)
+
+def _stored_reply(reply_key: tuple) -> Optional[ChatResponse]:
+    """Reply already sent for this message (gateway retry or double send)"""
+    stored = get_stored_reply(reply_key)
+    if stored is None:
+        return None
+    _count_request("duplicate")
+    return ChatResponse(**stored)
+
+@app.post('/chat', response_model=ChatResponse)
+async def chat(request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Main chat endpoint following KodiBOT Detailed Chat Flow
+    Runs fully async (AsyncSession + AsyncOpenAI) so LLM calls never block the worker
+    Messages of one phone are handled one at a time; redelivered messages get the stored reply
+    """
+    phone_number = request.phone_number
+    message_text = request.message
+    reply_key = idempotency_key(phone_number, message_text, request.message_id)
+    set_llm_context(endpoint="/chat")
+    
+    with CHAT_REQUEST_SECONDS.time("/chat"):
+        async with phone_locks.hold(phone_number):
+            stored = _stored_reply(reply_key)
+            if stored is not None:
+                return stored
+            
+            response = await _run_chat(phone_number, message_text, db)
+            store_reply(reply_key, response.dict(), chat_outcome.get())
+            return response
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+STREAM_INTERRUPTED_MESSAGE = "La réponse a été interrompue. Veuillez réessayer."
+
+@app.post('/chat/stream')
+async def chat_stream(request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Streaming variant of /chat (Server-Sent Events)
+    Same linking, intent and data steps; the LLM answer is sent as "delta" events
+    while it is generated, then a "done" event carries the final ChatResponse
+    """
+    phone_number = request.phone_number
+    message_text = request.message
+    reply_key = idempotency_key(phone_number, message_text, request.message_id)
+    set_llm_context(endpoint="/chat/stream")
+    started = time.perf_counter()
+    
+    # The phone lock is held until the streamed answer is logged; release() runs once,
+    # from the stream or from the background task if the stream never completes
+    await phone_locks.acquire(phone_number)
+    released = False
+    
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            phone_locks.release(phone_number)
+    
+    try:
+        prepared = _stored_reply(reply_key)
+        if prepared is None:
+            try:
+                prepared = await _prepare_chat(phone_number, message_text, db)
+            except Exception as e:
+                prepared = await _chat_error(phone_number, db)
+            if isinstance(prepared, ChatResponse):
+                store_reply(reply_key, prepared.dict(), chat_outcome.get())
+    except BaseException:
+        release()
+        raise
+    
+    if isinstance(prepared, ChatResponse):
+        release()
+        CHAT_REQUEST_SECONDS.observe(time.perf_counter() - started, "/chat/stream")
         
-        return ChatResponse(error=error_message)
+        async def single_event():
+            yield _sse("done", prepared.dict())
+        return StreamingResponse(single_event(), media_type="text/event-stream", headers=SSE_HEADERS)
+    
+    async def answer_events():
+        # Always ends with a "done" event, with error set when the answer is incomplete or failed
+        final = None
+        try:
+            chunks = []
+            interrupted = False
+            try:
+                with CHAT_STAGE_SECONDS.time("llm"):
+                    async for chunk in stream_answer_async(prepared.user_prompt, prepared.system_prompt, phone_number=phone_number):
+                        chunks.append(chunk)
+                        yield _sse("delta", {"content": chunk})
+            except StreamInterrupted:
+                interrupted = True
+            
+            response_message = "".join(chunks)
+            # The request session is closed once the response starts: log with a fresh one
+            async with AsyncSessionLocal() as log_db:
+                if interrupted:
+                    # The truncated text is neither cached nor replayed
+                    final = await _reply(phone_number, response_message, log_db, citizen_id=prepared.citizen_id,
+                                         outcome="interrupted", error=STREAM_INTERRUPTED_MESSAGE)
+                else:
+                    cache_answer(prepared.citizen_id, prepared.intent, message_text, prepared.context_data,
+                                 response_message, prepared.history)
+                    final = await _reply(phone_number, response_message, log_db, citizen_id=prepared.citizen_id,
+                                         outcome="degraded" if is_degraded_answer(response_message) else "answered")
+                    store_reply(reply_key, final.dict(), chat_outcome.get())
+        except Exception as e:
+            print(f"❌ Error while streaming the answer: {e}")
+            try:
+                async with AsyncSessionLocal() as log_db:
+                    final = await _chat_error(phone_number, log_db)
+            except Exception as log_error:
+                print(f"❌ Error while logging the stream failure: {log_error}")
+                _count_request("error")
+                final = ChatResponse(error="Une erreur s'est produite. Veuillez réessayer.")
+        finally:
+            release()
+        CHAT_REQUEST_SECONDS.observe(time.perf_counter() - started, "/chat/stream")
+        yield _sse("done", final.dict())
+    
+    return StreamingResponse(
+        answer_events(), media_type="text/event-stream", headers=SSE_HEADERS,
+        background=BackgroundTask(release)
+    )
 
 @app.post('/link-account', response_model=LinkingResponse)
 async def link_account(request: LinkingRequest, db: Session = Depends(get_db)):
     """
     Step 4b: Initiate account linking with Citizen ID
     """
-    try:
-        result = AuthService.initiate_linking(
-            phone_number=request.phone_number,
-            citizen_id=request.citizen_id,
-            db=db
-        )
-        
-        # Log the linking attempt
-        LoggingService.log_message(
-            phone_number=request.phone_number,
-            message_text=f"Demande de liaison avec ID: {request.citizen_id}",
-            direction="IN",
-            db=db
-        )
-        
-        if result["success"]:
-            response_msg = f"Code OTP envoyé! Veuillez entrer le code reçu par SMS. (Test: {result['otp']})"
+    # Serialized with /chat for the same phone (OTP state)
+    async with phone_locks.hold(request.phone_number):
+        try:
+            result = AuthService.initiate_linking(
+                phone_number=request.phone_number,
+                citizen_id=request.citizen_id,
+                db=db
+            )
+            
+            # Log the linking attempt
             LoggingService.log_message(
                 phone_number=request.phone_number,
-                message_text=response_msg,
-                direction="OUT",
+                message_text=f"Demande de liaison avec ID: {request.citizen_id}",
+                direction="IN",
                 db=db
             )
-        
-        return LinkingResponse(**result)
-        
-    except Exception as e:
-        return LinkingResponse(
-            success=False,
-            message="Erreur lors de la liaison du compte"
-        )
+            
+            if result["success"]:
+                response_msg = f"Code OTP envoyé! Veuillez entrer le code reçu par SMS. (Test: {result['otp']})"
+                LoggingService.log_message(
+                    phone_number=request.phone_number,
+                    message_text=response_msg,
+                    direction="OUT",
+                    db=db
+                )
+            
+            return LinkingResponse(**result)
+            
+        except Exception as e:
+            return LinkingResponse(
+                success=False,
+                message="Erreur lors de la liaison du compte"
+            )
 
 @app.post('/verify-otp', response_model=LinkingResponse)
 async def verify_otp(request: OTPVerificationRequest, db: Session = Depends(get_db)):
     """
     Verify OTP and complete account linking
     """
-    try:
-        result = AuthService.verify_otp(
-            phone_number=request.phone_number,
-            otp_code=request.otp_code,
-            db=db
-        )
-        
-        # Log verification attempt
-        LoggingService.log_message(
-            phone_number=request.phone_number,
-            message_text=f"Vérification OTP: {request.otp_code}",
-            direction="IN",
-            db=db
-        )
-        
-        response_msg = result["message"]
-        if result["success"]:
-            response_msg += " Vous pouvez maintenant poser vos questions!"
-        
-        LoggingService.log_message(
-            phone_number=request.phone_number,
-            message_text=response_msg,
-            direction="OUT",
-            db=db
-        )
-        
-        return LinkingResponse(
-            success=result["success"],
-            message=response_msg
-        )
-        
-    except Exception as e:
-        return LinkingResponse(
-            success=False,
-            message="Erreur lors de la vérification OTP"
-        )
+    # Serialized with /chat for the same phone (OTP state)
+    async with phone_locks.hold(request.phone_number):
+        try:
+            result = AuthService.verify_otp(
+                phone_number=request.phone_number,
+                otp_code=request.otp_code,
+                db=db
+            )
+            
+            # Log verification attempt
+            LoggingService.log_message(
+                phone_number=request.phone_number,
+                message_text=f"Vérification OTP: {request.otp_code}",
+                direction="IN",
+                db=db
+            )
+            
+            response_msg = result["message"]
+            if result["success"]:
+                response_msg += " Vous pouvez maintenant poser vos questions!"
+            
+            LoggingService.log_message(
+                phone_number=request.phone_number,
+                message_text=response_msg,
+                direction="OUT",
+                db=db
+            )
+            
+            return LinkingResponse(
+                success=result["success"],
+                message=response_msg
+            )
+            
+        except Exception as e:
+            return LinkingResponse(
+                success=False,
+                message="Erreur lors de la vérification OTP"
+            )
+
+KCAF_WRITE_MODES = ("create", "upsert")
+
+def _check_kcaf_mode(mode: str):
+    if mode not in KCAF_WRITE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode doit être l'un de: {', '.join(KCAF_WRITE_MODES)}")
 
 @app.post('/kcaf-records', response_model=KCAF_RecordResponse, status_code=201)
-async def create_kcaf_record_endpoint(record: KCAF_RecordCreate, db: Session = Depends(get_db)):
+async def create_kcaf_record_endpoint(record: KCAF_RecordCreate, response: Response, mode: str = "create",
+                                      idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
     """
     Create a new K-CAF record for a specific parcel.
+    mode=upsert updates an existing record when the submission is newer (client_version / updated_at);
+    an unversioned submission identical to the stored record leaves it unchanged;
+    the Idempotency-Key header (or idempotency_token) makes a resent submission a no-op.
     """
+    _check_kcaf_mode(mode)
+    if record.idempotency_token is None:
+        record.idempotency_token = idempotency_key
+    
+    if mode == "upsert":
+        status = DataService.upsert_kcaf_records([(0, record)], db)[0]["status"]
+        response.headers["X-Upsert-Status"] = status
+        if status != "created":
+            response.status_code = 200
+        return DataService.get_kcaf_record_by_parcel(parcel_number=record.parcel_number, db=db)
+    
     db_record = DataService.create_kcaf_record(record_data=record, db=db)
     if db_record is None:
         raise HTTPException(status_code=409, detail="K-CAF record already exists for this parcel")
     return db_record
 
+# Records validated and inserted per multi-row INSERT / commit
+KCAF_BULK_CHUNK_SIZE = int(os.getenv("KCAF_BULK_CHUNK_SIZE", "500"))
+
+async def _kcaf_bulk_items(request: Request):
+    """
+    Yield (index, raw item) from a JSON array body, or from an NDJSON body as it streams in
+    Unparseable NDJSON lines are yielded as a ValueError
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" not in content_type and "jsonl" not in content_type:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Corps JSON invalide")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Le corps doit être un tableau JSON ou du NDJSON")
+        for index, item in enumerate(items):
+            yield index, item
+        return
+    
+    index = 0
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield index, _parse_ndjson_line(line)
+                index += 1
+    if buffer.strip():
+        yield index, _parse_ndjson_line(buffer)
+
+def _parse_ndjson_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f"JSON invalide: {e}")
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors())
+
+@app.post('/kcaf-records/bulk', response_model=KCAF_BulkResponse)
+async def bulk_create_kcaf_records_endpoint(request: Request, mode: str = "create", db: Session = Depends(get_db)):
+    """
+    Create many K-CAF records in one call (collector sync)
+    Body: a JSON array of K-CAF records, or NDJSON (Content-Type: application/x-ndjson)
+    Rows are validated and inserted in chunks; each one is reported as created, duplicate or invalid
+    (mode=upsert: created, updated, unchanged, duplicate or invalid)
+    """
+    _check_kcaf_mode(mode)
+    write_chunk = DataService.upsert_kcaf_records if mode == "upsert" else DataService.bulk_create_kcaf_records
+    results = []
+    chunk = []
+    
+    async def insert_chunk():
+        results.extend(await run_in_threadpool(write_chunk, list(chunk), db))
+        chunk.clear()
+    
+    async for index, item in _kcaf_bulk_items(request):
+        if isinstance(item, ValueError):
+            results.append({"index": index, "status": "invalid", "error": str(item)})
+            continue
+        if not isinstance(item, dict):
+            results.append({"index": index, "status": "invalid", "error": "Chaque élément doit être un objet JSON"})
+            continue
+        try:
+            chunk.append((index, KCAF_RecordCreate(**item)))
+        except ValidationError as e:
+            results.append({
+                "index": index, "parcel_number": item.get("parcel_number"),
+                "status": "invalid", "error": _validation_message(e)
+            })
+        if len(chunk) >= KCAF_BULK_CHUNK_SIZE:
+            await insert_chunk()
+    if chunk:
+        await insert_chunk()
+    
+    results.sort(key=lambda result: result["index"])
+    counts = {status: 0 for status in ("created", "updated", "unchanged", "duplicate", "invalid")}
+    for result in results:
+        counts[result["status"]] += 1
+    return {"total": len(results), **counts, "results": results}
+
 @app.get('/kcaf-records/{parcel_number}', response_model=KCAF_RecordResponse)
 async def get_kcaf_record_endpoint(parcel_number: str, db: Session = Depends(get_db)):
     """
@@ -333,56 +704,155 @@ async def get_etax_status_endpoint(citizen_id: str, db: Session = Depends(get_db
     return etax_data
 
 @app.get('/analytics/popular-intents')
-async def get_popular_intents(db: Session = Depends(get_db)):
+async def get_popular_intents(hours: Optional[int] = None, db: Session = Depends(get_db)):
     """
     Get analytics on most popular intents (Step 12: Logging analysis)
+    Read from the hourly chat_log_rollups (all time, or the last `hours` hours)
     """
+    return {"popular_intents": popular_intents(db, hours=hours)}
+
+ANALYTICS_WINDOWS = {"24h": 24, "7d": 24 * 7, "30d": 24 * 30}
+
+@app.get('/analytics/intents')
+async def get_intent_window(window: str = "24h", db: Session = Depends(get_db)):
+    """Inbound messages, fallbacks and mean confidence per intent over 24h / 7d / 30d (from the rollups)"""
+    if window not in ANALYTICS_WINDOWS:
+        raise HTTPException(status_code=400, detail="window doit être 24h, 7d ou 30d")
+    return {"window": window, **intent_summary(db, ANALYTICS_WINDOWS[window])}
+
+@app.get('/analytics/intents/daily')
+async def get_daily_intents(days: int = 7, db: Session = Depends(get_db)):
+    """Messages per UTC day with the inbound intent breakdown (from the rollups)"""
+    if not 1 <= days <= 366:
+        raise HTTPException(status_code=400, detail="days doit être entre 1 et 366")
+    return {"days": daily_intents(db, days)}
+
+@app.get('/analytics/llm-usage')
+async def get_llm_usage(group_by: str = "intent", persisted: bool = False, hours: int = 24,
+                        db: Session = Depends(get_db)):
+    """
+    OpenAI tokens, latency and cost per intent / endpoint / operation / model
+    In-memory aggregates since startup, or the llm_usage table (LLM_USAGE_PERSIST=true) with persisted=true
+    """
+    if group_by not in ("endpoint", "intent", "operation", "model"):
+        raise HTTPException(status_code=400, detail="group_by doit être endpoint, intent, operation ou model")
+    
+    if not persisted:
+        return llm_usage.summary(group_by)
+    
+    from datetime import datetime, timedelta
     from sqlalchemy import func
-    from src.database import ChatLogs
+    from src.database import LLMUsage
     
+    column = getattr(LLMUsage, group_by)
     results = db.query(
-        ChatLogs.intent,
-        func.count(ChatLogs.intent).label('count')
+        column.label("name"),
+        func.count(LLMUsage.id).label("calls"),
+        func.sum(LLMUsage.prompt_tokens).label("prompt_tokens"),
+        func.sum(LLMUsage.completion_tokens).label("completion_tokens"),
+        func.sum(LLMUsage.cached_tokens).label("cached_tokens"),
+        func.sum(LLMUsage.cost_usd).label("cost_usd"),
+        func.avg(LLMUsage.latency_ms).label("avg_latency_ms")
     ).filter(
-        ChatLogs.intent.isnot(None),
-        ChatLogs.direction == "IN"
-    ).group_by(
-        ChatLogs.intent
-    ).order_by(
-        func.count(ChatLogs.intent).desc()
-    ).limit(10).all()
+        LLMUsage.created_at >= datetime.utcnow() - timedelta(hours=hours)
+    ).group_by(column).order_by(func.sum(LLMUsage.cost_usd).desc()).all()
     
     return {
-        "popular_intents": [
-            {"intent": result.intent, "count": result.count}
+        "group_by": group_by,
+        "hours": hours,
+        "groups": [
+            {
+                group_by: result.name,
+                "calls": result.calls,
+                "prompt_tokens": result.prompt_tokens or 0,
+                "completion_tokens": result.completion_tokens or 0,
+                "cached_tokens": result.cached_tokens or 0,
+                "cost_usd": round(result.cost_usd or 0.0, 6),
+                "avg_latency_ms": round(result.avg_latency_ms or 0.0, 2)
+            }
             for result in results
         ]
     }
 
+@app.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus scrape endpoint: chat stage timings, request outcomes, DB queries, LLM calls
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get('/cache/stats')
+async def get_cache_stats():
+    """
+    Hit/miss statistics of the in-process caches
+    """
+    return {"caches": [cache.stats() for cache in CACHES], "conversations": conversation_store.stats()}
+
+@app.get('/analytics/prompt-context')
+async def get_prompt_context_stats():
+    """
+    Token savings of the compact context serializer since startup
+    """
+    return serializer_stats()
+
+@app.get('/logs/writer-stats')
+async def get_log_writer_stats():
+    """
+    Queue depth and throughput of the write-behind chat log writer
+    """
+    return chat_log_writer.stats()
+
+# Keyset pagination for the citizen listings: one query per chunk, streamed as it is read
+DIRECTORY_CHUNK_SIZE = 200
+DIRECTORY_MAX_LIMIT = 5000
+
+def _check_page(limit: int, after: int):
+    if not 1 <= limit <= DIRECTORY_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit doit être entre 1 et {DIRECTORY_MAX_LIMIT}")
+    if after < 0:
+        raise HTTPException(status_code=400, detail="after doit être positif")
+
+def _stream_citizen_page(head: dict, key: str, after: int, limit: int, serialize, first_chunk):
+    """
+    Stream {**head, key: [...], "next_cursor": id | null} chunk by chunk
+    first_chunk was read by the endpoint (so connection errors still get a normal response);
+    the following chunks use their own session, the request one is closed once streaming starts
+    """
+    opening = json.dumps(head, ensure_ascii=False)[:-1]
+    yield f'{opening}{", " if head else ""}"{key}": ['
+    
+    db = SessionLocal()
+    try:
+        chunk, sent, last_id = first_chunk, 0, after
+        while chunk:
+            items = ",".join(json.dumps(serialize(row), ensure_ascii=False) for row in chunk)
+            yield ("," if sent else "") + items
+            sent += len(chunk)
+            last_id = chunk[-1].id
+            if len(chunk) < DIRECTORY_CHUNK_SIZE or sent >= limit:
+                break
+            chunk = DataService.get_citizen_directory_page(last_id, min(DIRECTORY_CHUNK_SIZE, limit - sent), db)
+        
+        next_cursor = last_id if sent >= limit and DataService.has_citizens_after(last_id, db) else None
+    except Exception as e:
+        # Headers are already sent: end the document so clients can still parse the rows received
+        print(f"❌ Citizen listing interrupted after {last_id}: {e}")
+        next_cursor = last_id
+    finally:
+        db.close()
+    yield f'], "next_cursor": {json.dumps(next_cursor)}, "limit": {limit}}}'
+
 @app.get('/debug-db')
-async def debug_database(db: Session = Depends(get_db)):
+async def debug_database(limit: int = 100, after: int = 0, db: Session = Depends(get_db)):
     """
     Debug endpoint to test database connectivity
+    Citizens are paginated by id: pass the returned next_cursor as `after` for the next page
     """
+    _check_page(limit, after)
     try:
         # Simple query to test database
         citizen_count = db.query(Citizens).count()
-        all_citizens = db.query(Citizens).all()
-        
-        citizens_info = []
-        for citizen in all_citizens:
-            citizens_info.append({
-                "name": f"{citizen.first_name} {citizen.last_name}",
-                "phone": citizen.phone_number,
-                "citizen_id": citizen.citizen_id,
-                "address": citizen.address
-            })
-        
-        return {
-            "status": "success",
-            "citizen_count": citizen_count,
-            "citizens": citizens_info
-        }
+        first_chunk = DataService.get_citizen_directory_page(after, min(DIRECTORY_CHUNK_SIZE, limit), db)
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -391,42 +861,30 @@ async def debug_database(db: Session = Depends(get_db)):
             "error": str(e),
             "traceback": error_trace
         }
+    
+    def serialize(citizen):
+        return {
+            "name": f"{citizen.first_name} {citizen.last_name}",
+            "phone": citizen.phone_number,
+            "citizen_id": citizen.citizen_id,
+            "address": citizen.address
+        }
+    
+    head = {"status": "success", "citizen_count": citizen_count}
+    return StreamingResponse(
+        _stream_citizen_page(head, "citizens", after, limit, serialize, first_chunk),
+        media_type="application/json"
+    )
 
 @app.get('/test-users')
-async def get_test_users(db: Session = Depends(get_db)):
+async def get_test_users(limit: int = 500, after: int = 0, db: Session = Depends(get_db)):
     """
     Get test users from database for the chat interface
+    Paginated by citizen id (next_cursor -> `after`); link status comes from the same query
     """
+    _check_page(limit, after)
     try:
-        # Get all citizens
-        citizens = db.query(Citizens).all()
-        
-        test_users = []
-        for citizen in citizens:
-            # Check if citizen is linked
-            linked_user = db.query(LinkedUsers).filter(
-                LinkedUsers.citizen_id == citizen.citizen_id
-            ).first()
-            
-            # Extract city from address
-            city = "RDC"
-            address_str = getattr(citizen, 'address', None)
-            if address_str and isinstance(address_str, str) and ',' in address_str:
-                parts = address_str.split(',')
-                if len(parts) >= 2:
-                    city = parts[-2].strip()
-            
-            test_users.append({
-                "phone_number": citizen.phone_number,
-                "citizen_id": citizen.citizen_id,
-                "name": f"{citizen.first_name} {citizen.last_name}",
-                "address": citizen.address,
-                "is_linked": linked_user is not None and linked_user.is_linked if linked_user else False,
-                "description": f"Citoyen de {city}"
-            })
-        
-        return {"test_users": test_users}
-    
+        first_chunk = DataService.get_citizen_directory_page(after, min(DIRECTORY_CHUNK_SIZE, limit), db)
     except Exception as e:
         import traceback
         print(f"Error in test-users endpoint: {str(e)}")
@@ -437,10 +895,24 @@ async def get_test_users(db: Session = Depends(get_db)):
             "test_users": [],
             "error": f"Erreur: {str(e)}"
         }
+    
+    def serialize(citizen):
+        return {
+            "phone_number": citizen.phone_number,
+            "citizen_id": citizen.citizen_id,
+            "name": f"{citizen.first_name} {citizen.last_name}",
+            "address": citizen.address,
+            "is_linked": bool(citizen.is_linked),
+            "description": f"Citoyen de {DataService.city_from_address(citizen.address)}"
+        }
+    
+    return StreamingResponse(
+        _stream_citizen_page({}, "test_users", after, limit, serialize, first_chunk),
+        media_type="application/json"
+    )
 
 if __name__ == "__main__":
     import uvicorn
-    import os
     
     # Get configuration from environment variables
     host = os.getenv("HOST", "0.0.0.0")
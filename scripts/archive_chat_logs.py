@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+KodiBOT Chat Log Archival
+Moves chat_logs older than the retention period into the gzip JSON Lines archive
+(run it daily, e.g. from cron), or scans archived days.
+
+    python scripts/archive_chat_logs.py                       # archive days older than CHAT_LOG_RETENTION_DAYS
+    python scripts/archive_chat_logs.py --retention-days 7 --dry-run
+    python scripts/archive_chat_logs.py --scan 2025-01-01 --phone +243842616809
+"""
+
+import sys
+import os
+import argparse
+import json
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import create_tables, SessionLocal
+from src.archive import ChatLogArchive, CHAT_LOG_RETENTION_DAYS, CHAT_LOG_ARCHIVE_DIR
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Archive old chat_logs or scan the archive")
+    parser.add_argument("--retention-days", type=int, default=CHAT_LOG_RETENTION_DAYS,
+                        help="Whole days older than this are archived")
+    parser.add_argument("--archive-dir", default=CHAT_LOG_ARCHIVE_DIR)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the rows that would be archived")
+    parser.add_argument("--scan", metavar="DAY", help="Print archived rows from DAY (YYYY-MM-DD) as JSON lines")
+    parser.add_argument("--until", metavar="DAY", help="Last day scanned (defaults to --scan)")
+    parser.add_argument("--phone", help="Only rows of this phone number (with --scan)")
+    return parser.parse_args()
+
+def scan(archive: ChatLogArchive, args):
+    for record in archive.iter_archived(args.scan, args.until or args.scan, phone_number=args.phone):
+        print(json.dumps(record, ensure_ascii=False))
+
+def main():
+    args = parse_args()
+    archive = ChatLogArchive(args.archive_dir)
+    if args.scan:
+        scan(archive, args)
+        return
+
+    print("🗄️  KodiBOT Chat Log Archival")
+    print("=" * 60)
+    create_tables()
+    db = SessionLocal()
+    try:
+        moved = archive.archive_older_than(db, args.retention_days, dry_run=args.dry_run)
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Archival failed: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+    verb = "Would archive" if args.dry_run else "Archived"
+    for day, count in moved.items():
+        print(f"  {day}: {count} rows")
+    print(f"✅ {verb} {sum(moved.values())} rows over {len(moved)} day(s)")
+    print(f"📦 Archive: {json.dumps(archive.stats(), ensure_ascii=False)}")
+
+if __name__ == "__main__":
+    main()
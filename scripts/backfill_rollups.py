@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+KodiBOT Analytics Rollups Backfill
+Rebuilds chat_log_rollups from the chat_logs history (safe to re-run).
+Only closed hours are rebuilt, so it can run while chat traffic is being
+written; the current hour is left to the live rollup updates.
+"""
+
+import sys
+import os
+import argparse
+import time
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import create_tables, SessionLocal
+from src.rollups import backfill_rollups
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rebuild chat_log_rollups from chat_logs")
+    parser.add_argument("--batch-size", type=int, default=10000, help="chat_logs rows fetched per round trip")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    print("📊 KodiBOT Analytics Rollups Backfill")
+    print("=" * 60)
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        counted = backfill_rollups(db, batch_size=args.batch_size)
+        print(f"✅ Rolled up {counted} chat logs in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Backfill failed: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
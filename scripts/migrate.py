@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+KodiBOT Schema Migrations
+Applies pending migrations to DATABASE_URL (the API also runs them at startup)
+
+    python scripts/migrate.py            # upgrade to the latest version
+    python scripts/migrate.py --status   # list migrations and when they were applied
+"""
+
+import sys
+import os
+import argparse
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import Base, engine, check_upsert_support
+from src.migrations import migration_status, run_migrations
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Apply KodiBOT schema migrations")
+    parser.add_argument("--status", action="store_true", help="Only show the migration status")
+    parser.add_argument("--target", type=int, default=None, help="Stop after this version")
+    return parser.parse_args()
+
+def print_status():
+    for item in migration_status(engine):
+        applied = item["applied_at"] or "pending"
+        print(f"  {item['version']:>4}  {item['name']:<60} {applied}")
+
+def main():
+    args = parse_args()
+    print("🧱 KodiBOT Schema Migrations")
+    print("=" * 60)
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+
+    if not args.status:
+        # Tables added since the database was created, then the versioned changes
+        try:
+            check_upsert_support(engine)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        Base.metadata.create_all(bind=engine)
+        try:
+            applied = run_migrations(engine, target=args.target)
+        except Exception:
+            sys.exit(1)
+        print(f"✅ {len(applied)} migration(s) applied")
+
+    print_status()
+
+if __name__ == "__main__":
+    main()
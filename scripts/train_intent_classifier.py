@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+KodiBOT Local Intent Classifier Training
+Fits the character n-gram classifier on classified inbound chat_logs and saves the artifact
+"""
+
+import sys
+import os
+import argparse
+import random
+import time
+from collections import Counter
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import SessionLocal
+from src.intent_classifier import (
+    LocalIntentClassifier, load_training_samples, evaluate, build_metadata,
+    DEFAULT_MODEL_PATH, DEFAULT_THRESHOLD, TRAINING_LABEL_SOURCES, LEGACY_SOURCE
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the local intent classifier from chat_logs")
+    parser.add_argument("--output", default=DEFAULT_MODEL_PATH, help="Path of the model artifact")
+    parser.add_argument("--min-confidence", type=float, default=0.7, help="Minimum logged confidence to use a label")
+    parser.add_argument("--sources", default=",".join(TRAINING_LABEL_SOURCES),
+                        help="Comma-separated label sources to train on (llm, human)")
+    parser.add_argument("--include-legacy", action="store_true",
+                        help="Also train on classified rows logged before intent_source was recorded (any classifier)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Serving threshold used for evaluation")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of samples kept for evaluation")
+    parser.add_argument("--min-samples", type=int, default=50)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    sources = tuple(source.strip() for source in args.sources.split(",") if source.strip())
+    print("🧠 KodiBOT Local Intent Classifier Training")
+    print("=" * 60)
+
+    db = SessionLocal()
+    try:
+        source_counts = Counter()
+        samples = load_training_samples(db, min_confidence=args.min_confidence, sources=sources,
+                                        include_legacy=args.include_legacy, source_counts=source_counts)
+    finally:
+        db.close()
+
+    # Rows used per label source: an empty source (e.g. a fresh intent_source column) shows up here
+    label_sources = sources + ((LEGACY_SOURCE,) if args.include_legacy else ())
+    for source in label_sources:
+        print(f"   {source}: {source_counts[source]} rows")
+    if not args.include_legacy:
+        print("   (rows logged before intent_source was recorded are skipped: see --include-legacy)")
+    intents = sorted({intent for _, intent in samples})
+    print(f"📥 {len(samples)} unique messages labelled by {', '.join(label_sources)} across {len(intents)} intents: {', '.join(intents)}")
+    if len(samples) < args.min_samples or len(intents) < 2:
+        print(f"❌ Not enough training data (need {args.min_samples} samples and 2 intents)")
+        sys.exit(1)
+
+    random.Random(42).shuffle(samples)
+    split = int(len(samples) * (1 - args.holdout))
+    train_set, holdout_set = samples[:split], samples[split:]
+
+    started = time.perf_counter()
+    model = LocalIntentClassifier.train(train_set, epochs=args.epochs)
+    print(f"⏱️  Trained on {len(train_set)} samples in {time.perf_counter() - started:.1f}s")
+
+    metrics = evaluate(model, holdout_set, args.threshold) if holdout_set else {}
+    print(f"📊 Holdout: {metrics}")
+
+    # Refit on everything for the served artifact
+    model = LocalIntentClassifier.train(samples, epochs=args.epochs)
+    model.metadata = build_metadata(len(samples), metrics, args.min_confidence, label_sources)
+    model.save(args.output)
+    print(f"✅ Model saved to {args.output} ({len(model.to_dict()['weights'])} features)")
+
+if __name__ == "__main__":
+    main()
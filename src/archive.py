@@ -0,0 +1,176 @@
+"""
+Chat Log Archive for KodiBOT
+Retention for chat_logs: whole UTC days older than CHAT_LOG_RETENTION_DAYS are
+moved out of the hot table into gzip-compressed JSON Lines files (one file per
+day and run) listed in a manifest. The hot table and its indexes stay small;
+archived days can still be scanned as a stream with iter_archived().
+
+A day is written to a temporary file, renamed, recorded in the manifest, and only
+then deleted from chat_logs. If a run is interrupted, the next run skips rows the
+manifest already covers and deletes them, so rows are never lost or archived twice.
+Hourly rollups are kept, so analytics still cover archived days.
+"""
+
+import gzip
+import json
+import os
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .database import ChatLogs
+
+CHAT_LOG_RETENTION_DAYS = int(os.getenv("CHAT_LOG_RETENTION_DAYS", "30"))
+CHAT_LOG_ARCHIVE_DIR = os.getenv("CHAT_LOG_ARCHIVE_DIR", "archive/chat_logs")
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+MANIFEST_NAME = "manifest.json"
+_COLUMNS = [column.name for column in ChatLogs.__table__.columns]
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class ChatLogArchive:
+    """Day-partitioned .jsonl.gz files plus manifest.json in one directory"""
+
+    def __init__(self, directory: str = CHAT_LOG_ARCHIVE_DIR):
+        self.directory = directory
+
+    # Manifest
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def manifest(self) -> Dict[str, List[dict]]:
+        """{"YYYY-MM-DD": [{"file", "rows", "first_id", "last_id", "bytes", "archived_at"}, ...]}"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding="utf-8") as handle:
+            return json.load(handle)
+
+    def _save_manifest(self, manifest: Dict[str, List[dict]]):
+        temporary = self.manifest_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(manifest, handle, indent=2, sort_keys=True)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, self.manifest_path)
+
+    def archived_days(self) -> List[str]:
+        return sorted(self.manifest())
+
+    # Writing
+
+    def _next_file(self, day: str, manifest: Dict[str, List[dict]]) -> str:
+        part = len(manifest.get(day, []))
+        return f"chat_logs-{day}.jsonl.gz" if part == 0 else f"chat_logs-{day}.{part}.jsonl.gz"
+
+    def archive_day(self, db: Session, day: date, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+        """Move one UTC day of chat_logs into the archive; returns the number of rows moved"""
+        os.makedirs(self.directory, exist_ok=True)
+        key = day.isoformat()
+        start = datetime.combine(day, dt_time.min)
+        end = start + timedelta(days=1)
+        in_day = (ChatLogs.created_at >= start, ChatLogs.created_at < end)
+
+        manifest = self.manifest()
+        # Rows a previous (interrupted) run already wrote: delete only
+        covered = max((part["last_id"] for part in manifest.get(key, [])), default=0)
+
+        rows = db.query(ChatLogs.__table__).filter(*in_day, ChatLogs.id > covered).order_by(ChatLogs.id)
+        filename = self._next_file(key, manifest)
+        temporary = os.path.join(self.directory, filename + ".tmp")
+        count, first_id, last_id = 0, None, None
+        with gzip.open(temporary, "wt", encoding="utf-8") as handle:
+            for row in rows.execution_options(yield_per=batch_size):
+                record = {column: _serialize(getattr(row, column)) for column in _COLUMNS}
+                handle.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+                count += 1
+                first_id = row.id if first_id is None else first_id
+                last_id = row.id
+
+        if count:
+            path = os.path.join(self.directory, filename)
+            os.replace(temporary, path)
+            manifest.setdefault(key, []).append({
+                "file": filename,
+                "rows": count,
+                "first_id": first_id,
+                "last_id": last_id,
+                "bytes": os.path.getsize(path),
+                "archived_at": datetime.utcnow().isoformat()
+            })
+            self._save_manifest(manifest)
+            covered = last_id
+        else:
+            os.remove(temporary)
+
+        deleted = 0
+        if covered:
+            deleted = db.query(ChatLogs).filter(*in_day, ChatLogs.id <= covered).delete(synchronize_session=False)
+            db.commit()
+        return deleted
+
+    def archive_older_than(self, db: Session, retention_days: int = CHAT_LOG_RETENTION_DAYS,
+                           dry_run: bool = False) -> Dict[str, int]:
+        """Archive every whole day before today - retention_days; returns rows moved per day"""
+        cutoff = datetime.combine(datetime.utcnow().date() - timedelta(days=retention_days), dt_time.min)
+        oldest = db.query(func.min(ChatLogs.created_at)).filter(ChatLogs.created_at < cutoff).scalar()
+        moved: Dict[str, int] = {}
+        if oldest is None:
+            return moved
+
+        day = oldest.date()
+        while day < cutoff.date():
+            if dry_run:
+                start = datetime.combine(day, dt_time.min)
+                count = db.query(func.count(ChatLogs.id)).filter(
+                    ChatLogs.created_at >= start, ChatLogs.created_at < start + timedelta(days=1)
+                ).scalar()
+            else:
+                count = self.archive_day(db, day)
+            if count:
+                moved[day.isoformat()] = count
+            day += timedelta(days=1)
+        return moved
+
+    # Reading
+
+    def iter_archived(self, start_day: Optional[str] = None, end_day: Optional[str] = None,
+                      phone_number: Optional[str] = None, direction: Optional[str] = None) -> Iterator[dict]:
+        """
+        Stream archived rows (oldest day first) between start_day and end_day inclusive
+        Files are decompressed line by line, so memory stays flat whatever the range
+        """
+        manifest = self.manifest()
+        for day in sorted(manifest):
+            if (start_day and day < start_day) or (end_day and day > end_day):
+                continue
+            for part in manifest[day]:
+                with gzip.open(os.path.join(self.directory, part["file"]), "rt", encoding="utf-8") as handle:
+                    for line in handle:
+                        record = json.loads(line)
+                        if phone_number and record["phone_number"] != phone_number:
+                            continue
+                        if direction and record["direction"] != direction:
+                            continue
+                        yield record
+
+    def stats(self) -> dict:
+        manifest = self.manifest()
+        parts = [part for day_parts in manifest.values() for part in day_parts]
+        return {
+            "directory": self.directory,
+            "days": len(manifest),
+            "files": len(parts),
+            "rows": sum(part["rows"] for part in parts),
+            "bytes": sum(part["bytes"] for part in parts),
+            "oldest_day": min(manifest) if manifest else None,
+            "newest_day": max(manifest) if manifest else None
+        }
+
+# Global archive instance
+chat_log_archive = ChatLogArchive()
@@ -0,0 +1,167 @@
+"""
+In-Process Caching Utilities for KodiBOT
+Bounded LRU + TTL cache with hit/miss counters, plus key helpers
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Optional, Tuple
+
+_MISSING = object()
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+
+def normalize_message(message: str) -> str:
+    """
+    Normalize a user message for cache keys
+    Casefold, fold accents, turn punctuation runs into spaces, collapse whitespace
+    """
+    folded = unicodedata.normalize("NFKD", message.casefold())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return " ".join(_PUNCTUATION_RE.sub(" ", folded).split())
+
+def fingerprint(data: Any) -> str:
+    """Stable hash of JSON-like data (dict key order does not matter)"""
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+class TTLCache:
+    """
+    Thread-safe bounded cache with LRU eviction and per-entry TTL
+    Keeps hit/miss/eviction counters for sizing
+    """
+
+    def __init__(self, name: str, max_size: int = 1024, ttl: float = 300.0):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None,
+            validate: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Return the cached value (refreshing its LRU position) or default
+        An entry rejected by validate is dropped and counted as an invalidation
+        """
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            if validate is not None and not validate(value):
+                del self._data[key]
+                self.invalidations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entries past max_size"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Drop one entry; returns True if it was cached"""
+        with self._lock:
+            if self._data.pop(key, _MISSING) is _MISSING:
+                return False
+            self.invalidations += 1
+            return True
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches the predicate"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
+
+class SQLiteCacheStore:
+    """
+    Small write-through SQLite table backing a TTLCache across restarts
+    Values are stored as JSON with a wall-clock expiry
+    """
+
+    def __init__(self, path: str, table: str):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Cache data: favour write latency over durability
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def load(self, limit: int) -> Iterator[Tuple[str, Any, float]]:
+        """Yield (key, value, remaining_ttl) for live entries, most recent expiry first"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+            self._conn.commit()
+            rows = self._conn.execute(
+                f"SELECT key, value, expires_at FROM {self.table} ORDER BY expires_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        for key, value, expires_at in reversed(rows):
+            yield key, json.loads(value), expires_at - now
+
+    def save(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
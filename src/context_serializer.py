@@ -0,0 +1,149 @@
+"""
+Compact Context Serializer for KodiBOT
+Turns the context dicts built by DataService into short "key: value" lines for the
+LLM prompt. Row lists share one column header, and rows are kept by relevance
+(unpaid first, then most recent year) until the token budget is reached.
+"""
+
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SETTLED_STATUSES = {"paid", "paye", "payé", "payée", "settled", "sold", "vendu"}
+_YEAR_KEYS = ("annee", "year", "tax_year")
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough BPE-like token count without a tokenizer
+    One token per punctuation mark, about four characters per word piece
+    """
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _TOKEN_RE.findall(text))
+
+def _format_value(value: Any) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _is_row_list(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(item, dict) for item in value)
+
+def _row_priority(row: dict) -> Tuple[int, int]:
+    """Sort key: outstanding items first, then the most recent year"""
+    status = str(row.get("statut", row.get("status", ""))).lower()
+    due, paid = row.get("montant_du"), row.get("montant_paye")
+    outstanding = status not in _SETTLED_STATUSES
+    if isinstance(due, (int, float)) and isinstance(paid, (int, float)):
+        outstanding = outstanding or paid < due
+    year = next((row[key] for key in _YEAR_KEYS if isinstance(row.get(key), int)), 0)
+    return (0 if outstanding else 1, -year)
+
+@dataclass
+class SerializedContext:
+    text: str
+    tokens: int
+    raw_tokens: int
+    rows_kept: int
+    rows_dropped: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.raw_tokens - self.tokens)
+
+class _Writer:
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.lines: List[str] = []
+        self.tokens = 0
+        self.rows_kept = 0
+        self.rows_dropped = 0
+
+    def add(self, line: str, force: bool = False) -> bool:
+        cost = estimate_tokens(line) + 1
+        if not force and self.tokens + cost > self.budget:
+            return False
+        self.lines.append(line)
+        self.tokens += cost
+        return True
+
+def _write_rows(writer: _Writer, key: str, rows: List[dict], indent: str):
+    columns: List[str] = []
+    for row in rows:
+        columns.extend(column for column in row if column not in columns)
+    writer.add(f"{indent}{key} ({len(rows)}): {' | '.join(columns)}", force=True)
+
+    ranked = sorted(rows, key=_row_priority)
+    for position, row in enumerate(ranked):
+        line = f"{indent}- " + " | ".join(_format_value(row.get(column)) for column in columns)
+        if not writer.add(line):
+            dropped = len(ranked) - position
+            writer.rows_dropped += dropped
+            writer.add(f"{indent}- ... {dropped} autre(s) omise(s) (plus anciennes ou réglées)", force=True)
+            return
+        writer.rows_kept += 1
+
+def _write_dict(writer: _Writer, data: Dict[str, Any], indent: str = ""):
+    # Scalars (totals, names) first: they are always kept
+    nested = []
+    for key, value in data.items():
+        if isinstance(value, (dict, list)):
+            nested.append((key, value))
+        else:
+            writer.add(f"{indent}{key}: {_format_value(value)}", force=True)
+
+    for key, value in nested:
+        if isinstance(value, dict):
+            writer.add(f"{indent}{key}:", force=True)
+            _write_dict(writer, value, indent + "  ")
+        elif _is_row_list(value):
+            _write_rows(writer, key, value, indent)
+        elif value:
+            writer.add(f"{indent}{key}: {', '.join(_format_value(item) for item in value)}", force=True)
+        else:
+            writer.add(f"{indent}{key}: aucun", force=True)
+
+def serialize_context(context_data: Optional[dict], budget: int = CONTEXT_TOKEN_BUDGET) -> SerializedContext:
+    """Serialize a context dict into compact lines within the token budget"""
+    if not context_data:
+        text = "Aucune donnée spécifique"
+        tokens = estimate_tokens(text)
+        return SerializedContext(text, tokens, tokens, 0, 0)
+
+    writer = _Writer(budget)
+    _write_dict(writer, context_data)
+    text = "\n".join(writer.lines)
+    result = SerializedContext(
+        text=text,
+        tokens=estimate_tokens(text),
+        raw_tokens=estimate_tokens(str(context_data)),
+        rows_kept=writer.rows_kept,
+        rows_dropped=writer.rows_dropped
+    )
+    _record(result)
+    return result
+
+# Running totals, to see what the compact format saves on real traffic
+_stats_lock = threading.Lock()
+_stats = {"serialized": 0, "raw_tokens": 0, "tokens": 0, "saved_tokens": 0, "truncated": 0}
+
+def _record(result: SerializedContext):
+    with _stats_lock:
+        _stats["serialized"] += 1
+        _stats["raw_tokens"] += result.raw_tokens
+        _stats["tokens"] += result.tokens
+        _stats["saved_tokens"] += result.saved_tokens
+        _stats["truncated"] += result.rows_dropped > 0
+
+def serializer_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["budget"] = CONTEXT_TOKEN_BUDGET
+    stats["saved_ratio"] = round(stats["saved_tokens"] / stats["raw_tokens"], 4) if stats["raw_tokens"] else 0.0
+    return stats
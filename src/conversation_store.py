@@ -0,0 +1,123 @@
+"""
+Bounded Conversation Store for KodiBOT
+Keeps the recent turns of each phone number in a ring buffer so answers can use
+the conversation so far. Memory stays flat: turns per phone, turn length and the
+number of phones are capped, and idle conversations expire.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .context_serializer import estimate_tokens
+
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "10"))
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "1800"))
+CONVERSATION_MAX_PHONES = int(os.getenv("CONVERSATION_MAX_PHONES", "10000"))
+CONVERSATION_HISTORY_TOKENS = int(os.getenv("CONVERSATION_HISTORY_TOKENS", "400"))
+MAX_TURN_CHARS = 2000
+
+class ConversationStore:
+    """
+    Per-phone ring buffers of {"role", "content"} turns
+    LRU over phones (max_phones) and idle TTL bound the total memory
+    """
+
+    def __init__(self, max_turns: int = CONVERSATION_MAX_TURNS, ttl: float = CONVERSATION_TTL,
+                 max_phones: int = CONVERSATION_MAX_PHONES):
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.max_phones = max_phones
+        self._conversations: "OrderedDict[str, Tuple[float, Deque[dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _live_turns(self, phone_number: str, now: float) -> Optional[Deque[dict]]:
+        entry = self._conversations.get(phone_number)
+        if entry is None:
+            return None
+        last_seen, turns = entry
+        if now - last_seen > self.ttl:
+            del self._conversations[phone_number]
+            self.expirations += 1
+            return None
+        return turns
+
+    def append(self, phone_number: str, role: str, content: str):
+        """Add one turn, evicting the least recently active phones past max_phones"""
+        if not phone_number or not content:
+            return
+        now = time.monotonic()
+        with self._lock:
+            turns = self._live_turns(phone_number, now)
+            if turns is None:
+                turns = deque(maxlen=self.max_turns)
+            turns.append({"role": role, "content": content[:MAX_TURN_CHARS]})
+            self._conversations[phone_number] = (now, turns)
+            self._conversations.move_to_end(phone_number)
+            while len(self._conversations) > self.max_phones:
+                self._conversations.popitem(last=False)
+                self.evictions += 1
+
+    def record_exchange(self, phone_number: str, user_content: str, assistant_content: str):
+        self.append(phone_number, "user", user_content)
+        self.append(phone_number, "assistant", assistant_content)
+
+    def history(self, phone_number: Optional[str], token_budget: int = CONVERSATION_HISTORY_TOKENS) -> List[dict]:
+        """Most recent turns (oldest first) whose estimated tokens fit in token_budget"""
+        if not phone_number or token_budget <= 0:
+            return []
+        with self._lock:
+            turns = self._live_turns(phone_number, time.monotonic())
+            recent = list(turns) if turns else []
+
+        selected: List[dict] = []
+        used = 0
+        for turn in reversed(recent):
+            cost = estimate_tokens(turn["content"]) + 4
+            if used + cost > token_budget:
+                break
+            selected.append(turn)
+            used += cost
+        # Never start the history with an orphan assistant turn
+        while selected and selected[-1]["role"] == "assistant":
+            selected.pop()
+        selected.reverse()
+        return selected
+
+    def clear(self, phone_number: str):
+        with self._lock:
+            self._conversations.pop(phone_number, None)
+
+    def purge_expired(self) -> int:
+        """Drop idle conversations (also happens lazily on access)"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [phone for phone, (last_seen, _) in self._conversations.items() if now - last_seen > self.ttl]
+            for phone in expired:
+                del self._conversations[phone]
+            self.expirations += len(expired)
+            return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            turns = sum(len(turns) for _, turns in self._conversations.values())
+            phones = len(self._conversations)
+        return {
+            "phones": phones,
+            "turns": turns,
+            "max_phones": self.max_phones,
+            "max_turns_per_phone": self.max_turns,
+            "ttl_seconds": self.ttl,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+# Global store instance
+conversation_store = ConversationStore()
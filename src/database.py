@@ -1,15 +1,44 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Text, ForeignKey, Boolean, JSON
+from sqlalchemy import create_engine, literal_column, Column, Integer, String, DateTime, Float, Text, ForeignKey, Boolean, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from datetime import datetime
 import os
+from .metrics import instrument_engine
+from .engine_profile import engine_options, apply_engine_profile
+from .migrations import run_migrations
+
+# Async drivers used when deriving the async URL from DATABASE_URL
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str) -> str:
+    """Map a sync database URL onto the matching async driver"""
+    scheme, sep, rest = url.partition("://")
+    if not sep or "+" in scheme:
+        return url
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
 
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///kodibot.db")
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+apply_engine_profile(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Async database setup (used by the non-blocking chat pipeline)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+apply_engine_profile(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# Query counters for /metrics
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
 class Citizens(Base):
     __tablename__ = "citizens"
     
@@ -34,7 +63,7 @@ class LinkedUsers(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     phone_number = Column(String(20), unique=True, index=True)
-    citizen_id = Column(String(50), ForeignKey("citizens.citizen_id"))
+    citizen_id = Column(String(50), ForeignKey("citizens.citizen_id"), index=True)
     otp_code = Column(String(6))
     otp_expires_at = Column(DateTime)
     is_linked = Column(Boolean, default=False)
@@ -45,7 +74,7 @@ class Taxes(Base):
     __tablename__ = "taxes"
     
     id = Column(Integer, primary_key=True, index=True)
-    citizen_id = Column(String(50), ForeignKey("citizens.citizen_id"))
+    citizen_id = Column(String(50), ForeignKey("citizens.citizen_id"), index=True)
     tax_type = Column(String(100))  # foncière, professionnelle, etc.
     amount_due = Column(Float)
     amount_paid = Column(Float)
@@ -74,8 +103,8 @@ class Parcels(Base):
     __tablename__ = "parcels"
     
     id = Column(Integer, primary_key=True, index=True)
-    citizen_id = Column(String(50), ForeignKey("citizens.citizen_id"))
-    parcel_number = Column(String(100))
+    citizen_id = Column(String(50), ForeignKey("citizens.citizen_id"), index=True)
+    parcel_number = Column(String(100), unique=True, index=True)
     property_type = Column(String(100))  # terrain, maison, appartement
     address = Column(Text)
     area_sqm = Column(Float)
@@ -89,21 +118,59 @@ class Parcels(Base):
 
 class ChatLogs(Base):
     __tablename__ = "chat_logs"
+    __table_args__ = (
+        Index("ix_chat_logs_direction_intent", "direction", "intent"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    phone_number = Column(String(20))
+    phone_number = Column(String(20), index=True)
     citizen_id = Column(String(50), ForeignKey("citizens.citizen_id"), nullable=True)
     message_text = Column(Text)
     direction = Column(String(10))  # IN or OUT
     intent = Column(String(100), nullable=True)
     confidence = Column(Float, nullable=True)
+    intent_source = Column(String(20), nullable=True)  # llm, local, rules or human (who produced the label)
     response_accuracy = Column(Float, nullable=True)  # 0-100%
     session_id = Column(String(100), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     citizen = relationship("Citizens", back_populates="chat_logs")
 
+class ChatLogRollup(Base):
+    """
+    Hourly chat_logs aggregates per (intent, direction), kept up to date as logs are written
+    intent is "" for messages without an intent (outbound replies, not yet classified)
+    """
+    __tablename__ = "chat_log_rollups"
+    
+    bucket_hour = Column(DateTime, primary_key=True)
+    intent = Column(String(100), primary_key=True, default="")
+    direction = Column(String(10), primary_key=True)
+    message_count = Column(Integer, default=0, nullable=False)
+    fallback_count = Column(Integer, default=0, nullable=False)
+    confidence_sum = Column(Float, default=0.0, nullable=False)
+    confidence_count = Column(Integer, default=0, nullable=False)
+
+class LLMUsage(Base):
+    """
+    One OpenAI call: tokens, latency, cost and outcome (written when LLM_USAGE_PERSIST=true)
+    """
+    __tablename__ = "llm_usage"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    endpoint = Column(String(100))
+    intent = Column(String(100))
+    operation = Column(String(50))  # answer, intent, combined, stream
+    model = Column(String(100))
+    outcome = Column(String(20))  # success, quota, error
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)
+    latency_ms = Column(Float)
+    cost_usd = Column(Float, default=0.0)
+
 class KCAF_Records(Base):
     """
     K-CAF Property Assessment Records
@@ -155,12 +222,69 @@ class KCAF_Records(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Offline collector sync (see DataService.upsert_kcaf_records)
+    client_version = Column(Integer) # Collector's revision counter for this record
+    idempotency_token = Column(String) # Token of the last submission applied
+
     # Relationship
     parcel = relationship("Parcels", back_populates="kcaf_record")
 
-# Create all tables
+# Backends with INSERT ... ON CONFLICT ... RETURNING, used by the chat log rollups
+# (inside every log-writer commit) and the K-CAF writes
+UPSERT_DIALECTS = ("sqlite", "postgresql")
+SQLITE_MIN_VERSION = (3, 35, 0)  # First release with RETURNING
+
+def check_upsert_support(engine):
+    """Fail at startup, with the reason, on a database the upserts cannot run on"""
+    name = engine.dialect.name
+    if name not in UPSERT_DIALECTS:
+        raise RuntimeError(
+            f"DATABASE_URL uses {name}, which KodiBOT does not support: use SQLite or PostgreSQL "
+            f"(chat log rollups and K-CAF records are written with INSERT ... ON CONFLICT)"
+        )
+    if name == "sqlite":
+        version = engine.dialect.dbapi.sqlite_version_info
+        if version < SQLITE_MIN_VERSION:
+            raise RuntimeError(
+                f"SQLite {'.'.join(map(str, version))} is too old: KodiBOT needs "
+                f"{'.'.join(map(str, SQLITE_MIN_VERSION))} or later (INSERT ... RETURNING)"
+            )
+
+def dialect_insert(dialect_name: str, table):
+    """INSERT supporting on_conflict_do_update / do_nothing (SQLite and PostgreSQL, see check_upsert_support)"""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"No upsert support for dialect {dialect_name}")
+    return insert(table)
+
+def upsert_inserted_flag(dialect_name: str):
+    """
+    RETURNING column of an upsert telling inserted rows (true) from updated ones
+    PostgreSQL: a row version written by an INSERT has no xmax; None where no such marker exists
+    """
+    if dialect_name == "postgresql":
+        return literal_column("xmax = 0", Boolean).label("inserted")
+    return None
+
+def begin_write(session):
+    """
+    SQLite: take the write lock now (BEGIN IMMEDIATE), so the reads that follow and the writes
+    of the transaction see no concurrent writer. No-op elsewhere or once a write has started
+    """
+    if session.get_bind().dialect.name != "sqlite":
+        return
+    connection = session.connection()
+    if not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+# Create all tables, then bring existing databases up to the current schema version
 def create_tables():
+    check_upsert_support(engine)
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
 
 # Database dependency
 def get_db():
@@ -168,4 +292,10 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# Async database dependency
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+ 
\ No newline at end of file
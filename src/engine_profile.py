@@ -0,0 +1,120 @@
+"""
+Database Engine Profile for KodiBOT
+Engine options and per-connection settings for the sync and async engines:
+- SQLite: WAL journal, synchronous=NORMAL, mmap, page cache and busy timeout
+  on every connection, so concurrent writers wait instead of failing with
+  "database is locked"
+- PostgreSQL: pool sizing, overflow, pre-ping, recycling and a statement timeout
+DB_ENGINE_PROFILE=default keeps SQLAlchemy's defaults.
+"""
+
+import os
+from typing import Any, Dict
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+DB_ENGINE_PROFILE = os.getenv("DB_ENGINE_PROFILE", "production").lower()
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negative = KiB (64 MiB)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+def sqlite_pragmas(url) -> Dict[str, Any]:
+    """PRAGMAs applied to each new SQLite connection (in this order)"""
+    pragmas: Dict[str, Any] = {"busy_timeout": SQLITE_BUSY_TIMEOUT_MS}
+    if not _is_memory_sqlite(url):
+        # An in-memory database has no journal file and no file to map
+        pragmas["journal_mode"] = SQLITE_JOURNAL_MODE
+        pragmas["mmap_size"] = SQLITE_MMAP_SIZE
+    pragmas["synchronous"] = SQLITE_SYNCHRONOUS
+    pragmas["cache_size"] = SQLITE_CACHE_SIZE
+    return pragmas
+
+def engine_options(database_url: str) -> Dict[str, Any]:
+    """Keyword arguments for create_engine / create_async_engine"""
+    if DB_ENGINE_PROFILE == "default":
+        return {}
+    url = make_url(database_url)
+    backend, driver = url.get_backend_name(), url.get_driver_name()
+
+    if backend == "sqlite":
+        if _is_memory_sqlite(url):
+            return {}
+        # The driver-level timeout is the busy handler until the PRAGMA runs
+        return {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+
+    options: Dict[str, Any] = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    if backend == "postgresql" and DB_STATEMENT_TIMEOUT_MS > 0:
+        if driver == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+def apply_engine_profile(engine: Engine):
+    """Run the SQLite PRAGMAs on every new connection (sync engine, or async_engine.sync_engine)"""
+    if DB_ENGINE_PROFILE == "default" or engine.dialect.name != "sqlite":
+        return
+    pragmas = sqlite_pragmas(engine.url)
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+                if name == "journal_mode":
+                    cursor.fetchall()
+        finally:
+            cursor.close()
+
+def engine_report(engine: Engine) -> Dict[str, Any]:
+    """Effective settings of an engine, read back from a live connection"""
+    report: Dict[str, Any] = {
+        "profile": DB_ENGINE_PROFILE,
+        "dialect": f"{engine.dialect.name}+{engine.dialect.driver}",
+        "pool": type(engine.pool).__name__,
+    }
+    pool = engine.pool
+    if hasattr(pool, "size"):
+        report["pool_size"] = pool.size()
+    for attribute, key in (("_max_overflow", "max_overflow"), ("_recycle", "pool_recycle"),
+                           ("_pre_ping", "pool_pre_ping"), ("_timeout", "pool_timeout")):
+        if hasattr(pool, attribute):
+            report[key] = getattr(pool, attribute)
+
+    with engine.connect() as connection:
+        if engine.dialect.name == "sqlite":
+            for name in ("journal_mode", "synchronous", "mmap_size", "cache_size", "busy_timeout"):
+                report[name] = connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+        elif engine.dialect.name == "postgresql":
+            report["statement_timeout"] = connection.exec_driver_sql("SHOW statement_timeout").scalar()
+    return report
+
+def print_engine_report(engine: Engine):
+    """Startup report of the effective database settings"""
+    try:
+        report = engine_report(engine)
+    except Exception as e:
+        print(f"⚠️  Could not read database settings: {e}")
+        return
+    settings = ", ".join(f"{key}={value}" for key, value in report.items() if key not in ("profile", "dialect"))
+    print(f"🗄️  Database engine ({report['dialect']}, profile {report['profile']}): {settings}")
@@ -0,0 +1,233 @@
+"""
+Local Intent Classifier for KodiBOT
+Character n-gram features + multinomial logistic regression, trained on chat_logs history.
+Pure Python (no numpy/sklearn) so it runs in-process on CPU in well under a millisecond.
+"""
+
+import json
+import math
+import os
+import random
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+DEFAULT_MODEL_PATH = os.getenv("LOCAL_INTENT_MODEL_PATH", "intent_model.json")
+DEFAULT_THRESHOLD = float(os.getenv("LOCAL_INTENT_THRESHOLD", "0.85"))
+
+# Labels the model may learn from: rule and local-model labels would feed its own output back
+TRAINING_LABEL_SOURCES = ("llm", "human")
+
+def _prepare_text(text: str) -> str:
+    """Lowercase, strip accents and collapse whitespace"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.split())
+
+def extract_features(text: str, ngram_min: int = 2, ngram_max: int = 4) -> Dict[str, float]:
+    """Character n-gram counts, log-scaled and L2-normalized"""
+    padded = f" {_prepare_text(text)} "
+    counts = Counter(
+        padded[i:i + n]
+        for n in range(ngram_min, ngram_max + 1)
+        for i in range(len(padded) - n + 1)
+    )
+    features = {gram: 1.0 + math.log(count) for gram, count in counts.items()}
+    norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+    return {gram: v / norm for gram, v in features.items()}
+
+def _softmax(scores: List[float]) -> List[float]:
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+class LocalIntentClassifier:
+    """
+    Multinomial logistic regression over sparse character n-gram features
+    Weights are stored per feature as one vector over labels
+    """
+
+    def __init__(self, labels: List[str], weights: Optional[Dict[str, List[float]]] = None,
+                 bias: Optional[List[float]] = None, ngram_min: int = 2, ngram_max: int = 4,
+                 metadata: Optional[dict] = None):
+        self.labels = labels
+        self.weights = weights or {}
+        self.bias = bias or [0.0] * len(labels)
+        self.ngram_min = ngram_min
+        self.ngram_max = ngram_max
+        self.metadata = metadata or {}
+
+    def _scores(self, features: Dict[str, float]) -> List[float]:
+        scores = list(self.bias)
+        for gram, value in features.items():
+            vector = self.weights.get(gram)
+            if vector:
+                for i, w in enumerate(vector):
+                    scores[i] += value * w
+        return scores
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Return (intent, probability) for a message"""
+        probs = _softmax(self._scores(extract_features(text, self.ngram_min, self.ngram_max)))
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.labels[best], probs[best]
+
+    @classmethod
+    def train(cls, samples: List[Tuple[str, str]], epochs: int = 20, learning_rate: float = 1.0,
+              l2: float = 1e-5, ngram_min: int = 2, ngram_max: int = 4, seed: int = 42) -> "LocalIntentClassifier":
+        """Fit the model with SGD on (message, intent) pairs"""
+        labels = sorted({intent for _, intent in samples})
+        index = {label: i for i, label in enumerate(labels)}
+        data = [(extract_features(text, ngram_min, ngram_max), index[intent]) for text, intent in samples]
+
+        model = cls(labels, ngram_min=ngram_min, ngram_max=ngram_max)
+        weights: Dict[str, List[float]] = defaultdict(lambda: [0.0] * len(labels))
+        model.weights = weights
+        rng = random.Random(seed)
+
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            rate = learning_rate / math.sqrt(1.0 + epoch)
+            for features, target in data:
+                probs = _softmax(model._scores(features))
+                for i in range(len(labels)):
+                    grad = probs[i] - (1.0 if i == target else 0.0)
+                    if abs(grad) < 1e-6:
+                        continue
+                    model.bias[i] -= rate * grad
+                    for gram, value in features.items():
+                        vector = weights[gram]
+                        vector[i] -= rate * (grad * value + l2 * vector[i])
+
+        model.weights = dict(weights)
+        return model
+
+    def to_dict(self, precision: int = 5) -> dict:
+        """Serialize the model, dropping near-zero weights"""
+        weights = {}
+        for gram, vector in self.weights.items():
+            rounded = [round(w, precision) for w in vector]
+            if any(rounded):
+                weights[gram] = rounded
+        return {
+            "labels": self.labels,
+            "bias": [round(b, precision) for b in self.bias],
+            "ngram_min": self.ngram_min,
+            "ngram_max": self.ngram_max,
+            "metadata": self.metadata,
+            "weights": weights
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LocalIntentClassifier":
+        return cls(
+            labels=data["labels"],
+            weights=data["weights"],
+            bias=data["bias"],
+            ngram_min=data.get("ngram_min", 2),
+            ngram_max=data.get("ngram_max", 4),
+            metadata=data.get("metadata", {})
+        )
+
+    def save(self, path: str = DEFAULT_MODEL_PATH):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> "LocalIntentClassifier":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+# Key of the rows logged before intent_source existed (NULL source) in the per-source counts
+LEGACY_SOURCE = "legacy"
+
+def load_training_samples(db, min_confidence: float = 0.7,
+                          sources: Tuple[str, ...] = TRAINING_LABEL_SOURCES,
+                          include_legacy: bool = False,
+                          source_counts: Optional[Counter] = None) -> List[Tuple[str, str]]:
+    """
+    Build (message, intent) pairs from inbound chat logs labelled by one of `sources`
+    include_legacy also takes the classified rows logged before intent_source was recorded
+    (their labels came from any classifier); source_counts, if given, receives the rows used per source
+    Duplicate messages are collapsed onto their majority intent
+    """
+    from sqlalchemy import or_
+    from .database import ChatLogs
+
+    labelled = ChatLogs.intent_source.in_(sources)
+    if include_legacy:
+        labelled = or_(labelled, ChatLogs.intent_source.is_(None))
+    rows = db.query(ChatLogs.message_text, ChatLogs.intent, ChatLogs.intent_source).filter(
+        ChatLogs.direction == "IN",
+        ChatLogs.intent.isnot(None),
+        labelled,
+        ChatLogs.confidence >= min_confidence
+    ).yield_per(1000)
+
+    votes: Dict[str, Counter] = defaultdict(Counter)
+    originals: Dict[str, str] = {}
+    for message_text, intent, source in rows:
+        if not message_text:
+            continue
+        if source_counts is not None:
+            source_counts[source or LEGACY_SOURCE] += 1
+        key = _prepare_text(message_text)
+        votes[key][intent] += 1
+        originals.setdefault(key, message_text)
+
+    return [(originals[key], counter.most_common(1)[0][0]) for key, counter in votes.items()]
+
+def evaluate(model: LocalIntentClassifier, samples: List[Tuple[str, str]], threshold: float) -> Dict[str, Any]:
+    """Accuracy overall and on the samples the model would answer locally"""
+    correct = confident = confident_correct = 0
+    for text, intent in samples:
+        predicted, probability = model.predict(text)
+        correct += predicted == intent
+        if probability >= threshold:
+            confident += 1
+            confident_correct += predicted == intent
+    total = len(samples) or 1
+    return {
+        "accuracy": round(correct / total, 4),
+        "coverage": round(confident / total, 4),
+        "confident_accuracy": round(confident_correct / confident, 4) if confident else None
+    }
+
+# Global model instance (loaded at startup)
+_local_model: Optional[LocalIntentClassifier] = None
+
+def load_local_classifier(path: str = DEFAULT_MODEL_PATH) -> Optional[LocalIntentClassifier]:
+    """Load the trained artifact if present; the LLM is used for everything otherwise"""
+    global _local_model
+    if os.getenv("LOCAL_INTENT_ENABLED", "true").lower() != "true" or not os.path.exists(path):
+        _local_model = None
+        return None
+
+    try:
+        _local_model = LocalIntentClassifier.load(path)
+        print(f"🧠 Local intent classifier loaded: {path} ({len(_local_model.labels)} intents)")
+    except Exception as e:
+        print(f"⚠️  Could not load local intent classifier {path}: {e}")
+        _local_model = None
+    return _local_model
+
+def classify_locally(user_message: str, threshold: float = DEFAULT_THRESHOLD) -> Optional[Tuple[str, float]]:
+    """Return (intent, confidence) when the local model is confident enough, else None"""
+    if _local_model is None:
+        return None
+    intent, probability = _local_model.predict(user_message)
+    if probability < threshold:
+        return None
+    return intent, probability
+
+def build_metadata(samples_count: int, metrics: Dict[str, Any], min_confidence: float,
+                   sources: Tuple[str, ...] = TRAINING_LABEL_SOURCES) -> dict:
+    return {
+        "trained_at": datetime.utcnow().isoformat(),
+        "samples": samples_count,
+        "min_confidence": min_confidence,
+        "label_sources": list(sources),
+        "holdout": metrics
+    }
@@ -0,0 +1,74 @@
+"""
+Compiled Keyword Matcher for KodiBOT
+Aho-Corasick automaton: finds every registered pattern in a single pass over the text,
+whatever the number of patterns.
+"""
+
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+class KeywordMatcher:
+    """
+    Multi-pattern substring matcher (Aho-Corasick)
+    Each pattern carries a payload returned with its matches
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]] = ()):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._own: List[List[Tuple[str, Any]]] = [[]]
+        self._out: List[List[Tuple[str, Any]]] = [[]]
+        self._built = False
+        for pattern, payload in patterns:
+            self.add(pattern, payload)
+        self.build()
+
+    def add(self, pattern: str, payload: Any):
+        """Register a pattern (the automaton must be rebuilt afterwards)"""
+        if not pattern:
+            raise ValueError("Empty patterns cannot be matched")
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._own.append([])
+            state = nxt
+        self._own[state].append((pattern, payload))
+        self._built = False
+
+    def build(self):
+        """Compute failure links breadth-first and merge outputs along them"""
+        self._out = [list(outputs) for outputs in self._own]
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str, Any]]:
+        """Yield (start_index, pattern, payload) for every occurrence in text"""
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern, payload in out[state]:
+                yield i - len(pattern) + 1, pattern, payload
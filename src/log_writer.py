@@ -0,0 +1,306 @@
+"""
+Write-Behind Chat Log Writer for KodiBOT
+Chat logs are queued in memory and bulk-inserted by a background thread
+(every CHAT_LOG_FLUSH_MS milliseconds or CHAT_LOG_BATCH_SIZE rows), so the
+request path never commits just to record a message. Other append-only rows
+(llm_usage) can ride on the same queue with insert(). The hourly chat_log_rollups
+are updated in the same commit.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import update
+
+from .database import SessionLocal, ChatLogs
+from .rollups import ROLLUPS_ENABLED, RollupDelta, apply_rollups
+
+CHAT_LOG_WRITE_BEHIND = os.getenv("CHAT_LOG_WRITE_BEHIND", "true").lower() == "true"
+CHAT_LOG_FLUSH_MS = int(os.getenv("CHAT_LOG_FLUSH_MS", "200"))
+CHAT_LOG_BATCH_SIZE = int(os.getenv("CHAT_LOG_BATCH_SIZE", "500"))
+CHAT_LOG_QUEUE_SIZE = int(os.getenv("CHAT_LOG_QUEUE_SIZE", "10000"))
+
+_LOG_FIELDS = ("phone_number", "citizen_id", "message_text", "direction", "intent", "confidence",
+               "intent_source", "created_at")
+_UPDATABLE_FIELDS = {"intent", "confidence", "intent_source", "response_accuracy", "session_id"}
+
+class PendingChatLog:
+    """
+    Chat log queued for insertion
+    Exposes the ChatLogs columns; id stays None until the row is written
+    """
+
+    def __init__(self, phone_number: str, message_text: str, direction: str,
+                 intent: Optional[str] = None, confidence: Optional[float] = None,
+                 citizen_id: Optional[str] = None):
+        self.id: Optional[int] = None
+        self.phone_number = phone_number
+        self.citizen_id = citizen_id
+        self.message_text = message_text
+        self.direction = direction
+        self.intent = intent
+        self.confidence = confidence
+        self.intent_source: Optional[str] = None
+        # Stamped at enqueue time so batching does not reorder the conversation
+        self.created_at = datetime.utcnow()
+
+    def to_row(self) -> dict:
+        return {field: getattr(self, field) for field in _LOG_FIELDS}
+
+class ChatLogWriter:
+    """
+    Background bulk writer for ChatLogs
+    Inserts and later updates go through one FIFO queue, so an update is always
+    applied after the insert of its row (on the pending object while it is still
+    queued, by primary key once written). Each batch is a single commit; a batch
+    that fails is retried item by item so one bad row only loses itself.
+    Producers never block: when the queue is full the item is dropped and counted.
+    """
+
+    def __init__(self, session_factory: Callable = SessionLocal, flush_ms: int = CHAT_LOG_FLUSH_MS,
+                 batch_size: int = CHAT_LOG_BATCH_SIZE, max_queue: int = CHAT_LOG_QUEUE_SIZE):
+        self.session_factory = session_factory
+        self.flush_interval = flush_ms / 1000.0
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stopped = False
+        self.enqueued = 0
+        self.written = 0
+        self.updated = 0
+        self.batches = 0
+        self.failed = 0
+        self.dropped = 0
+        self.orphaned_updates = 0
+        self.retried_batches = 0
+        self.last_flush_ms = 0.0
+        self.last_batch_size = 0
+
+    # Producer side
+
+    def log(self, phone_number: str, message_text: str, direction: str,
+            intent: Optional[str] = None, confidence: Optional[float] = None,
+            citizen_id: Optional[str] = None) -> PendingChatLog:
+        """Queue a chat log row and return its pending handle"""
+        entry = PendingChatLog(phone_number, message_text, direction, intent, confidence, citizen_id)
+        if self._put(("insert", entry, None)):
+            self.enqueued += 1
+        return entry
+
+    def update(self, entry: PendingChatLog, **fields):
+        """Queue a column update for a previously logged row"""
+        unknown = set(fields) - _UPDATABLE_FIELDS
+        if unknown:
+            raise ValueError(f"Cannot update chat log fields: {', '.join(sorted(unknown))}")
+        self._put(("update", entry, fields))
+
+    def insert(self, orm_class, row: dict):
+        """Queue a plain append-only row for any mapped class"""
+        if self._put(("row", orm_class, row)):
+            self.enqueued += 1
+
+    def _put(self, item: tuple) -> bool:
+        self.start()
+        # Called from async request handlers: blocking on a full queue (database behind)
+        # would stall the event loop, so the item is dropped and counted instead
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                print(f"⚠️  Chat log queue full ({self._queue.maxsize}): {self.dropped} item(s) dropped so far")
+            return False
+
+    # Lifecycle
+
+    def start(self):
+        """Start the flusher thread (no-op once stop() was called: later items wait for flush/stop)"""
+        if self._stopped or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._start_lock:
+            if self._stopped or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+            self._thread.start()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far is written; returns False on timeout"""
+        if self._thread is None or not self._thread.is_alive():
+            self._drain()
+            return self._queue.unfinished_tasks == 0
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the flusher thread for good after writing whatever is still queued"""
+        with self._start_lock:
+            self._stopped = True
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._drain()
+
+    # Consumer side
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+        self._drain()
+
+    def _collect(self) -> List[tuple]:
+        """Block for the first item, then gather up to batch_size items within the flush interval"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch: List[tuple]):
+        started = time.perf_counter()
+        try:
+            errors = [self._commit(batch)]
+            if errors[0] is not None and len(batch) > 1:
+                # Isolate the bad rows: the valid logs (and their rollup deltas) are kept
+                print(f"⚠️  Chat log batch of {len(batch)} failed ({errors[0]}), retrying item by item")
+                self.retried_batches += 1
+                errors = [self._commit([item]) for item in batch]
+            errors = [error for error in errors if error is not None]
+            if errors:
+                self.failed += len(errors)
+                print(f"⚠️  {len(errors)} chat log item(s) dropped: {errors[0]}")
+            self.batches += 1
+            self.last_batch_size = len(batch)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def _commit(self, batch: List[tuple]) -> Optional[Exception]:
+        """
+        Write a batch in one transaction; returns the error if it was rolled back
+        Pending entries are only modified once the commit succeeded, so a failed
+        batch can be retried as is
+        """
+        db = self.session_factory()
+        try:
+            rows: Dict[int, ChatLogs] = {}
+            extra_rows = []
+            applied: List[tuple] = []
+            # intent/confidence of written rows as of this batch, for the rollup moves
+            state: Dict[int, tuple] = {}
+            rollup = RollupDelta()
+            orphans = 0
+            for op, entry, fields in batch:
+                if op == "insert":
+                    rows[id(entry)] = ChatLogs(**entry.to_row())
+                elif op == "row":
+                    extra_rows.append(entry(**fields))
+                elif id(entry) in rows:
+                    # Row still part of this batch: fold the update into the insert
+                    for name, value in fields.items():
+                        setattr(rows[id(entry)], name, value)
+                    applied.append((entry, fields))
+                elif entry.id is not None:
+                    old_intent, old_confidence = state.get(id(entry), (entry.intent, entry.confidence))
+                    new_intent = fields.get("intent", old_intent)
+                    new_confidence = fields.get("confidence", old_confidence)
+                    db.execute(update(ChatLogs).where(ChatLogs.id == entry.id).values(**fields))
+                    rollup.move(entry.created_at, entry.direction, old_intent, old_confidence,
+                                new_intent, new_confidence)
+                    state[id(entry)] = (new_intent, new_confidence)
+                    applied.append((entry, fields))
+                else:
+                    # The insert of this row was dropped or failed: nothing to update
+                    orphans += 1
+
+            ids: Dict[int, int] = {}
+            if rows or extra_rows:
+                db.add_all(list(rows.values()) + extra_rows)
+                db.flush()
+                ids = {key: row.id for key, row in rows.items()}
+            for row in rows.values():
+                rollup.add(row.created_at, row.direction, row.intent, row.confidence)
+            if ROLLUPS_ENABLED:
+                apply_rollups(db, rollup)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            return e
+        finally:
+            db.close()
+
+        for op, entry, _ in batch:
+            if op == "insert":
+                entry.id = ids[id(entry)]
+        for entry, fields in applied:
+            for name, value in fields.items():
+                setattr(entry, name, value)
+        self.written += len(rows) + len(extra_rows)
+        self.updated += len(applied)
+        if orphans:
+            self.orphaned_updates += orphans
+            print(f"⚠️  {orphans} chat log update(s) discarded: their row was never written")
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": CHAT_LOG_WRITE_BEHIND,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "batch_size": self.batch_size,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "updates": self.updated,
+            "batches": self.batches,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "orphaned_updates": self.orphaned_updates,
+            "retried_batches": self.retried_batches,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": self.last_flush_ms
+        }
+
+# Global writer instance
+chat_log_writer = ChatLogWriter()
+
+# Never lose queued logs on interpreter exit (shutdown hook covers the normal path)
+atexit.register(chat_log_writer.stop)
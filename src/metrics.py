@@ -0,0 +1,355 @@
+"""
+In-Process Metrics for KodiBOT
+Lock-protected histograms and counters rendered in Prometheus text format,
+plus LLM usage accounting (tokens, latency, cost) per intent, endpoint and operation.
+Recording a sample is a perf_counter call, a dict lookup and a short lock.
+"""
+
+import bisect
+import os
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Request-scoped labels for LLM calls (set by the endpoints, read by openai_client)
+llm_endpoint: ContextVar[str] = ContextVar("llm_endpoint", default="internal")
+llm_intent: ContextVar[str] = ContextVar("llm_intent", default="unclassified")
+
+def set_llm_context(endpoint: Optional[str] = None, intent: Optional[str] = None):
+    """Label the LLM calls made by the current request"""
+    if endpoint is not None:
+        llm_endpoint.set(endpoint)
+    if intent is not None:
+        llm_intent.set(intent)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Fixed-bucket histogram (seconds by default) with quantile estimates"""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None when empty)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99)
+        }
+
+# Prometheus text exposition
+
+REGISTRY: List["_Metric"] = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[tuple, float] = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] += amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}"
+            for labels, value in items
+        ]
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+class LabeledHistogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self._children: Dict[tuple, Histogram] = {}
+
+    def labels(self, *labels) -> Histogram:
+        child = self._children.get(labels)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labels, Histogram(self.buckets))
+        return child
+
+    def observe(self, value: float, *labels):
+        self.labels(*labels).observe(value)
+
+    def time(self, *labels) -> _Timer:
+        """Context manager observing the elapsed wall-clock seconds"""
+        return _Timer(self.labels(*labels))
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            children = sorted(self._children.items())
+        for labels, histogram in children:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = ("le", _format_number(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_number(histogram.sum)}")
+            lines.append(f"{self.name}_count{label_text} {histogram.count}")
+        return lines
+
+class CallbackMetric(_Metric):
+    """Gauge or counter whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[tuple, float]]], type_name: str = "gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+        self.type_name = type_name
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}"
+            for labels, value in self.collect()
+        ]
+
+def render_prometheus() -> str:
+    """All registered metrics in Prometheus text exposition format (0.0.4)"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+    return "\n".join(lines) + "\n"
+
+# Chat flow metrics
+CHAT_STAGE_SECONDS = LabeledHistogram(
+    "kodibot_chat_stage_seconds", "Duration of each step of the chat flow", ("stage",)
+)
+CHAT_REQUEST_SECONDS = LabeledHistogram(
+    "kodibot_chat_request_seconds", "End-to-end chat request duration", ("endpoint",)
+)
+CHAT_REQUESTS = Counter(
+    "kodibot_chat_requests_total", "Chat requests by intent and outcome", ("endpoint", "intent", "outcome")
+)
+DB_QUERIES = Counter(
+    "kodibot_db_queries_total", "SQL statements executed", ("engine",)
+)
+LLM_CALLS = Counter(
+    "kodibot_llm_calls_total", "OpenAI calls by operation and outcome", ("operation", "outcome")
+)
+LLM_CALL_SECONDS = LabeledHistogram(
+    "kodibot_llm_call_seconds", "OpenAI call latency", ("operation",)
+)
+LLM_FALLBACKS = Counter(
+    "kodibot_llm_fallbacks_total", "Degraded responses after an OpenAI failure", ("kind", "reason")
+)
+
+def instrument_engine(engine, label: str):
+    """Count every statement executed on a (sync) engine"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_query(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERIES.inc(label)
+
+# USD per million tokens: (input, cached input, output)
+MODEL_PRICING: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+}
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """Cost in USD of one call (0 for models missing from MODEL_PRICING)"""
+    pricing = MODEL_PRICING.get(model)
+    if pricing is None:
+        # Dated snapshots ("gpt-4o-mini-2024-07-18") share the base model price
+        pricing = next((price for name, price in MODEL_PRICING.items() if model.startswith(name + "-")), None)
+    if pricing is None:
+        return 0.0
+    input_price, cached_price, output_price = pricing
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+class _UsageBucket:
+    __slots__ = ("calls", "outcomes", "prompt_tokens", "completion_tokens", "cached_tokens", "cost_usd", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost_usd = 0.0
+        self.latency = Histogram()
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "outcomes": dict(self.outcomes),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "latency_seconds": self.latency.snapshot()
+        }
+
+LLM_USAGE_PERSIST = os.getenv("LLM_USAGE_PERSIST", "false").lower() == "true"
+
+class LLMUsageTracker:
+    """
+    Aggregates every OpenAI call by endpoint, intent and operation
+    Rows can also be persisted to llm_usage through the write-behind writer
+    """
+
+    def __init__(self, persist: bool = LLM_USAGE_PERSIST):
+        self.persist = persist
+        self._buckets: Dict[Tuple[str, str, str, str], _UsageBucket] = defaultdict(_UsageBucket)
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, model: str, outcome: str, latency: float,
+               prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0):
+        endpoint, intent = llm_endpoint.get(), llm_intent.get()
+        cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        with self._lock:
+            bucket = self._buckets[(endpoint, intent, operation, model)]
+            bucket.calls += 1
+            bucket.outcomes[outcome] += 1
+            bucket.prompt_tokens += prompt_tokens
+            bucket.completion_tokens += completion_tokens
+            bucket.cached_tokens += cached_tokens
+            bucket.cost_usd += cost
+        bucket.latency.observe(latency)
+        LLM_CALLS.inc(operation, outcome)
+        LLM_CALL_SECONDS.observe(latency, operation)
+
+        if self.persist:
+            from .database import LLMUsage
+            from .log_writer import chat_log_writer
+            chat_log_writer.insert(LLMUsage, {
+                "created_at": datetime.utcnow(),
+                "endpoint": endpoint,
+                "intent": intent,
+                "operation": operation,
+                "model": model,
+                "outcome": outcome,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cached_tokens": cached_tokens,
+                "latency_ms": round(latency * 1000, 2),
+                "cost_usd": cost
+            })
+
+    def summary(self, group_by: str = "intent") -> dict:
+        """Totals plus one aggregate per value of group_by (endpoint, intent, operation or model)"""
+        fields = ("endpoint", "intent", "operation", "model")
+        if group_by not in fields:
+            raise ValueError(f"group_by must be one of: {', '.join(fields)}")
+        position = fields.index(group_by)
+
+        groups: Dict[str, _UsageBucket] = defaultdict(_UsageBucket)
+        total = _UsageBucket()
+        with self._lock:
+            items = list(self._buckets.items())
+        for key, bucket in items:
+            for target in (groups[key[position]], total):
+                target.calls += bucket.calls
+                for outcome, count in bucket.outcomes.items():
+                    target.outcomes[outcome] += count
+                target.prompt_tokens += bucket.prompt_tokens
+                target.completion_tokens += bucket.completion_tokens
+                target.cached_tokens += bucket.cached_tokens
+                target.cost_usd += bucket.cost_usd
+                for index, count in enumerate(bucket.latency.counts):
+                    target.latency.counts[index] += count
+                target.latency.count += bucket.latency.count
+                target.latency.sum += bucket.latency.sum
+
+        ranked = sorted(groups.items(), key=lambda item: item[1].cost_usd, reverse=True)
+        return {
+            "group_by": group_by,
+            "total": total.snapshot(),
+            "groups": [{group_by: name, **bucket.snapshot()} for name, bucket in ranked]
+        }
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+# Global tracker instance
+llm_usage = LLMUsageTracker()
@@ -0,0 +1,147 @@
+"""
+Versioned Schema Migrations for KodiBOT
+create_all() only creates missing tables. Changes to existing tables (new
+indexes, new columns) are numbered migrations, recorded in schema_migrations
+once applied, so databases created by older versions, including the shipped
+kodibot.db, catch up without losing data.
+
+Migrations must be idempotent (IF NOT EXISTS, column checks): SQLite does not
+always run DDL inside the transaction, and a fresh database already has the
+objects create_all() made from the models.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+class MigrationError(Exception):
+    """A migration cannot be applied to the current data"""
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+MIGRATIONS: List[Migration] = []
+
+def migration(version: int, name: str):
+    """Register an upgrade function as schema version `version`"""
+    def register(upgrade: Callable[[Connection], None]):
+        if any(existing.version == version for existing in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append(Migration(version, name, upgrade))
+        MIGRATIONS.sort(key=lambda item: item.version)
+        return upgrade
+    return register
+
+# Helpers for upgrade functions
+
+def create_index(connection: Connection, name: str, table: str, columns: Sequence[str], unique: bool = False):
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    connection.exec_driver_sql(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+def add_column(connection: Connection, table: str, column: str, ddl_type: str):
+    """ALTER TABLE ... ADD COLUMN unless the column already exists"""
+    existing = {info["name"] for info in inspect(connection).get_columns(table)}
+    if column not in existing:
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+
+def ensure_unique(connection: Connection, table: str, column: str):
+    """Refuse to build a unique index over duplicated values (they must be resolved by hand)"""
+    duplicates = connection.exec_driver_sql(
+        f"SELECT {column}, COUNT(*) FROM {table} WHERE {column} IS NOT NULL "
+        f"GROUP BY {column} HAVING COUNT(*) > 1 LIMIT 5"
+    ).fetchall()
+    if duplicates:
+        sample = ", ".join(f"{value} (x{count})" for value, count in duplicates)
+        raise MigrationError(f"{table}.{column} has duplicate values: {sample}")
+
+# Migrations
+
+@migration(1, "Indexes for hot chat, tax, parcel and analytics queries")
+def _hot_query_indexes(connection: Connection):
+    create_index(connection, "ix_taxes_citizen_id", "taxes", ["citizen_id"])
+    create_index(connection, "ix_parcels_citizen_id", "parcels", ["citizen_id"])
+    # Target of the kcaf_records foreign key
+    ensure_unique(connection, "parcels", "parcel_number")
+    create_index(connection, "ix_parcels_parcel_number", "parcels", ["parcel_number"], unique=True)
+    create_index(connection, "ix_chat_logs_phone_number", "chat_logs", ["phone_number"])
+    create_index(connection, "ix_chat_logs_created_at", "chat_logs", ["created_at"])
+    create_index(connection, "ix_chat_logs_direction_intent", "chat_logs", ["direction", "intent"])
+
+@migration(2, "Index linked_users.citizen_id for the citizen directory join")
+def _linked_users_citizen_index(connection: Connection):
+    create_index(connection, "ix_linked_users_citizen_id", "linked_users", ["citizen_id"])
+
+@migration(3, "K-CAF client_version and idempotency_token for collector upserts")
+def _kcaf_upsert_columns(connection: Connection):
+    add_column(connection, "kcaf_records", "client_version", "INTEGER")
+    add_column(connection, "kcaf_records", "idempotency_token", "VARCHAR")
+
+@migration(4, "chat_logs.intent_source for classifier training labels")
+def _chat_log_intent_source(connection: Connection):
+    add_column(connection, "chat_logs", "intent_source", "VARCHAR(20)")
+
+@migration(5, "Seed chat_log_rollups from the chat_logs history")
+def _seed_chat_log_rollups(connection: Connection):
+    # Without it /analytics/* stay empty on databases that logged chats before the rollups;
+    # the whole history, current hour included, is recounted in this transaction
+    from .rollups import seed_rollups
+    seed_rollups(connection)
+
+# Runner
+
+_CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(200) NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+)
+"""
+
+def _applied_versions(engine: Engine) -> dict:
+    with engine.begin() as connection:
+        connection.exec_driver_sql(_CREATE_VERSION_TABLE)
+        rows = connection.execute(text("SELECT version, applied_at FROM schema_migrations")).fetchall()
+    return {version: applied_at for version, applied_at in rows}
+
+def migration_status(engine: Engine) -> List[dict]:
+    applied = _applied_versions(engine)
+    return [
+        {"version": item.version, "name": item.name, "applied_at": applied.get(item.version)}
+        for item in MIGRATIONS
+    ]
+
+def run_migrations(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """
+    Apply pending migrations in version order (up to target), one transaction each
+    Raises on the first failure, so the app never starts on a half-migrated schema;
+    returns the versions applied by this call
+    """
+    applied = _applied_versions(engine)
+    done: List[int] = []
+    for item in MIGRATIONS:
+        if item.version in applied or (target is not None and item.version > target):
+            continue
+        try:
+            with engine.begin() as connection:
+                item.upgrade(connection)
+                connection.execute(
+                    text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                    {"version": item.version, "name": item.name, "applied_at": datetime.utcnow()}
+                )
+        except Exception as e:
+            # Another worker may have recorded the same version first (the upgrade itself is
+            # idempotent); an IntegrityError that left the version unrecorded is a real failure
+            if isinstance(e, IntegrityError) and item.version in _applied_versions(engine):
+                continue
+            print(f"❌ Migration {item.version} ({item.name}) failed: {e}")
+            raise
+        print(f"🧱 Applied migration {item.version}: {item.name}")
+        done.append(item.version)
+    return done
@@ -1,48 +1,15 @@
 import json
+import os
+import re
+from typing import Dict, Any, Optional
 from .prompts import MAIN_SYSTEM_PROMPT, INTENT_SYSTEM_PROMPT
-from .openai_client import get_client
-
-chat_logs = []
-
-def generate_answer(prompt, system_prompt=MAIN_SYSTEM_PROMPT):
-    chat_logs.append({
-        "role": "user",
-        "content": prompt
-    })
-
-    try:
-        client = get_client()
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.2
-        )
-
-        response = completion.choices[0].message.content
+from .openai_client import create_completion, acreate_completion, astream_completion, CircuitOpenError
+from .intent_classifier import classify_locally
+from .cache import TTLCache, SQLiteCacheStore, normalize_message, fingerprint
+from .metrics import LLM_FALLBACKS
+from .conversation_store import conversation_store
 
-        chat_logs.append({
-            "role": "assistant",
-            "content": response
-        })
-
-        print(chat_logs)
-        return response
-        
-    except Exception as e:
-        # Handle OpenAI quota exceeded or other API errors
-        error_str = str(e)
-        if "insufficient_quota" in error_str or "429" in error_str:
-            print(f"⚠️  OpenAI quota exceeded, returning service unavailable message")
-            quota_message = """🔧 **KodiBOT est temporairement indisponible**
+QUOTA_MESSAGE = """🔧 **KodiBOT est temporairement indisponible**
 
 Notre service IA est actuellement en maintenance pour cause de limite d'utilisation atteinte.
 
@@ -54,30 +21,238 @@ En attendant, vous pouvez :
 • Revenir plus tard sur la plateforme Kodinet
 
 Merci de votre compréhension ! 🙏"""
-            
-            chat_logs.append({
-                "role": "assistant", 
-                "content": quota_message
-            })
-            return quota_message
-        else:
-            print(f"⚠️  OpenAI error: {e}, returning generic error message")
-            error_message = """❌ **Erreur technique temporaire**
+
+ERROR_MESSAGE = """❌ **Erreur technique temporaire**
 
 Désolé, une erreur technique s'est produite.
 
 🔄 **Veuillez réessayer dans quelques instants**
 
 Si le problème persiste, contactez l'assistance technique."""
-            
-            chat_logs.append({
-                "role": "assistant",
-                "content": error_message
-            })
-            return error_message
 
-import re
-from typing import Dict, Any
+def is_quota_error(error: Exception) -> bool:
+    """Check if an OpenAI error is a quota / rate limit error"""
+    if isinstance(error, CircuitOpenError):
+        return error.reason == "quota"
+    error_str = str(error)
+    return "insufficient_quota" in error_str or "429" in error_str
+
+def is_degraded_answer(answer: Optional[str]) -> bool:
+    """True for the quota/error messages sent in place of an LLM answer"""
+    return answer in (QUOTA_MESSAGE, ERROR_MESSAGE)
+
+class StreamInterrupted(Exception):
+    """The answer stream failed after some text was sent: the partial answer is not a complete reply"""
+    def __init__(self, partial: str, cause: Exception):
+        super().__init__(f"answer stream interrupted after {len(partial)} characters: {cause}")
+        self.partial = partial
+        self.cause = cause
+
+def _failure_reason(error: Exception) -> str:
+    """Label of an OpenAI failure for the fallback counters"""
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    return "quota" if is_quota_error(error) else "error"
+
+def _build_answer_messages(prompt, system_prompt, phone_number: Optional[str] = None):
+    """Build the chat messages for answer generation (with the phone's recent turns, if any)"""
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        *conversation_store.history(phone_number),
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+def _record_answer(response, prompt, phone_number: Optional[str] = None):
+    """Track the exchange in the phone's conversation history"""
+    conversation_store.record_exchange(phone_number, prompt, response)
+    return response
+
+def _answer_error_message(e: Exception) -> str:
+    """Handle OpenAI quota exceeded or other API errors"""
+    LLM_FALLBACKS.inc("answer", _failure_reason(e))
+    if is_quota_error(e):
+        print(f"⚠️  OpenAI quota exceeded, returning service unavailable message")
+        message = QUOTA_MESSAGE
+    else:
+        print(f"⚠️  OpenAI error: {e}, returning generic error message")
+        message = ERROR_MESSAGE
+
+    return message
+
+def generate_answer(prompt, system_prompt=MAIN_SYSTEM_PROMPT, phone_number: Optional[str] = None):
+    try:
+        completion = create_completion(
+            "answer",
+            model="gpt-4o-mini",
+            messages=_build_answer_messages(prompt, system_prompt, phone_number),
+            temperature=0.2
+        )
+
+        return _record_answer(completion.choices[0].message.content, prompt, phone_number)
+        
+    except Exception as e:
+        return _answer_error_message(e)
+
+async def generate_answer_async(prompt, system_prompt=MAIN_SYSTEM_PROMPT, phone_number: Optional[str] = None):
+    """Async variant of generate_answer using the AsyncOpenAI client"""
+    try:
+        completion = await acreate_completion(
+            "answer",
+            model="gpt-4o-mini",
+            messages=_build_answer_messages(prompt, system_prompt, phone_number),
+            temperature=0.2
+        )
+
+        return _record_answer(completion.choices[0].message.content, prompt, phone_number)
+
+    except Exception as e:
+        return _answer_error_message(e)
+
+async def stream_answer_async(prompt, system_prompt=MAIN_SYSTEM_PROMPT, phone_number: Optional[str] = None):
+    """
+    Stream the answer as text chunks using OpenAI streaming
+    If the call fails before any token, the quota/error message is yielded instead;
+    if it fails midway, StreamInterrupted is raised (the partial answer is not recorded)
+    """
+    chunks = []
+    try:
+        stream = astream_completion(
+            "stream",
+            model="gpt-4o-mini",
+            messages=_build_answer_messages(prompt, system_prompt, phone_number),
+            temperature=0.2
+        )
+
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                chunks.append(delta)
+                yield delta
+
+    except Exception as e:
+        if not chunks:
+            yield _answer_error_message(e)
+            return
+        LLM_FALLBACKS.inc("answer", _failure_reason(e))
+        print(f"⚠️  OpenAI stream interrupted: {e}, partial answer discarded")
+        raise StreamInterrupted("".join(chunks), e) from e
+
+    _record_answer("".join(chunks), prompt, phone_number)
+
+async def generate_lead_async(message: str, system_prompt: str) -> Optional[str]:
+    """
+    One-sentence lead for a hybrid template answer
+    Returns None on failure: the templated answer is then sent on its own
+    """
+    try:
+        completion = await acreate_completion(
+            "lead",
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": message}
+            ],
+            temperature=0.3,
+            max_tokens=60
+        )
+        lead = (completion.choices[0].message.content or "").strip()
+        return lead or None
+
+    except Exception as e:
+        LLM_FALLBACKS.inc("lead", _failure_reason(e))
+        print(f"⚠️  OpenAI lead sentence failed: {e}, sending the template alone")
+        return None
+
+# Answer cache: (citizen_id, intent, normalized message) -> (context fingerprint, answer)
+# An entry is only served while the citizen data it was generated from is unchanged.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+answer_cache = TTLCache(
+    "answers",
+    max_size=int(os.getenv("ANSWER_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "900"))
+)
+
+def _answer_cache_key(citizen_id, intent, message, history=None):
+    # The prompt carries the phone's recent turns: an answer is only reused for the same conversation
+    return (str(citizen_id), intent, normalize_message(message), fingerprint(history) if history else "")
+
+def get_cached_answer(citizen_id, intent, message, context_data, history=None):
+    """Return a cached answer if the context (and conversation history) it was built from has not changed"""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    context_hash = fingerprint(context_data)
+    # Entries generated from different citizen data are dropped on lookup
+    entry = answer_cache.get(
+        _answer_cache_key(citizen_id, intent, message, history),
+        validate=lambda cached: cached[0] == context_hash
+    )
+    return entry[1] if entry else None
+
+def cache_answer(citizen_id, intent, message, context_data, answer, history=None):
+    """
+    Store a generated answer (error and quota messages are never cached)
+    history is the conversation history the answer was generated with, as read before the exchange
+    """
+    if not ANSWER_CACHE_ENABLED or not answer or is_degraded_answer(answer):
+        return
+    answer_cache.set(_answer_cache_key(citizen_id, intent, message, history), (fingerprint(context_data), answer))
+
+# Intent memo: normalized message -> LLM classification (temperature 0, so deterministic)
+INTENT_CACHE_ENABLED = os.getenv("INTENT_CACHE_ENABLED", "true").lower() == "true"
+intent_cache = TTLCache(
+    "intents",
+    max_size=int(os.getenv("INTENT_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("INTENT_CACHE_TTL", "86400"))
+)
+_intent_cache_store: Optional[SQLiteCacheStore] = None
+
+def load_intent_cache():
+    """Attach the SQLite store when INTENT_CACHE_PERSIST=true and warm the memo from it"""
+    global _intent_cache_store
+    if not INTENT_CACHE_ENABLED or os.getenv("INTENT_CACHE_PERSIST", "false").lower() != "true":
+        return
+    _intent_cache_store = SQLiteCacheStore(os.getenv("INTENT_CACHE_DB", "intent_cache.db"), "intent_cache")
+    loaded = 0
+    for key, value, remaining_ttl in _intent_cache_store.load(intent_cache.max_size):
+        intent_cache.set(key, value, ttl=remaining_ttl)
+        loaded += 1
+    print(f"🗂️  Intent cache warmed with {loaded} entries")
+
+def _get_memoized_intent(user_message: str, slots: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Cached classification for this normalized message, with fresh rule-based slots merged in"""
+    if not INTENT_CACHE_ENABLED:
+        return None
+    cached = intent_cache.get(normalize_message(user_message))
+    if cached is None:
+        return None
+    merged_slots = dict(cached["slots"])
+    for k, v in slots.items():
+        merged_slots.setdefault(k, v)
+    # Only LLM classifications are memoized
+    return {"intent": cached["intent"], "confidence": cached["confidence"], "slots": merged_slots, "source": "llm"}
+
+def _memoize_intent(user_message: str, result: Dict[str, Any]):
+    """Remember a successful LLM classification"""
+    if not INTENT_CACHE_ENABLED:
+        return
+    key = normalize_message(user_message)
+    result = {"intent": result["intent"], "confidence": result["confidence"], "slots": dict(result["slots"])}
+    intent_cache.set(key, result)
+    if _intent_cache_store is not None:
+        try:
+            _intent_cache_store.save(key, result, intent_cache.ttl)
+        except Exception as e:
+            print(f"⚠️  Intent cache persist failed: {e}")
+
+from .keyword_matcher import KeywordMatcher
 
 INTENT_CATEGORIES = [
     "greeting",
@@ -90,112 +265,127 @@ INTENT_CATEGORIES = [
     "fallback"
 ]
 
+# Rule-based intent keywords. A message scores the summed weight of the distinct
+# patterns it contains (default weight 1.0); the highest score wins and equal
+# scores go to the higher priority.
+FALLBACK_INTENT_RULES = {
+    "greeting": {
+        "priority": 1, "confidence": 0.9,
+        "patterns": ["bonjour", "salut", "hello", "bonsoir", "comment allez-vous"]
+    },
+    "goodbye": {
+        "priority": 2, "confidence": 0.9,
+        "patterns": ["au revoir", "à bientôt", "merci beaucoup", "bonne journée", "bye"]
+    },
+    "profile": {
+        "priority": 3, "confidence": 0.8,
+        "patterns": ["mon nom", "mon adresse", "ma date", "mes informations", "profil"]
+    },
+    "tax_info": {
+        "priority": 4, "confidence": 0.8,
+        "patterns": ["taxe", "impôt", "solde", "montant dû", "paiement", "fiscal"]
+    },
+    "parcels": {
+        "priority": 5, "confidence": 0.8,
+        "patterns": ["parcelle", "bien", "propriété", "terrain", "cadastr"]
+    },
+    "procedures": {
+        "priority": 6, "confidence": 0.8,
+        "patterns": ["permis", "passeport", "carte", "certificat", "renouveler", "procédure"]
+    },
+    "linking": {
+        "priority": 7, "confidence": 0.8,
+        "patterns": ["lier", "liaison", "connecter", "associer", "numéro de citoyen"]
+    },
+}
+
+PROCEDURE_SLOT_KEYWORDS = ["permis", "passeport", "carte", "certificat", "renouveler", "demande"]
+
+# Compiled once at import
+CITIZEN_ID_REGEX = re.compile(r"\b(CIT\d{8,10}|\d{8,10})\b")
+PARCEL_ID_REGEX = re.compile(r"\bP-[A-Za-z0-9]+\b")
+
+def _compile_intent_matcher() -> KeywordMatcher:
+    """Build the automaton over every intent pattern; payload is (intent, weight)"""
+    entries = []
+    for intent, rule in FALLBACK_INTENT_RULES.items():
+        for pattern in rule["patterns"]:
+            # Patterns may be given as (text, weight) to boost strong keywords
+            text, weight = pattern if isinstance(pattern, tuple) else (pattern, 1.0)
+            entries.append((text.lower(), (intent, weight)))
+    return KeywordMatcher(entries)
+
+INTENT_MATCHER = _compile_intent_matcher()
+PROCEDURE_SLOT_MATCHER = KeywordMatcher(
+    (keyword, rank) for rank, keyword in enumerate(PROCEDURE_SLOT_KEYWORDS)
+)
+
+def _score_intents(message_lower: str) -> Dict[str, float]:
+    """
+    Sum the weights of the distinct patterns found, per intent
+    A match nested inside a longer match ("bien" in "à bientôt") is ignored
+    """
+    matches = list(INTENT_MATCHER.iter_matches(message_lower))
+    scores: Dict[str, float] = {}
+    seen = set()
+    for start, pattern, (intent, weight) in matches:
+        end = start + len(pattern)
+        if pattern in seen or any(
+            other_start <= start and end <= other_start + len(other) and len(other) > len(pattern)
+            for other_start, other, _ in matches
+        ):
+            continue
+        seen.add(pattern)
+        scores[intent] = scores.get(intent, 0.0) + weight
+    return scores
+
 def get_intent_fallback(user_message: str) -> Dict[str, Any]:
     """
     Fallback intent classifier when OpenAI is not available
-    Uses rule-based classification
+    Uses rule-based classification: every intent is scored in one pass of the
+    compiled keyword automaton, ties are broken by rule priority
     """
-    message_lower = user_message.lower()
-    slots = {}
-    
-    # Extract slots using regex
-    import re
-    
-    # citizen ID: 8-10 digits or CIT prefix
-    cid_match = re.search(r"\b(CIT\d{8,10}|\d{8,10})\b", user_message)
-    if cid_match:
-        slots["citizen_id"] = cid_match.group(1)
-    
-    # parcel ID pattern: P-XXXXX or similar
-    parcel_match = re.search(r"\bP-[A-Za-z0-9]+\b", user_message)
-    if parcel_match:
-        slots["parcel_id"] = parcel_match.group(0)
-    
-    # procedure name extraction
-    procedure_keywords = ["permis", "passeport", "carte", "certificat", "renouveler", "demande"]
-    for keyword in procedure_keywords:
-        if keyword.lower() in message_lower:
-            slots["procedure_name"] = keyword
-            break
+    slots = _extract_slots(user_message)
     
     # Rule-based intent classification
     intent = "fallback"
     confidence = 0.7  # Medium confidence for rule-based
     
-    # Greeting patterns
-    greeting_patterns = ["bonjour", "salut", "hello", "bonsoir", "comment allez-vous"]
-    if any(pattern in message_lower for pattern in greeting_patterns):
-        intent = "greeting"
-        confidence = 0.9
-    
-    # Goodbye patterns
-    goodbye_patterns = ["au revoir", "à bientôt", "merci beaucoup", "bonne journée", "bye"]
-    if any(pattern in message_lower for pattern in goodbye_patterns):
-        intent = "goodbye"
-        confidence = 0.9
-    
-    # Profile patterns
-    profile_patterns = ["mon nom", "mon adresse", "ma date", "mes informations", "profil"]
-    if any(pattern in message_lower for pattern in profile_patterns):
-        intent = "profile"
-        confidence = 0.8
-    
-    # Tax info patterns
-    tax_patterns = ["taxe", "impôt", "solde", "montant dû", "paiement", "fiscal"]
-    if any(pattern in message_lower for pattern in tax_patterns):
-        intent = "tax_info"
-        confidence = 0.8
-    
-    # Parcels patterns
-    parcel_patterns = ["parcelle", "bien", "propriété", "terrain", "cadastr"]
-    if any(pattern in message_lower for pattern in parcel_patterns):
-        intent = "parcels"
-        confidence = 0.8
-    
-    # Procedures patterns
-    procedure_patterns = ["permis", "passeport", "carte", "certificat", "renouveler", "procédure"]
-    if any(pattern in message_lower for pattern in procedure_patterns):
-        intent = "procedures"
-        confidence = 0.8
-    
-    # Linking patterns
-    linking_patterns = ["lier", "liaison", "connecter", "associer", "numéro de citoyen"]
-    if any(pattern in message_lower for pattern in linking_patterns):
-        intent = "linking"
-        confidence = 0.8
+    scores = _score_intents(user_message.lower())
+    if scores:
+        intent = max(scores, key=lambda name: (scores[name], FALLBACK_INTENT_RULES[name]["priority"]))
+        confidence = FALLBACK_INTENT_RULES[intent]["confidence"]
     
     return {
         "intent": intent,
         "confidence": confidence,
-        "slots": slots
+        "slots": slots,
+        "source": "rules"
     }
 
-def get_intent(user_message: str) -> Dict[str, Any]:
-    """
-    Classifies the user's intent and extracts relevant slots.
-    Returns a dictionary: {"intent": str, "confidence": float, "slots": dict}
-    """
-    # First, try a quick rule-based slot extraction:
+def _extract_slots(user_message: str) -> Dict[str, Any]:
+    """Quick rule-based slot extraction"""
     slots = {}
     
     # citizen ID: 8-10 digits or CIT prefix
-    cid_match = re.search(r"\b(CIT\d{8,10}|\d{8,10})\b", user_message)
+    cid_match = CITIZEN_ID_REGEX.search(user_message)
     if cid_match:
         slots["citizen_id"] = cid_match.group(1)
     
     # parcel ID pattern: P-XXXXX or similar
-    parcel_match = re.search(r"\bP-[A-Za-z0-9]+\b", user_message)
+    parcel_match = PARCEL_ID_REGEX.search(user_message)
     if parcel_match:
         slots["parcel_id"] = parcel_match.group(0)
     
-    # procedure name extraction
-    procedure_keywords = ["permis", "passeport", "carte", "certificat", "renouveler", "demande"]
-    for keyword in procedure_keywords:
-        if keyword.lower() in user_message.lower():
-            slots["procedure_name"] = keyword
-            break
-
-    # Build the LLM prompt
+    # procedure name extraction (first keyword in list order wins)
+    ranks = [rank for _, _, rank in PROCEDURE_SLOT_MATCHER.iter_matches(user_message.lower())]
+    if ranks:
+        slots["procedure_name"] = PROCEDURE_SLOT_KEYWORDS[min(ranks)]
+
+    return slots
+
+def _build_intent_messages(user_message: str):
+    """Build the LLM messages for intent classification"""
     intent_prompt = f"""
 Classifie l'intention de l'utilisateur (uniquement une de ces catégories) et renvoie aussi un score de confiance et les slots extraits:
 {', '.join(INTENT_CATEGORIES)}
@@ -206,49 +396,185 @@ Réponds en JSON EXACT, sans explications :
 Message utilisateur :
 \"\"\"{user_message}\"\"\"
 """
+    return [
+        {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+        {"role": "user", "content": intent_prompt}
+    ]
+
+def _parse_intent_content(content: str, slots: Dict[str, Any]) -> Dict[str, Any]:
+    """Parse the LLM JSON answer and merge rule-based slots"""
+    parsed = json.loads(content.strip())
+    intent = parsed.get("intent", "fallback")
+    confidence = float(parsed.get("confidence", 0.0))
+    llm_slots = parsed.get("slots", {})
+    
+    # Merge rule-based slots but do not override LLM slots
+    for k, v in slots.items():
+        if k not in llm_slots:
+            llm_slots[k] = v
+
+    # Enforce valid intent
+    if intent not in INTENT_CATEGORIES:
+        intent = "fallback"
+
+    return {
+        "intent": intent,
+        "confidence": confidence,
+        "slots": llm_slots,
+        "source": "llm"
+    }
+
+def _classify_locally(user_message: str, slots: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Use the trained local model when it is above its confidence threshold"""
+    local = classify_locally(user_message)
+    if not local or local[0] not in INTENT_CATEGORIES:
+        return None
+    intent, confidence = local
+    return {
+        "intent": intent,
+        "confidence": round(confidence, 4),
+        "slots": slots,
+        "source": "local"
+    }
+
+def classify_without_llm(user_message: str) -> Optional[Dict[str, Any]]:
+    """
+    Free classification: a confident local classifier, else the intent memo
+    Returns None when only an LLM call can classify the message
+    """
+    slots = _extract_slots(user_message)
+    return _classify_locally(user_message, slots) or _get_memoized_intent(user_message, slots)
+
+def _intent_error_fallback(e: Exception, user_message: str, kind: str = "intent") -> Dict[str, Any]:
+    """Fallback to rule-based classification when OpenAI fails"""
+    LLM_FALLBACKS.inc(kind, _failure_reason(e))
+    if is_quota_error(e):
+        print(f"⚠️  OpenAI quota exceeded, using fallback classifier")
+    else:
+        print(f"⚠️  OpenAI error: {e}, using fallback classifier")
+    return get_intent_fallback(user_message)
+
+def get_intent(user_message: str) -> Dict[str, Any]:
+    """
+    Classifies the user's intent and extracts relevant slots.
+    Returns a dictionary: {"intent": str, "confidence": float, "slots": dict}
+    """
+    # First, try a quick rule-based slot extraction
+    slots = _extract_slots(user_message)
+
+    # Confident local classifier answers skip the LLM entirely
+    local_result = _classify_locally(user_message, slots)
+    if local_result:
+        return local_result
+
+    # Same normalized message already classified by the LLM
+    memoized = _get_memoized_intent(user_message, slots)
+    if memoized:
+        return memoized
 
     # Try OpenAI first, fallback to rule-based if quota exceeded
     try:
-        client = get_client()
-        completion = client.chat.completions.create(
+        completion = create_completion(
+            "intent",
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": INTENT_SYSTEM_PROMPT},
-                {"role": "user", "content": intent_prompt}
-            ],
+            messages=_build_intent_messages(user_message),
             temperature=0.0,
             max_tokens=100
         )
         
-        content = (completion.choices[0].message.content or "").strip()
-        
-        # Parse JSON safely
-        parsed = json.loads(content)
-        intent = parsed.get("intent", "fallback")
-        confidence = float(parsed.get("confidence", 0.0))
-        llm_slots = parsed.get("slots", {})
-        
-        # Merge rule-based slots but do not override LLM slots
-        for k, v in slots.items():
-            if k not in llm_slots:
-                llm_slots[k] = v
-
-        # Enforce valid intent
-        if intent not in INTENT_CATEGORIES:
-            intent = "fallback"
-
-        return {
-            "intent": intent,
-            "confidence": confidence,
-            "slots": llm_slots
-        }
+        result = _parse_intent_content(completion.choices[0].message.content or "", slots)
+        _memoize_intent(user_message, result)
+        return result
         
     except Exception as e:
-        # Check if it's a quota error
-        error_str = str(e)
-        if "insufficient_quota" in error_str or "429" in error_str:
-            print(f"⚠️  OpenAI quota exceeded, using fallback classifier")
-            return get_intent_fallback(user_message)
-        else:
-            print(f"⚠️  OpenAI error: {e}, using fallback classifier")
-            return get_intent_fallback(user_message)
\ No newline at end of file
+        return _intent_error_fallback(e, user_message)
+
+async def get_intent_async(user_message: str) -> Dict[str, Any]:
+    """
+    Async variant of get_intent using the AsyncOpenAI client.
+    Returns a dictionary: {"intent": str, "confidence": float, "slots": dict}
+    """
+    slots = _extract_slots(user_message)
+
+    local_result = _classify_locally(user_message, slots)
+    if local_result:
+        return local_result
+
+    memoized = _get_memoized_intent(user_message, slots)
+    if memoized:
+        return memoized
+
+    try:
+        completion = await acreate_completion(
+            "intent",
+            model="gpt-4o-mini",
+            messages=_build_intent_messages(user_message),
+            temperature=0.0,
+            max_tokens=100
+        )
+
+        result = _parse_intent_content(completion.choices[0].message.content or "", slots)
+        _memoize_intent(user_message, result)
+        return result
+
+    except Exception as e:
+        return _intent_error_fallback(e, user_message)
+
+def _parse_combined_content(content: str, slots: Dict[str, Any]) -> Dict[str, Any]:
+    """Parse the combined JSON answer: intent fields plus the final answer"""
+    result = _parse_intent_content(content, slots)
+    answer = json.loads(content.strip()).get("answer")
+    result["answer"] = answer.strip() if isinstance(answer, str) and answer.strip() else None
+    return result
+
+def _combined_error_fallback(e: Exception, user_message: str) -> Dict[str, Any]:
+    """Rule-based intent without answer; the caller falls back to the two-step flow"""
+    result = _intent_error_fallback(e, user_message, kind="combined")
+    result["answer"] = None
+    return result
+
+def get_intent_and_answer(user_message: str, system_prompt: str) -> Dict[str, Any]:
+    """
+    Classifies the intent AND generates the final answer in one LLM round trip.
+    Returns {"intent": str, "confidence": float, "slots": dict, "answer": Optional[str]}
+    """
+    slots = _extract_slots(user_message)
+
+    try:
+        completion = create_completion(
+            "combined",
+            model="gpt-4o-mini",
+            messages=_build_answer_messages(user_message, system_prompt),
+            response_format={"type": "json_object"},
+            temperature=0.2
+        )
+
+        result = _parse_combined_content(completion.choices[0].message.content or "", slots)
+        _memoize_intent(user_message, result)
+        return result
+
+    except Exception as e:
+        return _combined_error_fallback(e, user_message)
+
+async def get_intent_and_answer_async(user_message: str, system_prompt: str) -> Dict[str, Any]:
+    """
+    Async variant of get_intent_and_answer.
+    Returns {"intent": str, "confidence": float, "slots": dict, "answer": Optional[str]}
+    """
+    slots = _extract_slots(user_message)
+
+    try:
+        completion = await acreate_completion(
+            "combined",
+            model="gpt-4o-mini",
+            messages=_build_answer_messages(user_message, system_prompt),
+            response_format={"type": "json_object"},
+            temperature=0.2
+        )
+
+        result = _parse_combined_content(completion.choices[0].message.content or "", slots)
+        _memoize_intent(user_message, result)
+        return result
+
+    except Exception as e:
+        return _combined_error_fallback(e, user_message)
@@ -5,6 +5,7 @@ from datetime import datetime
 class ChatRequest(BaseModel):
     phone_number: str
     message: str
+    message_id: Optional[str] = None  # Provider message id, used to drop redelivered webhooks
 
 class ChatResponse(BaseModel):
     response: Optional[str] = None
@@ -38,7 +39,7 @@ class KCAF_Apartment(BaseModel):
     date_debut_contrat: Optional[str] = None
     date_fin_contrat: Optional[str] = None
 
-class KCAF_RecordCreate(BaseModel):
+class KCAF_RecordBase(BaseModel):
     parcel_number: str
     nature_propriete: str
     usage_principal: str
@@ -69,10 +70,35 @@ class KCAF_RecordCreate(BaseModel):
     etat: str
     numero_collecteur: str
 
-class KCAF_RecordResponse(KCAF_RecordCreate):
+class KCAF_RecordCreate(KCAF_RecordBase):
+    # Upsert: the newest client_version (or, without one, the newest updated_at) wins;
+    # a resent submission with the same idempotency_token is a no-op
+    client_version: Optional[int] = None
+    idempotency_token: Optional[str] = None
+    updated_at: Optional[datetime] = None  # Collector's last edit time
+
+class KCAF_RecordResponse(KCAF_RecordBase):
+    # The idempotency_token is an internal dedup key: it is never sent back
     id: int
+    client_version: Optional[int] = None
     created_at: datetime
     updated_at: datetime
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class KCAF_BulkRowResult(BaseModel):
+    index: int  # Position of the row in the request body
+    parcel_number: Optional[str] = None
+    status: str  # created, updated, unchanged, duplicate, invalid
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class KCAF_BulkResponse(BaseModel):
+    total: int
+    created: int
+    updated: int = 0
+    unchanged: int = 0
+    duplicate: int
+    invalid: int
+    results: List[KCAF_BulkRowResult]
@@ -3,18 +3,23 @@ Centralized OpenAI Client Configuration
 Eliminates duplication and ensures consistent error handling
 """
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, BadRequestError
+import asyncio
+import hashlib
+import json
 import os
+import threading
+import time
+from typing import Dict, Optional
 from dotenv import load_dotenv
+from .metrics import llm_usage, Counter, CallbackMetric
+from .logger import log_openai
 
 # Load environment variables
 load_dotenv()
 
-def get_openai_client() -> OpenAI:
-    """
-    Get a configured OpenAI client instance
-    Centralized configuration with proper error handling
-    """
+def _get_api_key() -> str:
+    """Read the OpenAI API key or fail with a helpful message"""
     api_key = os.getenv("OPENAI_API_KEY")
     
     if not api_key:
@@ -23,7 +28,21 @@ def get_openai_client() -> OpenAI:
             "Please add it to your .env file: OPENAI_API_KEY=sk-proj-..."
         )
     
-    return OpenAI(api_key=api_key)
+    return api_key
+
+def get_openai_client() -> OpenAI:
+    """
+    Get a configured OpenAI client instance
+    Centralized configuration with proper error handling
+    """
+    return OpenAI(api_key=_get_api_key())
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Get a configured AsyncOpenAI client instance
+    Used by the async chat pipeline so LLM calls never block the event loop
+    """
+    return AsyncOpenAI(api_key=_get_api_key())
 
 def validate_openai_config() -> tuple[bool, str]:
     """
@@ -43,12 +62,304 @@ def validate_openai_config() -> tuple[bool, str]:
     except Exception as e:
         return False, f"❌ Erreur validation OpenAI: {e}"
 
-# Global client instance (lazy loading)
+# Global client instances (lazy loading)
 _client = None
+_async_client = None
 
 def get_client() -> OpenAI:
     """Get the global OpenAI client instance (singleton pattern)"""
     global _client
     if _client is None:
         _client = get_openai_client()
-    return _client 
\ No newline at end of file
+    return _client
+
+def get_async_client() -> AsyncOpenAI:
+    """Get the global AsyncOpenAI client instance (singleton pattern)"""
+    global _async_client
+    if _async_client is None:
+        _async_client = get_async_openai_client()
+    return _async_client
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling OpenAI while the circuit breaker is open"""
+    
+    def __init__(self, reason: str, retry_in: float):
+        self.reason = reason  # kind of the failures that opened the circuit: quota or error
+        self.retry_in = retry_in
+        super().__init__(f"OpenAI circuit open after repeated {reason} failures, retry in {retry_in:.0f}s")
+
+# Registered once: every breaker instance shares these families
+LLM_CIRCUIT_TRANSITIONS = Counter(
+    "kodibot_llm_circuit_transitions_total", "OpenAI circuit breaker state changes", ("to",)
+)
+LLM_CIRCUIT_REJECTIONS = Counter(
+    "kodibot_llm_circuit_rejections_total", "OpenAI calls skipped while the circuit was open"
+)
+
+class CircuitBreaker:
+    """
+    Shared breaker for all OpenAI calls (sync and async)
+    closed: calls go through; failure_threshold consecutive failures open it
+    open: calls fail immediately with CircuitOpenError for cooldown seconds
+    half_open: one probe call is let through; success (or a 400 answer) closes, failure re-opens
+    """
+    
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0, enabled: bool = True):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.enabled = enabled
+        self.state = self.CLOSED
+        self.failures = 0
+        self.last_failure_reason = "error"
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.transitions = LLM_CIRCUIT_TRANSITIONS
+        self.rejections = LLM_CIRCUIT_REJECTIONS
+    
+    def _move(self, state: str):
+        if state != self.state:
+            self.state = state
+            self.transitions.inc(state)
+            print(f"⚡ OpenAI circuit breaker {state}")
+    
+    def before_call(self) -> bool:
+        """
+        Raise CircuitOpenError when the call must not reach OpenAI
+        Returns True when the call is the half-open probe: the caller must then end it with
+        record_success, record_failure(..., probe=True) or abandon_probe
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self._move(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+        self.rejections.inc()
+        raise CircuitOpenError(self.last_failure_reason, max(0.0, remaining))
+    
+    def record_success(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.failures = 0
+            self._probe_in_flight = False
+            self._move(self.CLOSED)
+    
+    def record_failure(self, error: Exception, probe: bool = False):
+        if not self.enabled or isinstance(error, CircuitOpenError):
+            return
+        if isinstance(error, BadRequestError):
+            # Malformed requests say nothing bad about OpenAI's health, but a probe that got one reached it
+            if probe:
+                self.record_success()
+            return
+        with self._lock:
+            self.failures += 1
+            self.last_failure_reason = _call_outcome(error)
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self._move(self.OPEN)
+    
+    def abandon_probe(self):
+        """The probe ended without a verdict (cancelled, stream closed early): let the next call probe"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "cooldown_seconds": self.cooldown,
+            "last_failure_reason": self.last_failure_reason
+        }
+
+circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+    cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+    enabled=os.getenv("LLM_BREAKER_ENABLED", "true").lower() == "true"
+)
+
+_CIRCUIT_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+CallbackMetric("kodibot_llm_circuit_state", "OpenAI circuit breaker state (0 closed, 1 half-open, 2 open)", (),
+               lambda: [((), _CIRCUIT_STATE_VALUES[circuit_breaker.state])])
+
+def _call_outcome(error: Exception) -> str:
+    error_str = str(error)
+    return "quota" if "insufficient_quota" in error_str or "429" in error_str else "error"
+
+def _record_usage(operation: str, model: str, started: float, usage=None, error: Exception = None):
+    """Account one call in the usage tracker and the OpenAI log (never fails the call)"""
+    try:
+        _account_call(operation, model, started, usage, error)
+    except Exception as e:
+        print(f"⚠️  Could not record OpenAI usage: {e}")
+
+def _account_call(operation: str, model: str, started: float, usage, error: Exception):
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    llm_usage.record(
+        operation=operation,
+        model=model,
+        outcome="success" if error is None else _call_outcome(error),
+        latency=time.perf_counter() - started,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_tokens=cached_tokens
+    )
+    log_openai(operation, model, prompt_tokens + completion_tokens, error)
+
+def _create_completion(operation: str, **params):
+    probe = circuit_breaker.before_call()
+    started = time.perf_counter()
+    model = params.get("model", "")
+    try:
+        completion = get_client().chat.completions.create(**params)
+    except Exception as e:
+        circuit_breaker.record_failure(e, probe)
+        _record_usage(operation, model, started, error=e)
+        raise
+    except BaseException:
+        if probe:
+            circuit_breaker.abandon_probe()
+        raise
+    circuit_breaker.record_success()
+    _record_usage(operation, getattr(completion, "model", None) or model, started, completion.usage)
+    return completion
+
+async def _acreate_completion(operation: str, **params):
+    probe = circuit_breaker.before_call()
+    started = time.perf_counter()
+    model = params.get("model", "")
+    try:
+        completion = await get_async_client().chat.completions.create(**params)
+    except Exception as e:
+        circuit_breaker.record_failure(e, probe)
+        _record_usage(operation, model, started, error=e)
+        raise
+    except BaseException:
+        if probe:
+            circuit_breaker.abandon_probe()
+        raise
+    circuit_breaker.record_success()
+    _record_usage(operation, getattr(completion, "model", None) or model, started, completion.usage)
+    return completion
+
+# Single-flight: identical (model, messages, params) requests already in flight share
+# one upstream call and its result. Streaming calls are never coalesced.
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "true").lower() == "true"
+LLM_COALESCED = Counter(
+    "kodibot_llm_coalesced_total", "OpenAI requests served by an identical in-flight call", ("operation",)
+)
+
+def _flight_key(params: dict) -> str:
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+class _SyncFlight:
+    __slots__ = ("done", "result", "error")
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[Exception] = None
+
+_sync_flights: Dict[str, _SyncFlight] = {}
+_sync_flights_lock = threading.Lock()
+_async_flights: Dict[str, "asyncio.Task"] = {}
+
+def create_completion(operation: str, **params):
+    """
+    Instrumented chat.completions.create on the global client
+    operation labels the call in usage metrics (answer, intent, combined)
+    """
+    if not LLM_SINGLE_FLIGHT:
+        return _create_completion(operation, **params)
+    
+    key = _flight_key(params)
+    with _sync_flights_lock:
+        flight = _sync_flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _sync_flights[key] = _SyncFlight()
+    
+    if not leader:
+        LLM_COALESCED.inc(operation)
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    
+    try:
+        flight.result = _create_completion(operation, **params)
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _sync_flights_lock:
+            _sync_flights.pop(key, None)
+        flight.done.set()
+
+def _forget_flight(key: str, task: "asyncio.Task"):
+    if _async_flights.get(key) is task:
+        del _async_flights[key]
+    if not task.cancelled():
+        task.exception()  # retrieved here so an unawaited failure is not reported twice
+
+async def acreate_completion(operation: str, **params):
+    """
+    Async variant of create_completion on the global AsyncOpenAI client
+    The upstream call runs in its own task, so a cancelled caller does not cancel it for the others
+    """
+    if not LLM_SINGLE_FLIGHT:
+        return await _acreate_completion(operation, **params)
+    
+    key = _flight_key(params)
+    task = _async_flights.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_acreate_completion(operation, **params))
+        _async_flights[key] = task
+        task.add_done_callback(lambda done: _forget_flight(key, done))
+    else:
+        LLM_COALESCED.inc(operation)
+    return await asyncio.shield(task)
+
+async def astream_completion(operation: str, **params):
+    """
+    Instrumented streaming completion: yields the raw chunks
+    Usage is requested in the final chunk and recorded once the stream ends
+    """
+    probe = circuit_breaker.before_call()
+    started = time.perf_counter()
+    model = params.get("model", "")
+    params = {**params, "stream": True, "stream_options": {"include_usage": True}}
+    usage = None
+    try:
+        stream = await get_async_client().chat.completions.create(**params)
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            yield chunk
+    except Exception as e:
+        circuit_breaker.record_failure(e, probe)
+        _record_usage(operation, model, started, usage, error=e)
+        raise
+    except BaseException:
+        # Cancelled, or the consumer closed the stream early (GeneratorExit)
+        if probe:
+            circuit_breaker.abandon_probe()
+        raise
+    circuit_breaker.record_success()
+    _record_usage(operation, model, started, usage)
@@ -3,6 +3,8 @@ KodiBOT System Prompts Management
 Centralized prompts to avoid duplication and ensure consistency
 """
 
+from .context_serializer import serialize_context, CONTEXT_TOKEN_BUDGET
+
 # Main comprehensive system prompt for chat responses
 MAIN_SYSTEM_PROMPT = """
 Vous êtes KodiBOT, un assistant virtuel spécialisé en fiscalité en République Démocratique du Congo (RDC) et dans les démarches administratives associées via la plateforme e-gouvernement Kodinet. Votre rôle est d'aider les citoyens à comprendre et traiter les questions relatives aux impôts (impôts foncier, taxes locales, déclarations fiscales, exonérations, etc.) et à accomplir les démarches administratives (paiement d'impôts, renouvellement de documents, procédures, assistance, etc.) dans le contexte congolais.
@@ -55,15 +57,18 @@ Vous recevrez des données contextuelles incluant les informations du citoyen (n
 # Intent classification system prompt
 INTENT_SYSTEM_PROMPT = "Tu es KodiBOT, un assistant gouvernemental. Réponds toujours en JSON."
 
-def build_contextualized_prompt(citizen_name: str, citizen_id: str, context_data: dict = None) -> str:
+def build_contextualized_prompt(citizen_name: str, citizen_id: str, context_data: dict = None,
+                                token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
     """
     Build a contextualized system prompt with user data
+    Context is serialized as compact lines, trimmed by relevance to token_budget
     """
+    context = serialize_context(context_data, token_budget)
     context_section = f"""
 UTILISATEUR: {citizen_name} (ID: {citizen_id})
 
 CONTEXTE DATA:
-{context_data if context_data else "Aucune donnée spécifique"}
+{context.text}
 
 INSTRUCTIONS SPÉCIFIQUES:
 - Réponds en français de manière claire et professionnelle
@@ -74,4 +79,33 @@ INSTRUCTIONS SPÉCIFIQUES:
 - Pour les montants, utilise le format "XXX FC" (Francs Congolais)
 """
     
-    return f"{MAIN_SYSTEM_PROMPT}\n\n{context_section}" 
\ No newline at end of file
+    return f"{MAIN_SYSTEM_PROMPT}\n\n{context_section}"
+
+# Output contract for the combined (single round trip) pipeline
+COMBINED_OUTPUT_INSTRUCTIONS = """
+FORMAT DE RÉPONSE (mode combiné):
+Classifie d'abord l'intention du message parmi: {categories}
+Puis rédige la réponse finale en français pour le citoyen, en utilisant UNIQUEMENT le contexte ci-dessus.
+Si le contexte ne contient pas les données nécessaires (détail des parcelles, procédures, statut E-Tax, etc.),
+n'invente rien : mets "answer": null, la réponse sera préparée à partir des données complètes.
+
+Réponds en JSON EXACT, sans explications :
+{{"intent":"<nom_intention>","confidence":<0.00-1.00>,"slots":{{ ... }},"answer":"<réponse finale en français>" ou null}}
+"""
+
+def build_combined_prompt(citizen_name: str, citizen_id: str, context_data: dict, categories: list) -> str:
+    """
+    Build the system prompt for the combined intent + answer request
+    """
+    base_prompt = build_contextualized_prompt(citizen_name, citizen_id, context_data)
+    return f"{base_prompt}\n{COMBINED_OUTPUT_INSTRUCTIONS.format(categories=', '.join(categories))}"
+
+# Lead sentence for hybrid template answers (the template carries every figure)
+LEAD_SYSTEM_PROMPT = """Tu es KodiBOT, l'assistant fiscal de la plateforme Kodinet (RDC).
+Écris UNE seule phrase d'introduction cordiale, en français, qui répond au ton de la question du citoyen.
+Ne cite AUCUN chiffre, montant, date ou numéro : le détail est ajouté après ta phrase.
+Maximum 25 mots, au plus un émoji."""
+
+def build_lead_prompt(citizen_name: str) -> str:
+    """System prompt for the one-sentence lead of a hybrid template answer"""
+    return f"{LEAD_SYSTEM_PROMPT}\n\nUTILISATEUR: {citizen_name}"
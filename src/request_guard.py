@@ -0,0 +1,89 @@
+"""
+Per-Phone Request Guard for KodiBOT
+Serializes the messages of one phone number (async keyed locks) and replays the
+stored reply when a message is redelivered, so gateway retries and double sends
+never run the chat pipeline twice.
+"""
+
+import asyncio
+import hashlib
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List, Optional
+
+from .cache import TTLCache, normalize_message
+
+# Provider message ids are unique: remember them for the whole retry horizon.
+# Without an id, identical text from the same phone is a duplicate only within a short window.
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+DUPLICATE_WINDOW = float(os.getenv("DUPLICATE_WINDOW", "30"))
+
+class KeyedLocks:
+    """
+    One asyncio.Lock per key, created on demand and dropped when nobody holds or waits on it
+    Must be used from a single event loop (one per worker process)
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, List] = {}
+
+    async def acquire(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._forget(key, entry)
+            raise
+
+    def release(self, key: Hashable):
+        entry = self._locks[key]
+        entry[0].release()
+        self._forget(key, entry)
+
+    def _forget(self, key: Hashable, entry: List):
+        entry[1] -= 1
+        if entry[1] == 0 and self._locks.get(key) is entry:
+            del self._locks[key]
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+phone_locks = KeyedLocks()
+
+# (phone_number, kind, id-or-hash) -> stored ChatResponse dict
+reply_cache = TTLCache("chat_replies", max_size=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "20000")), ttl=IDEMPOTENCY_TTL)
+
+def idempotency_key(phone_number: str, message: str, message_id: Optional[str] = None) -> tuple:
+    """Provider message id when given, otherwise a hash of the normalized text"""
+    if message_id:
+        return (phone_number, "id", message_id)
+    digest = hashlib.sha1(normalize_message(message).encode("utf-8")).hexdigest()
+    return (phone_number, "text", digest)
+
+def get_stored_reply(key: tuple) -> Optional[dict]:
+    return reply_cache.get(key)
+
+# Chat outcomes whose reply is replayed; errors, degraded LLM replies, low-confidence
+# fallbacks and failed lookups are not stored, so a retry can succeed
+REPLAYABLE_OUTCOMES = frozenset({"answered", "combined", "canned", "template", "cached", "hybrid", "linking"})
+
+def store_reply(key: tuple, reply: dict, outcome: Optional[str]):
+    """Remember a successful reply for redeliveries of the same message"""
+    if outcome not in REPLAYABLE_OUTCOMES or reply.get("error"):
+        return
+    reply_cache.set(key, reply, ttl=IDEMPOTENCY_TTL if key[1] == "id" else DUPLICATE_WINDOW)
+
+def forget_replies(phone_number: str) -> int:
+    """Drop the stored replies of one phone (its link state changed, so they are stale)"""
+    return reply_cache.invalidate_where(lambda key: key[0] == phone_number)
@@ -0,0 +1,222 @@
+"""
+Chat Log Rollups for KodiBOT
+Hourly aggregates of chat_logs per (intent, direction): messages, fallbacks and
+confidence sums. They are maintained incrementally in the same transaction that
+writes the logs, so analytics read a few rows per hour instead of scanning
+chat_logs. A schema migration seeds them from the logged history (up to the
+first live update); scripts/backfill_rollups.py rebuilds the closed hours from chat_logs.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import func, delete, select, or_
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .database import ChatLogs, ChatLogRollup, dialect_insert
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+
+# Same rule as the chat flow: low confidence or explicit fallback gets the help message
+FALLBACK_CONFIDENCE = 0.6
+
+_COUNTERS = ("message_count", "fallback_count", "confidence_sum", "confidence_count")
+
+# Live writers add to the current hour (and, through the write-behind queue, to the previous
+# one for a few seconds): the backfill only rebuilds hours closed before this margin
+BACKFILL_SETTLE = timedelta(minutes=5)
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def is_fallback(direction: str, intent: Optional[str], confidence: Optional[float]) -> bool:
+    if direction != "IN" or intent is None:
+        return False
+    return intent == "fallback" or (confidence is not None and confidence < FALLBACK_CONFIDENCE)
+
+class RollupDelta:
+    """Counter changes per (hour, intent, direction), applied with one upsert per key"""
+
+    def __init__(self):
+        self._changes: Dict[Tuple[datetime, str, str], List[float]] = defaultdict(lambda: [0, 0, 0.0, 0])
+
+    def add(self, created_at: Optional[datetime], direction: str, intent: Optional[str],
+            confidence: Optional[float], sign: int = 1):
+        """Count one chat log (sign=-1 takes back a previous count of the same row)"""
+        counters = self._changes[(hour_bucket(created_at or datetime.utcnow()), intent or "", direction)]
+        counters[0] += sign
+        counters[1] += sign if is_fallback(direction, intent, confidence) else 0
+        if confidence is not None:
+            counters[2] += sign * confidence
+            counters[3] += sign
+
+    def move(self, created_at: Optional[datetime], direction: str, old_intent: Optional[str],
+             old_confidence: Optional[float], new_intent: Optional[str], new_confidence: Optional[float]):
+        """A logged row was reclassified"""
+        self.add(created_at, direction, old_intent, old_confidence, sign=-1)
+        self.add(created_at, direction, new_intent, new_confidence)
+
+    def rows(self) -> List[dict]:
+        return [
+            {
+                "bucket_hour": hour, "intent": intent, "direction": direction,
+                **dict(zip(_COUNTERS, counters))
+            }
+            for (hour, intent, direction), counters in self._changes.items()
+            if any(counters)
+        ]
+
+    def __bool__(self) -> bool:
+        return bool(self._changes)
+
+def apply_rollups(db: Union[Session, Connection], delta: RollupDelta):
+    """Upsert the delta into chat_log_rollups (part of the caller's transaction)"""
+    rows = delta.rows()
+    if not rows:
+        return
+    table = ChatLogRollup.__table__
+    dialect = db.get_bind().dialect if isinstance(db, Session) else db.dialect
+    statement = dialect_insert(dialect.name, table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["bucket_hour", "intent", "direction"],
+        set_={name: table.c[name] + statement.excluded[name] for name in _COUNTERS}
+    )
+    db.execute(statement, rows)
+
+def delta_for_log(chat_log) -> RollupDelta:
+    delta = RollupDelta()
+    delta.add(chat_log.created_at, chat_log.direction, chat_log.intent, chat_log.confidence)
+    return delta
+
+def delta_for_reclassification(chat_log, intent: Optional[str], confidence: Optional[float]) -> RollupDelta:
+    delta = RollupDelta()
+    delta.move(chat_log.created_at, chat_log.direction, chat_log.intent, chat_log.confidence, intent, confidence)
+    return delta
+
+def _count_logs(db: Union[Session, Connection], delta: RollupDelta, since: Optional[datetime] = None,
+                before: Optional[datetime] = None, batch_size: int = 10000, undated: bool = False) -> int:
+    """
+    Add the chat_logs created in [since, before) to delta; returns the number of logs
+    undated also counts the rows without created_at (in the current hour, like RollupDelta.add)
+    """
+    statement = select(ChatLogs.created_at, ChatLogs.direction, ChatLogs.intent, ChatLogs.confidence)
+    if since is not None:
+        dated = ChatLogs.created_at >= since
+        statement = statement.where(or_(dated, ChatLogs.created_at.is_(None)) if undated else dated)
+    if before is not None:
+        statement = statement.where(ChatLogs.created_at < before)
+    counted = 0
+    for created_at, direction, intent, confidence in db.execute(statement.execution_options(yield_per=batch_size)):
+        delta.add(created_at, direction, intent, confidence)
+        counted += 1
+    return counted
+
+def backfill_rollups(db: Session, batch_size: int = 10000) -> int:
+    """
+    Rebuild the rollups of closed hours from chat_logs in one transaction; returns the number of logs counted
+    Hours before the oldest remaining log (archived days) keep their rollups, and the hours
+    live writers still add to are left to them, so no concurrent delta is overwritten
+    """
+    oldest = db.query(func.min(ChatLogs.created_at)).scalar()
+    closed_before = hour_bucket(datetime.utcnow() - BACKFILL_SETTLE)
+    if oldest is None or hour_bucket(oldest) >= closed_before:
+        return 0
+    since = hour_bucket(oldest)
+    delta = RollupDelta()
+    counted = _count_logs(db, delta, since, closed_before, batch_size)
+
+    db.execute(delete(ChatLogRollup).where(
+        ChatLogRollup.bucket_hour >= since, ChatLogRollup.bucket_hour < closed_before
+    ))
+    apply_rollups(db, delta)
+    db.commit()
+    return counted
+
+def seed_rollups(connection: Connection) -> int:
+    """
+    Rebuild the rollups of every hour still in chat_logs, the current one included; returns the number
+    of logs counted. Runs in the migration's transaction with the rollups locked first (the DELETE holds
+    the SQLite write lock; PostgreSQL takes a table lock): logs committed before are recounted, including
+    those of the first live hour written before live rollup updates started, and writers committing
+    after add their own deltas. Hours older than the oldest log (archived days) keep their rollups.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("LOCK TABLE chat_log_rollups IN EXCLUSIVE MODE")
+    oldest = connection.execute(select(func.min(ChatLogs.created_at))).scalar()
+    since = hour_bucket(min(oldest, datetime.utcnow()) if oldest else datetime.utcnow())
+    connection.execute(delete(ChatLogRollup).where(ChatLogRollup.bucket_hour >= since))
+    delta = RollupDelta()
+    counted = _count_logs(connection, delta, since, undated=True)
+    apply_rollups(connection, delta)
+    return counted
+
+# Queries
+
+def _since(hours: Optional[int]) -> Optional[datetime]:
+    return hour_bucket(datetime.utcnow()) - timedelta(hours=hours - 1) if hours else None
+
+def popular_intents(db: Session, hours: Optional[int] = None, limit: int = 10) -> List[dict]:
+    """Most frequent inbound intents, all time or over the last `hours` hours"""
+    total = func.sum(ChatLogRollup.message_count)
+    query = db.query(ChatLogRollup.intent, total.label("count")).filter(
+        ChatLogRollup.direction == "IN", ChatLogRollup.intent != ""
+    )
+    since = _since(hours)
+    if since is not None:
+        query = query.filter(ChatLogRollup.bucket_hour >= since)
+    results = query.group_by(ChatLogRollup.intent).having(total > 0).order_by(total.desc()).limit(limit).all()
+    return [{"intent": result.intent, "count": int(result.count)} for result in results]
+
+def _intent_stats(messages, fallbacks, confidence_sum, confidence_count) -> dict:
+    return {
+        "messages": int(messages or 0),
+        "fallbacks": int(fallbacks or 0),
+        "fallback_rate": round((fallbacks or 0) / messages, 4) if messages else 0.0,
+        "avg_confidence": round(confidence_sum / confidence_count, 4) if confidence_count else None
+    }
+
+def intent_summary(db: Session, hours: int) -> dict:
+    """Inbound messages, fallbacks and mean confidence per intent over the last `hours` hours"""
+    results = db.query(
+        ChatLogRollup.intent,
+        func.sum(ChatLogRollup.message_count),
+        func.sum(ChatLogRollup.fallback_count),
+        func.sum(ChatLogRollup.confidence_sum),
+        func.sum(ChatLogRollup.confidence_count)
+    ).filter(
+        ChatLogRollup.direction == "IN", ChatLogRollup.bucket_hour >= _since(hours)
+    ).group_by(ChatLogRollup.intent).all()
+
+    intents = {}
+    totals = [0, 0, 0.0, 0]
+    for intent, *sums in results:
+        intents[intent or "unclassified"] = _intent_stats(*sums)
+        totals = [total + (value or 0) for total, value in zip(totals, sums)]
+    return {
+        "hours": hours,
+        "total": _intent_stats(*totals),
+        "intents": dict(sorted(intents.items(), key=lambda item: -item[1]["messages"]))
+    }
+
+def daily_intents(db: Session, days: int) -> List[dict]:
+    """Inbound and outbound message counts per UTC day, with the inbound intent breakdown"""
+    since = hour_bucket(datetime.utcnow()).replace(hour=0) - timedelta(days=days - 1)
+    results = db.query(
+        ChatLogRollup.bucket_hour, ChatLogRollup.intent, ChatLogRollup.direction,
+        ChatLogRollup.message_count, ChatLogRollup.fallback_count
+    ).filter(ChatLogRollup.bucket_hour >= since).all()
+
+    by_day: Dict[str, dict] = {}
+    for bucket_hour, intent, direction, messages, fallbacks in results:
+        day = by_day.setdefault(bucket_hour.strftime("%Y-%m-%d"), {"inbound": 0, "outbound": 0, "fallbacks": 0, "intents": {}})
+        if direction == "IN":
+            day["inbound"] += messages
+            day["fallbacks"] += fallbacks
+            name = intent or "unclassified"
+            day["intents"][name] = day["intents"].get(name, 0) + messages
+        else:
+            day["outbound"] += messages
+    return [{"day": day, **stats} for day, stats in sorted(by_day.items())]
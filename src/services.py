@@ -4,13 +4,160 @@ Services for KodiBOT - Authentication, Data, and Logging
 
 import random
 import string
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func, event, case, and_, or_
 from sqlalchemy.orm import Session
-from .database import Citizens, LinkedUsers, Taxes, Parcels, Procedures, ChatLogs, KCAF_Records
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import (
+    Citizens, LinkedUsers, Taxes, Parcels, Procedures, ChatLogs, KCAF_Records, dialect_insert,
+    upsert_inserted_flag, begin_write
+)
 from .models import KCAF_RecordCreate
+from .cache import TTLCache
+from .request_guard import forget_replies, reply_cache
+from .log_writer import chat_log_writer, PendingChatLog, CHAT_LOG_WRITE_BEHIND
+from .rollups import ROLLUPS_ENABLED, apply_rollups, delta_for_log, delta_for_reclassification
 import json
+import os
 import uuid
-from typing import Optional
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+# Citizen context cache: (citizen_id, kind) -> dict built by DataService.
+# Entries are invalidated when Citizens/Taxes/Parcels/KCAF_Records rows of that
+# citizen are committed (see the session hooks below); the TTL only bounds
+# staleness from writes made by other processes. Cached dicts are shared: treat them as read-only.
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_KINDS = ("profile", "taxes", "parcels", "prefetch")
+context_cache = TTLCache(
+    "citizen_context",
+    max_size=int(os.getenv("CONTEXT_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("CONTEXT_CACHE_TTL", "600"))
+)
+
+def get_cached_context(citizen_id: str, kind: str):
+    if not CONTEXT_CACHE_ENABLED:
+        return None
+    return context_cache.get((str(citizen_id), kind))
+
+def cache_context(citizen_id: str, kind: str, data):
+    """Store a context dict (None results are not cached) and return it"""
+    if CONTEXT_CACHE_ENABLED and data is not None:
+        context_cache.set((str(citizen_id), kind), data)
+    return data
+
+def invalidate_citizen_context(citizen_id: str):
+    """Drop every cached context dict of one citizen"""
+    for kind in CONTEXT_KINDS:
+        context_cache.invalidate((str(citizen_id), kind))
+
+# Identity cache: phone_number -> LinkedCitizen snapshot, or None for unlinked numbers.
+# Dropped by initiate_linking/verify_otp and by any committed LinkedUsers write for
+# that phone; Citizens writes clear it (names are part of the snapshot).
+# The stored chat replies of the phone go with it: they were built for the old link state.
+IDENTITY_CACHE_ENABLED = os.getenv("IDENTITY_CACHE_ENABLED", "true").lower() == "true"
+identity_cache = TTLCache(
+    "identities",
+    max_size=int(os.getenv("IDENTITY_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("IDENTITY_CACHE_TTL", "60"))
+)
+_IDENTITY_MISS = object()
+
+@dataclass(frozen=True)
+class LinkedCitizen:
+    """Read-only snapshot of a linked phone number and its citizen"""
+    phone_number: str
+    citizen_id: str
+    first_name: Optional[str]
+    last_name: Optional[str]
+    citizen_found: bool
+    
+    @property
+    def full_name(self) -> str:
+        return f"{self.first_name} {self.last_name}"
+
+def invalidate_identity(phone_number: str):
+    identity_cache.invalidate(phone_number)
+    forget_replies(phone_number)
+
+# Models whose writes change a citizen's cached context
+_CITIZEN_SCOPED_MODELS = (Citizens, Taxes, Parcels)
+_CONTEXT_MODELS = (Citizens, Taxes, Parcels, KCAF_Records)
+
+@event.listens_for(Session, "after_flush")
+def _collect_context_writes(session, flush_context):
+    """Remember which citizens were written in this transaction"""
+    touched = session.info.setdefault("context_citizens", set())
+    parcel_numbers = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, _CITIZEN_SCOPED_MODELS) and obj.citizen_id:
+            touched.add(str(obj.citizen_id))
+        elif isinstance(obj, KCAF_Records) and obj.parcel_number:
+            parcel_numbers.add(obj.parcel_number)
+        if isinstance(obj, LinkedUsers) and obj.phone_number:
+            session.info.setdefault("identity_phones", set()).add(obj.phone_number)
+        elif isinstance(obj, Citizens):
+            session.info["identity_clear_all"] = True
+    if parcel_numbers:
+        rows = session.execute(
+            select(Parcels.citizen_id).where(Parcels.parcel_number.in_(parcel_numbers))
+        )
+        touched.update(str(citizen_id) for (citizen_id,) in rows if citizen_id)
+
+def _mark_parcels_written(session, parcel_numbers):
+    """Core statements skip the flush hook: record the citizens owning these parcels"""
+    if not parcel_numbers:
+        return
+    rows = session.execute(select(Parcels.citizen_id).where(Parcels.parcel_number.in_(list(parcel_numbers))))
+    session.info.setdefault("context_citizens", set()).update(str(citizen_id) for (citizen_id,) in rows if citizen_id)
+
+def _kcaf_row(record: KCAF_RecordCreate, now: datetime) -> dict:
+    """Column values for inserting/upserting a K-CAF record"""
+    row = record.dict()
+    updated_at = row["updated_at"]
+    if updated_at is not None and updated_at.tzinfo is not None:
+        updated_at = updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+    # A collector clock set in the future must not lock the record against later edits
+    row["updated_at"] = min(updated_at, now) if updated_at else now
+    row["created_at"] = now
+    return row
+
+# Bookkeeping columns left out when comparing a submission with the stored record
+_KCAF_META_COLUMNS = {"id", "parcel_number", "created_at", "updated_at", "client_version", "idempotency_token"}
+
+def _kcaf_same_content(row: dict, stored) -> bool:
+    """True when a submission's field values match the stored record (compared in Python: JSON columns)"""
+    return all(row[name] == stored[name] for name in row.keys() - _KCAF_META_COLUMNS if name in stored)
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_context_writes(orm_execute_state):
+    """Bulk INSERT/UPDATE/DELETE statements on context tables cannot be scoped: clear everything"""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in _CONTEXT_MODELS:
+        orm_execute_state.session.info["context_clear_all"] = True
+    if mapper is not None and mapper.class_ in (Citizens, LinkedUsers):
+        orm_execute_state.session.info["identity_clear_all"] = True
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_context_on_commit(session):
+    if session.info.pop("context_clear_all", False):
+        context_cache.clear()
+    for citizen_id in session.info.pop("context_citizens", ()):
+        invalidate_citizen_context(citizen_id)
+    if session.info.pop("identity_clear_all", False):
+        identity_cache.clear()
+        reply_cache.clear()
+    for phone_number in session.info.pop("identity_phones", ()):
+        invalidate_identity(phone_number)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_context_writes(session):
+    session.info.pop("context_clear_all", None)
+    session.info.pop("context_citizens", None)
+    session.info.pop("identity_clear_all", None)
+    session.info.pop("identity_phones", None)
 
 class AuthService:
     @staticmethod
@@ -21,11 +168,7 @@ class AuthService:
     @staticmethod
     def is_user_linked(phone_number: str, db: Session) -> bool:
         """Check if user is already linked"""
-        linked_user = db.query(LinkedUsers).filter(
-            LinkedUsers.phone_number == phone_number,
-            LinkedUsers.is_linked == True
-        ).first()
-        return linked_user is not None
+        return AuthService.resolve_linked_citizen(phone_number, db) is not None
     
     @staticmethod
     def get_citizen_by_phone(phone_number: str, db: Session):
@@ -44,6 +187,53 @@ class AuthService:
         
         return citizen
     
+    @staticmethod
+    def _linked_citizen_query(phone_number: str):
+        """Active link of a phone number joined to its citizen, in one SELECT"""
+        return select(
+            LinkedUsers.citizen_id, Citizens.first_name, Citizens.last_name, Citizens.citizen_id
+        ).outerjoin(
+            Citizens, Citizens.citizen_id == LinkedUsers.citizen_id
+        ).filter(
+            LinkedUsers.phone_number == phone_number,
+            LinkedUsers.is_linked == True
+        ).limit(1)
+    
+    @staticmethod
+    def _to_linked_citizen(phone_number: str, row) -> Optional[LinkedCitizen]:
+        if row is None:
+            return None
+        link_citizen_id, first_name, last_name, citizen_id = row
+        return LinkedCitizen(
+            phone_number=phone_number,
+            citizen_id=str(link_citizen_id),
+            first_name=first_name,
+            last_name=last_name,
+            citizen_found=citizen_id is not None
+        )
+    
+    @staticmethod
+    def _cached_identity(phone_number: str):
+        if not IDENTITY_CACHE_ENABLED:
+            return _IDENTITY_MISS
+        return identity_cache.get(phone_number, _IDENTITY_MISS)
+    
+    @staticmethod
+    def _cache_identity(phone_number: str, identity: Optional[LinkedCitizen]) -> Optional[LinkedCitizen]:
+        """Cache the resolution, including "not linked" results"""
+        if IDENTITY_CACHE_ENABLED:
+            identity_cache.set(phone_number, identity)
+        return identity
+    
+    @staticmethod
+    def resolve_linked_citizen(phone_number: str, db: Session) -> Optional[LinkedCitizen]:
+        """Link status and citizen of a phone number (None when not linked)"""
+        cached = AuthService._cached_identity(phone_number)
+        if cached is not _IDENTITY_MISS:
+            return cached
+        row = db.execute(AuthService._linked_citizen_query(phone_number)).first()
+        return AuthService._cache_identity(phone_number, AuthService._to_linked_citizen(phone_number, row))
+    
     @staticmethod
     def initiate_linking(phone_number: str, citizen_id: str, db: Session):
         """Start the linking process with OTP"""
@@ -61,22 +251,33 @@ class AuthService:
             LinkedUsers.phone_number == phone_number
         ).first()
         
+        new_link = AuthService._apply_linking_otp(existing_link, phone_number, citizen_id, otp, otp_expires)
+        if new_link is not None:
+            db.add(new_link)
+        
+        db.commit()
+        invalidate_identity(phone_number)
+        
+        return AuthService._linking_started(otp)
+    
+    @staticmethod
+    def _apply_linking_otp(existing_link, phone_number: str, citizen_id: str, otp: str, otp_expires: datetime):
+        """Update the pending link with a fresh OTP, returning a new row if none exists"""
         if existing_link:
             existing_link.citizen_id = citizen_id  # type: ignore
             existing_link.otp_code = otp  # type: ignore
             existing_link.otp_expires_at = otp_expires  # type: ignore
             existing_link.is_linked = False  # type: ignore
-        else:
-            new_link = LinkedUsers(
-                phone_number=phone_number,
-                citizen_id=citizen_id,
-                otp_code=otp,
-                otp_expires_at=otp_expires
-            )
-            db.add(new_link)
-        
-        db.commit()
-        
+            return None
+        return LinkedUsers(
+            phone_number=phone_number,
+            citizen_id=citizen_id,
+            otp_code=otp,
+            otp_expires_at=otp_expires
+        )
+    
+    @staticmethod
+    def _linking_started(otp: str):
         # For testing: return OTP in response (will be sent via SMS in production)
         return {
             "success": True, 
@@ -85,12 +286,8 @@ class AuthService:
         }
     
     @staticmethod
-    def verify_otp(phone_number: str, otp_code: str, db: Session):
-        """Verify OTP and complete linking"""
-        linked_user = db.query(LinkedUsers).filter(
-            LinkedUsers.phone_number == phone_number
-        ).first()
-        
+    def _check_and_complete_link(linked_user, otp_code: str):
+        """Validate the OTP against the pending link and complete it; returns the result dict"""
         if not linked_user:
             return {"success": False, "message": "Aucune demande de liaison trouvée"}
         
@@ -106,15 +303,26 @@ class AuthService:
         linked_user.otp_code = None  # type: ignore
         linked_user.otp_expires_at = None  # type: ignore
         
-        db.commit()
-        
         return {"success": True, "message": "Liaison réussie!"}
+    
+    @staticmethod
+    def verify_otp(phone_number: str, otp_code: str, db: Session):
+        """Verify OTP and complete linking"""
+        linked_user = db.query(LinkedUsers).filter(
+            LinkedUsers.phone_number == phone_number
+        ).first()
+        
+        result = AuthService._check_and_complete_link(linked_user, otp_code)
+        if result["success"]:
+            db.commit()
+            invalidate_identity(phone_number)
+        
+        return result
 
 class DataService:
     @staticmethod
-    def get_profile_data(citizen_id: str, db: Session):
-        """Fetch citizen profile data"""
-        citizen = db.query(Citizens).filter(Citizens.citizen_id == citizen_id).first()
+    def _format_profile(citizen):
+        """Build the profile dict from a Citizens row"""
         if not citizen:
             return None
         
@@ -126,10 +334,17 @@ class DataService:
         }
     
     @staticmethod
-    def get_tax_data(citizen_id: str, db: Session):
-        """Fetch tax information"""
-        taxes = db.query(Taxes).filter(Taxes.citizen_id == citizen_id).all()
-        
+    def get_profile_data(citizen_id: str, db: Session):
+        """Fetch citizen profile data"""
+        cached = get_cached_context(citizen_id, "profile")
+        if cached is not None:
+            return cached
+        citizen = db.query(Citizens).filter(Citizens.citizen_id == citizen_id).first()
+        return cache_context(citizen_id, "profile", DataService._format_profile(citizen))
+    
+    @staticmethod
+    def _format_taxes(taxes):
+        """Build the tax summary dict from Taxes rows"""
         tax_summary = []
         total_due = 0
         total_paid = 0
@@ -154,10 +369,17 @@ class DataService:
         }
     
     @staticmethod
-    def get_parcels_data(citizen_id: str, db: Session):
-        """Fetch parcel/property information"""
-        parcels = db.query(Parcels).filter(Parcels.citizen_id == citizen_id).all()
-        
+    def get_tax_data(citizen_id: str, db: Session):
+        """Fetch tax information"""
+        cached = get_cached_context(citizen_id, "taxes")
+        if cached is not None:
+            return cached
+        taxes = db.query(Taxes).filter(Taxes.citizen_id == citizen_id).all()
+        return cache_context(citizen_id, "taxes", DataService._format_taxes(taxes))
+    
+    @staticmethod
+    def _format_parcels(parcels):
+        """Build the parcels dict from Parcels rows"""
         parcels_list = []
         for parcel in parcels:
             parcels_list.append({
@@ -172,17 +394,51 @@ class DataService:
         return {"parcelles": parcels_list, "nombre_total": len(parcels_list)}
     
     @staticmethod
-    def get_procedures_data(procedure_name: str, db: Session):
-        """Fetch procedure information"""
-        if procedure_name:
-            procedure = db.query(Procedures).filter(
-                Procedures.name.ilike(f"%{procedure_name}%")
-            ).first()
-        else:
-            # Return most common procedures
-            procedures = db.query(Procedures).limit(5).all()
-            return {"procedures": [{"nom": p.name, "description": p.description} for p in procedures]}
-        
+    def get_parcels_data(citizen_id: str, db: Session):
+        """Fetch parcel/property information"""
+        cached = get_cached_context(citizen_id, "parcels")
+        if cached is not None:
+            return cached
+        parcels = db.query(Parcels).filter(Parcels.citizen_id == citizen_id).all()
+        return cache_context(citizen_id, "parcels", DataService._format_parcels(parcels))
+    
+    @staticmethod
+    def _format_prefetch(profile, tax_totals, parcel_count):
+        """Build the cheap per-citizen context used by the combined pipeline"""
+        total_due, total_paid, tax_count = tax_totals
+        return {
+            "profil": profile,
+            "resume_fiscal": {
+                "nombre_taxes": tax_count or 0,
+                "total_du": total_due or 0,
+                "total_paye": total_paid or 0,
+                "solde": (total_due or 0) - (total_paid or 0)
+            },
+            "nombre_parcelles": parcel_count or 0
+        }
+    
+    @staticmethod
+    def get_prefetch_context(citizen_id: str, db: Session):
+        """Fetch profile, tax totals and parcel count in aggregate queries"""
+        cached = get_cached_context(citizen_id, "prefetch")
+        if cached is not None:
+            return cached
+        tax_totals = db.query(
+            func.sum(Taxes.amount_due), func.sum(Taxes.amount_paid), func.count(Taxes.id)
+        ).filter(Taxes.citizen_id == citizen_id).one()
+        parcel_count = db.query(func.count(Parcels.id)).filter(Parcels.citizen_id == citizen_id).scalar()
+        return cache_context(citizen_id, "prefetch", DataService._format_prefetch(
+            DataService.get_profile_data(citizen_id, db), tuple(tax_totals), parcel_count
+        ))
+    
+    @staticmethod
+    def _format_procedure_list(procedures):
+        """Build the short procedures list dict"""
+        return {"procedures": [{"nom": p.name, "description": p.description} for p in procedures]}
+    
+    @staticmethod
+    def _format_procedure(procedure):
+        """Build the procedure dict from a Procedures row"""
         if not procedure:
             return None
         
@@ -195,23 +451,169 @@ class DataService:
             "cout": procedure.cost,
             "departement": procedure.department
         }
+    
+    @staticmethod
+    def get_procedures_data(procedure_name: str, db: Session):
+        """Fetch procedure information"""
+        if procedure_name:
+            procedure = db.query(Procedures).filter(
+                Procedures.name.ilike(f"%{procedure_name}%")
+            ).first()
+        else:
+            # Return most common procedures
+            procedures = db.query(Procedures).limit(5).all()
+            return DataService._format_procedure_list(procedures)
+        
+        return DataService._format_procedure(procedure)
 
     @staticmethod
     def create_kcaf_record(record_data: KCAF_RecordCreate, db: Session):
-        """Create a new K-CAF record for a parcel."""
-        existing_record = db.query(KCAF_Records).filter(KCAF_Records.parcel_number == record_data.parcel_number).first()
-        if existing_record:
+        """
+        Create a new K-CAF record for a parcel (INSERT ... ON CONFLICT DO NOTHING, no pre-check)
+        Returns None if the parcel already has a record, unless it was stored by a submission
+        with the same idempotency_token (a retry): the stored record is returned instead
+        """
+        table = KCAF_Records.__table__
+        statement = dialect_insert(db.get_bind().dialect.name, table).on_conflict_do_nothing(
+            index_elements=["parcel_number"]
+        ).returning(table.c.id)
+        record_id = db.execute(statement, _kcaf_row(record_data, datetime.utcnow())).scalar()
+        if record_id is None:
+            db.rollback()
+            existing = DataService.get_kcaf_record_by_parcel(record_data.parcel_number, db)
+            token = record_data.idempotency_token
+            if existing is not None and token and existing.idempotency_token == token:
+                return existing
             return None
 
-        record_dict = record_data.dict()
-        if record_data.appartements_details:
-            record_dict['appartements_details'] = [apt.dict() for apt in record_data.appartements_details]
+        _mark_parcels_written(db, [record_data.parcel_number])
+        db.commit()
+        return db.get(KCAF_Records, record_id)
+
+    @staticmethod
+    def bulk_create_kcaf_records(records: List[Tuple[int, KCAF_RecordCreate]], db: Session) -> List[dict]:
+        """
+        Insert one chunk of validated K-CAF records: one SELECT, one multi-row INSERT, one commit
+        Parcels that already have a record (or repeat within the chunk) are reported as duplicates
+        """
+        numbers = {record.parcel_number for _, record in records}
+        existing = {
+            number for (number,) in
+            db.query(KCAF_Records.parcel_number).filter(KCAF_Records.parcel_number.in_(numbers))
+        }
+        
+        results = []
+        pending = {}
+        rows = []
+        now = datetime.utcnow()
+        for index, record in records:
+            if record.parcel_number in existing or record.parcel_number in pending:
+                results.append({"index": index, "parcel_number": record.parcel_number, "status": "duplicate"})
+                continue
+            pending[record.parcel_number] = index
+            rows.append(_kcaf_row(record, now))
+        
+        inserted = {}
+        if rows:
+            table = KCAF_Records.__table__
+            # A concurrent sync may insert the same parcel between the SELECT and the INSERT
+            statement = dialect_insert(db.get_bind().dialect.name, table).on_conflict_do_nothing(
+                index_elements=["parcel_number"]
+            ).returning(table.c.id, table.c.parcel_number)
+            # executemany + RETURNING is sent as batched multi-row INSERTs ("insertmanyvalues")
+            inserted = {number: record_id for record_id, number in db.execute(statement, rows)}
+            _mark_parcels_written(db, inserted)
+            db.commit()
+        
+        for number, index in pending.items():
+            if number in inserted:
+                results.append({"index": index, "parcel_number": number, "status": "created", "id": inserted[number]})
+            else:
+                results.append({"index": index, "parcel_number": number, "status": "duplicate"})
+        results.sort(key=lambda result: result["index"])
+        return results
+
+    @staticmethod
+    def _kcaf_upsert_statement(db: Session):
+        """
+        INSERT ... ON CONFLICT (parcel_number) DO UPDATE, applied only when the submission is newer:
+        a higher client_version, or (unversioned) a later updated_at, and not a resent idempotency_token
+        """
+        table = KCAF_Records.__table__
+        statement = dialect_insert(db.get_bind().dialect.name, table)
+        new, current = statement.excluded, table.c
+        newer = or_(
+            and_(new.client_version.isnot(None),
+                 or_(current.client_version.is_(None), new.client_version > current.client_version)),
+            and_(new.client_version.is_(None), new.updated_at > current.updated_at)
+        )
+        not_replayed = or_(new.idempotency_token.is_(None), new.idempotency_token.is_distinct_from(current.idempotency_token))
+        
+        kept = {"id", "parcel_number", "created_at"}
+        set_ = {column.name: new[column.name] for column in table.columns if column.name not in kept}
+        set_["client_version"] = func.coalesce(new.client_version, current.client_version)
+        returned = [table.c.id, table.c.parcel_number]
+        inserted = upsert_inserted_flag(db.get_bind().dialect.name)
+        if inserted is not None:
+            returned.append(inserted)
+        return statement.on_conflict_do_update(
+            index_elements=["parcel_number"], set_=set_, where=and_(newer, not_replayed)
+        ).returning(*returned)
 
-        new_record = KCAF_Records(**record_dict)
-        db.add(new_record)
+    @staticmethod
+    def upsert_kcaf_records(records: List[Tuple[int, KCAF_RecordCreate]], db: Session) -> List[dict]:
+        """
+        Upsert one chunk of validated K-CAF records: one SELECT, one INSERT ... ON CONFLICT DO UPDATE, one commit
+        Each row is created, updated, or unchanged (stale version, resent submission, or an unversioned
+        submission identical to the stored record); a parcel repeated within the chunk is reported as duplicate
+        """
+        table = KCAF_Records.__table__
+        marks_inserts = upsert_inserted_flag(db.get_bind().dialect.name) is not None
+        if not marks_inserts:
+            # The stored rows read below then stay those the upsert meets (no concurrent writer)
+            begin_write(db)
+        numbers = {record.parcel_number for _, record in records}
+        existing = {
+            row["parcel_number"]: row for row in
+            db.execute(select(table).where(table.c.parcel_number.in_(numbers))).mappings()
+        }
+        
+        results = []
+        pending = {}
+        rows = []
+        now = datetime.utcnow()
+        for index, record in records:
+            if record.parcel_number in pending:
+                results.append({"index": index, "parcel_number": record.parcel_number, "status": "duplicate"})
+                continue
+            row = _kcaf_row(record, now)
+            stored = existing.get(record.parcel_number)
+            # Without a version, "newer" is only the submission time: an identical resend must not rewrite the record
+            if stored is not None and record.client_version is None and _kcaf_same_content(row, stored):
+                results.append({"index": index, "parcel_number": record.parcel_number, "status": "unchanged"})
+                continue
+            pending[record.parcel_number] = index
+            rows.append(row)
+        
+        written = {}
+        if rows:
+            # Skipped rows are not returned; inserted rows are told apart by the RETURNING marker,
+            # or by the SELECT made under the write lock
+            for returned in db.execute(DataService._kcaf_upsert_statement(db), rows):
+                inserted = returned.inserted if marks_inserts else returned.parcel_number not in existing
+                written[returned.parcel_number] = (returned.id, "created" if inserted else "updated")
+            _mark_parcels_written(db, written)
+        # Also ends a transaction that only read (releases the SQLite write lock)
         db.commit()
-        db.refresh(new_record)
-        return new_record
+        
+        for number, index in pending.items():
+            if number in written:
+                record_id, status = written[number]
+                results.append({"index": index, "parcel_number": number, "status": status, "id": record_id})
+            else:
+                results.append({"index": index, "parcel_number": number, "status": "unchanged"})
+        results.sort(key=lambda result: result["index"])
+        return results
 
     @staticmethod
     def get_kcaf_record_by_parcel(parcel_number: str, db: Session):
@@ -249,24 +651,76 @@ class DataService:
                                "Moyen" if etax_record["compliance_score"] >= 70 else "À améliorer"
         }
 
+    @staticmethod
+    def city_from_address(address: Optional[str]) -> str:
+        """City part of "street, city, country" addresses (RDC when unknown)"""
+        if not address or "," not in address:
+            return "RDC"
+        parts = address.rsplit(",", 2)
+        return parts[-2].strip() if len(parts) >= 2 else "RDC"
+    
+    @staticmethod
+    def get_citizen_directory_page(after_id: int, limit: int, db: Session):
+        """
+        Citizens with id > after_id in id order, with their link status
+        One keyset query: the linked_users outer join is aggregated per citizen
+        """
+        is_linked = func.max(case((LinkedUsers.is_linked == True, 1), else_=0))  # noqa: E712
+        return db.query(
+            Citizens.id,
+            Citizens.phone_number,
+            Citizens.citizen_id,
+            Citizens.first_name,
+            Citizens.last_name,
+            Citizens.address,
+            is_linked.label("is_linked")
+        ).outerjoin(
+            LinkedUsers, LinkedUsers.citizen_id == Citizens.citizen_id
+        ).filter(
+            Citizens.id > after_id
+        ).group_by(Citizens.id).order_by(Citizens.id).limit(limit).all()
+    
+    @staticmethod
+    def has_citizens_after(after_id: int, db: Session) -> bool:
+        return db.query(Citizens.id).filter(Citizens.id > after_id).first() is not None
+
 class LoggingService:
     @staticmethod
     def log_message(phone_number: str, message_text: str, direction: str, db: Session,
                    intent: Optional[str] = None, confidence: Optional[float] = None, 
                    citizen_id: Optional[str] = None):
-        """Log chat message"""
+        """Log chat message (queued to the write-behind writer unless disabled)"""
+        if CHAT_LOG_WRITE_BEHIND:
+            return chat_log_writer.log(phone_number, message_text, direction, intent, confidence, citizen_id)
+        
         chat_log = ChatLogs(
             phone_number=phone_number,
             citizen_id=citizen_id,
             message_text=message_text,
             direction=direction,
             intent=intent,
-            confidence=confidence
+            confidence=confidence,
+            created_at=datetime.utcnow()
         )
         db.add(chat_log)  # type: ignore
+        if ROLLUPS_ENABLED:
+            apply_rollups(db, delta_for_log(chat_log))
         db.commit()
         return chat_log
     
+    @staticmethod
+    def update_intent(chat_log, intent: str, confidence: float, db: Session, source: Optional[str] = None):
+        """Record the classified intent (and who produced it) on a logged inbound message"""
+        if isinstance(chat_log, PendingChatLog):
+            chat_log_writer.update(chat_log, intent=intent, confidence=confidence, intent_source=source)
+            return
+        if ROLLUPS_ENABLED:
+            apply_rollups(db, delta_for_reclassification(chat_log, intent, confidence))
+        chat_log.intent = intent
+        chat_log.confidence = confidence
+        chat_log.intent_source = source
+        db.commit()
+    
     @staticmethod
     def update_response_accuracy(log_id: int, accuracy: float, db: Session):
         """Update response accuracy score"""
@@ -275,6 +729,180 @@ class LoggingService:
             chat_log.response_accuracy = accuracy  # type: ignore
             db.commit()
 
+class AsyncAuthService:
+    """Async variant of AuthService for the non-blocking chat pipeline"""
+    
+    @staticmethod
+    async def _get_active_link(phone_number: str, db: AsyncSession):
+        result = await db.execute(
+            select(LinkedUsers).filter(
+                LinkedUsers.phone_number == phone_number,
+                LinkedUsers.is_linked == True
+            ).limit(1)
+        )
+        return result.scalars().first()
+    
+    @staticmethod
+    async def is_user_linked(phone_number: str, db: AsyncSession) -> bool:
+        """Check if user is already linked"""
+        return await AsyncAuthService.resolve_linked_citizen(phone_number, db) is not None
+    
+    @staticmethod
+    async def get_citizen_by_phone(phone_number: str, db: AsyncSession):
+        """Get citizen data by phone number"""
+        linked_user = await AsyncAuthService._get_active_link(phone_number, db)
+        if not linked_user:
+            return None
+        
+        result = await db.execute(
+            select(Citizens).filter(Citizens.citizen_id == linked_user.citizen_id).limit(1)
+        )
+        return result.scalars().first()
+    
+    @staticmethod
+    async def resolve_linked_citizen(phone_number: str, db: AsyncSession) -> Optional[LinkedCitizen]:
+        """Link status and citizen of a phone number (None when not linked)"""
+        cached = AuthService._cached_identity(phone_number)
+        if cached is not _IDENTITY_MISS:
+            return cached
+        row = (await db.execute(AuthService._linked_citizen_query(phone_number))).first()
+        return AuthService._cache_identity(phone_number, AuthService._to_linked_citizen(phone_number, row))
+    
+    @staticmethod
+    async def initiate_linking(phone_number: str, citizen_id: str, db: AsyncSession):
+        """Start the linking process with OTP"""
+        result = await db.execute(select(Citizens).filter(Citizens.citizen_id == citizen_id).limit(1))
+        if not result.scalars().first():
+            return {"success": False, "message": "Numéro de citoyen non trouvé"}
+        
+        otp = AuthService.generate_otp()
+        otp_expires = datetime.utcnow() + timedelta(minutes=10)
+        
+        result = await db.execute(select(LinkedUsers).filter(LinkedUsers.phone_number == phone_number).limit(1))
+        new_link = AuthService._apply_linking_otp(result.scalars().first(), phone_number, citizen_id, otp, otp_expires)
+        if new_link is not None:
+            db.add(new_link)
+        
+        await db.commit()
+        invalidate_identity(phone_number)
+        
+        return AuthService._linking_started(otp)
+    
+    @staticmethod
+    async def verify_otp(phone_number: str, otp_code: str, db: AsyncSession):
+        """Verify OTP and complete linking"""
+        result = await db.execute(select(LinkedUsers).filter(LinkedUsers.phone_number == phone_number).limit(1))
+        
+        verification = AuthService._check_and_complete_link(result.scalars().first(), otp_code)
+        if verification["success"]:
+            await db.commit()
+            invalidate_identity(phone_number)
+        
+        return verification
+
+class AsyncDataService:
+    """Async variant of DataService for the non-blocking chat pipeline"""
+    
+    @staticmethod
+    async def get_profile_data(citizen_id: str, db: AsyncSession):
+        """Fetch citizen profile data"""
+        cached = get_cached_context(citizen_id, "profile")
+        if cached is not None:
+            return cached
+        result = await db.execute(select(Citizens).filter(Citizens.citizen_id == citizen_id).limit(1))
+        return cache_context(citizen_id, "profile", DataService._format_profile(result.scalars().first()))
+    
+    @staticmethod
+    async def get_tax_data(citizen_id: str, db: AsyncSession):
+        """Fetch tax information"""
+        cached = get_cached_context(citizen_id, "taxes")
+        if cached is not None:
+            return cached
+        result = await db.execute(select(Taxes).filter(Taxes.citizen_id == citizen_id))
+        return cache_context(citizen_id, "taxes", DataService._format_taxes(result.scalars().all()))
+    
+    @staticmethod
+    async def get_parcels_data(citizen_id: str, db: AsyncSession):
+        """Fetch parcel/property information"""
+        cached = get_cached_context(citizen_id, "parcels")
+        if cached is not None:
+            return cached
+        result = await db.execute(select(Parcels).filter(Parcels.citizen_id == citizen_id))
+        return cache_context(citizen_id, "parcels", DataService._format_parcels(result.scalars().all()))
+    
+    @staticmethod
+    async def get_prefetch_context(citizen_id: str, db: AsyncSession):
+        """Fetch profile, tax totals and parcel count in aggregate queries"""
+        cached = get_cached_context(citizen_id, "prefetch")
+        if cached is not None:
+            return cached
+        tax_totals = (await db.execute(
+            select(func.sum(Taxes.amount_due), func.sum(Taxes.amount_paid), func.count(Taxes.id))
+            .filter(Taxes.citizen_id == citizen_id)
+        )).one()
+        parcel_count = (await db.execute(
+            select(func.count(Parcels.id)).filter(Parcels.citizen_id == citizen_id)
+        )).scalar()
+        return cache_context(citizen_id, "prefetch", DataService._format_prefetch(
+            await AsyncDataService.get_profile_data(citizen_id, db), tuple(tax_totals), parcel_count
+        ))
+    
+    @staticmethod
+    async def get_procedures_data(procedure_name: str, db: AsyncSession):
+        """Fetch procedure information"""
+        if not procedure_name:
+            result = await db.execute(select(Procedures).limit(5))
+            return DataService._format_procedure_list(result.scalars().all())
+        
+        result = await db.execute(
+            select(Procedures).filter(Procedures.name.ilike(f"%{procedure_name}%")).limit(1)
+        )
+        return DataService._format_procedure(result.scalars().first())
+    
+    @staticmethod
+    async def get_etax_status(citizen_id: str, db: AsyncSession):
+        """Fetch E-Tax status (served from in-memory test data, no I/O)"""
+        return DataService.get_etax_status(citizen_id, None)  # type: ignore
+
+class AsyncLoggingService:
+    """Async variant of LoggingService for the non-blocking chat pipeline"""
+    
+    @staticmethod
+    async def log_message(phone_number: str, message_text: str, direction: str, db: AsyncSession,
+                          intent: Optional[str] = None, confidence: Optional[float] = None,
+                          citizen_id: Optional[str] = None):
+        """Log chat message (queued to the write-behind writer unless disabled)"""
+        if CHAT_LOG_WRITE_BEHIND:
+            return chat_log_writer.log(phone_number, message_text, direction, intent, confidence, citizen_id)
+        
+        chat_log = ChatLogs(
+            phone_number=phone_number,
+            citizen_id=citizen_id,
+            message_text=message_text,
+            direction=direction,
+            intent=intent,
+            confidence=confidence,
+            created_at=datetime.utcnow()
+        )
+        db.add(chat_log)
+        if ROLLUPS_ENABLED:
+            await db.run_sync(apply_rollups, delta_for_log(chat_log))
+        await db.commit()
+        return chat_log
+    
+    @staticmethod
+    async def update_intent(chat_log, intent: str, confidence: float, db: AsyncSession, source: Optional[str] = None):
+        """Record the classified intent (and who produced it) on a logged inbound message"""
+        if isinstance(chat_log, PendingChatLog):
+            chat_log_writer.update(chat_log, intent=intent, confidence=confidence, intent_source=source)
+            return
+        if ROLLUPS_ENABLED:
+            await db.run_sync(apply_rollups, delta_for_reclassification(chat_log, intent, confidence))
+        chat_log.intent = intent
+        chat_log.confidence = confidence
+        chat_log.intent_source = source
+        await db.commit()
+
 class IntentHandlers:
     @staticmethod
     def handle_get_profile(citizen_id: str, db: Session, slots: Optional[dict] = None):
@@ -309,4 +937,40 @@ INTENT_HANDLERS = {
     "parcels": IntentHandlers.handle_get_parcels,
     "procedures": IntentHandlers.handle_get_procedures,
     "etax_status": IntentHandlers.handle_get_etax_status,
-} 
\ No newline at end of file
+}
+
+class AsyncIntentHandlers:
+    @staticmethod
+    async def handle_get_profile(citizen_id: str, db: AsyncSession, slots: Optional[dict] = None):
+        """Handle profile information requests"""
+        return await AsyncDataService.get_profile_data(citizen_id, db)
+    
+    @staticmethod
+    async def handle_get_tax_info(citizen_id: str, db: AsyncSession, slots: Optional[dict] = None):
+        """Handle tax information requests"""
+        return await AsyncDataService.get_tax_data(citizen_id, db)
+    
+    @staticmethod
+    async def handle_get_parcels(citizen_id: str, db: AsyncSession, slots: Optional[dict] = None):
+        """Handle parcel information requests"""
+        return await AsyncDataService.get_parcels_data(citizen_id, db)
+    
+    @staticmethod
+    async def handle_get_procedures(citizen_id: str, db: AsyncSession, slots: Optional[dict] = None):
+        """Handle procedure information requests"""
+        procedure_name = slots.get("procedure_name") if slots else None
+        return await AsyncDataService.get_procedures_data(procedure_name, db)  # type: ignore
+
+    @staticmethod
+    async def handle_get_etax_status(citizen_id: str, db: AsyncSession, slots: Optional[dict] = None):
+        """Handle E-Tax status information requests"""
+        return await AsyncDataService.get_etax_status(citizen_id, db)
+
+# Async intent mapping (used by the /chat pipeline)
+ASYNC_INTENT_HANDLERS = {
+    "profile": AsyncIntentHandlers.handle_get_profile,
+    "tax_info": AsyncIntentHandlers.handle_get_tax_info,
+    "parcels": AsyncIntentHandlers.handle_get_parcels,
+    "procedures": AsyncIntentHandlers.handle_get_procedures,
+    "etax_status": AsyncIntentHandlers.handle_get_etax_status,
+}
@@ -0,0 +1,153 @@
+"""
+Answer Templates for KodiBOT
+Deterministic French renderings of the data-lookup intents (profil, taxes,
+parcelles, E-Tax). The amounts come straight from the context dict, so a
+templated answer is instant and never misquotes a number.
+
+Each intent answers in one of three modes, chosen with ANSWER_MODES
+(e.g. "profile=template,tax_info=hybrid,parcels=llm"):
+- template: the rendered template only
+- hybrid: a short LLM-written lead sentence, then the rendered template
+- llm: the full LLM answer (previous behaviour)
+"""
+
+import os
+from typing import Callable, Dict, Optional
+
+ANSWER_MODES_ALLOWED = ("template", "hybrid", "llm")
+ANSWER_MODE_DEFAULT = os.getenv("ANSWER_MODE_DEFAULT", "template").lower()
+
+_SETTLED_STATUSES = {"paid", "sold"}
+_STATUS_LABELS = {
+    "paid": "✅ Payée",
+    "pending": "⏳ En attente",
+    "overdue": "⚠️ En retard",
+    "active": "✅ Active",
+    "sold": "🔁 Vendue",
+}
+
+def _parse_modes(spec: str) -> Dict[str, str]:
+    """Parse "intent=mode,intent=mode" (unknown modes are ignored)"""
+    modes = {}
+    for item in spec.split(","):
+        intent, _, mode = item.partition("=")
+        intent, mode = intent.strip(), mode.strip().lower()
+        if intent and mode in ANSWER_MODES_ALLOWED:
+            modes[intent] = mode
+    return modes
+
+ANSWER_MODES = _parse_modes(os.getenv("ANSWER_MODES", ""))
+
+def format_amount(value) -> str:
+    """1250000 -> "1 250 000 FC" (franc congolais, no decimals unless needed)"""
+    if value is None:
+        return "Non défini"
+    amount = float(value)
+    if amount.is_integer():
+        text = f"{int(amount):,}"
+    else:
+        text = f"{amount:,.2f}".replace(".", "#")
+    return text.replace(",", " ").replace("#", ",") + " FC"
+
+def _status_label(status) -> str:
+    return _STATUS_LABELS.get(str(status).lower(), str(status).capitalize() if status else "Non défini")
+
+def _yes_no(value) -> str:
+    return "✅ Oui" if value else "❌ Non"
+
+def render_profile(data: dict, citizen_name: str) -> str:
+    return "\n".join([
+        "👤 **Votre profil citoyen**",
+        "",
+        f"• Nom : {data.get('nom') or citizen_name}",
+        f"• Date de naissance : {data.get('date_naissance', 'Non définie')}",
+        f"• Adresse : {data.get('adresse', 'Non définie')}",
+        f"• Email : {data.get('email', 'Non définie')}",
+        "",
+        "Pour modifier ces informations, rendez-vous sur la plateforme Kodinet."
+    ])
+
+def render_tax_info(data: dict, citizen_name: str) -> str:
+    taxes = data.get("taxes") or []
+    if not taxes:
+        return f"📊 {citizen_name}, aucune taxe n'est enregistrée à votre nom pour le moment."
+
+    # Outstanding taxes first, then the most recent year
+    ranked = sorted(taxes, key=lambda tax: (
+        str(tax.get("statut", "")).lower() in _SETTLED_STATUSES, -(tax.get("annee") or 0)
+    ))
+    lines = ["📊 **Votre situation fiscale**", ""]
+    for tax in ranked:
+        lines.append(f"• {tax.get('type')} ({tax.get('annee')}) : {_status_label(tax.get('statut'))}")
+        lines.append(
+            f"  Dû : {format_amount(tax.get('montant_du'))} | Payé : {format_amount(tax.get('montant_paye'))}"
+            f" | Échéance : {tax.get('echeance', 'Non définie')}"
+        )
+
+    balance = data.get("solde") or 0
+    lines += [
+        "",
+        f"💰 Total dû : {format_amount(data.get('total_du'))}",
+        f"💵 Total payé : {format_amount(data.get('total_paye'))}",
+        f"🧾 Solde restant : {format_amount(balance)}",
+        "",
+        "💡 Vous pouvez régler votre solde en ligne sur Kodinet." if balance > 0
+        else "🎉 Vous êtes à jour dans vos paiements. Merci !"
+    ]
+    return "\n".join(lines)
+
+def render_parcels(data: dict, citizen_name: str) -> str:
+    parcels = data.get("parcelles") or []
+    if not parcels:
+        return f"🏠 {citizen_name}, aucune parcelle n'est enregistrée à votre nom."
+
+    lines = [f"🏠 **Vos parcelles** ({data.get('nombre_total', len(parcels))})", ""]
+    for parcel in parcels:
+        lines.append(f"• {parcel.get('numero_parcelle')} - {parcel.get('type')} ({_status_label(parcel.get('statut'))})")
+        lines.append(f"  📍 {parcel.get('adresse')} | 📐 {parcel.get('superficie')}")
+        lines.append(f"  Valeur estimée : {format_amount(parcel.get('valeur_estimee'))}")
+    return "\n".join(lines)
+
+def render_etax_status(data: dict, citizen_name: str) -> str:
+    methods = data.get("payment_methods") or []
+    if isinstance(methods, (list, tuple)):
+        methods = ", ".join(str(method) for method in methods) or "Aucun"
+    return "\n".join([
+        "💻 **Votre compte E-Tax**",
+        "",
+        f"• Statut : {data.get('status_display')}",
+        f"• Type de compte : {data.get('account_type')}",
+        f"• Vérification : {data.get('verification_level')}",
+        f"• Inscrit depuis le : {data.get('registration_date')}",
+        f"• Dernière connexion : {data.get('last_login')}",
+        f"• Moyens de paiement : {methods}",
+        f"• Notifications : {_yes_no(data.get('notifications_enabled'))}",
+        f"• Paiement automatique : {_yes_no(data.get('auto_payment_setup'))}",
+        f"• Déclarations déposées : {data.get('tax_returns_filed')} (dernière le {data.get('last_filing_date')})",
+        f"• Score de conformité : {data.get('compliance_score')}/100 ({data.get('compliance_level')})"
+    ])
+
+TEMPLATES: Dict[str, Callable[[dict, str], str]] = {
+    "profile": render_profile,
+    "tax_info": render_tax_info,
+    "parcels": render_parcels,
+    "etax_status": render_etax_status,
+}
+
+def answer_mode(intent: str) -> str:
+    """Configured answer mode of an intent ("llm" when it has no template)"""
+    if intent not in TEMPLATES:
+        return "llm"
+    mode = ANSWER_MODES.get(intent, ANSWER_MODE_DEFAULT)
+    return mode if mode in ANSWER_MODES_ALLOWED else "llm"
+
+def render_answer(intent: str, context_data: Optional[dict], citizen_name: str) -> Optional[str]:
+    """Templated answer, or None when the intent has no template or the data does not fit it"""
+    template = TEMPLATES.get(intent)
+    if template is None or not context_data:
+        return None
+    try:
+        return template(context_data, citizen_name)
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"⚠️  Template for {intent} failed: {e}, falling back to the LLM")
+        return None
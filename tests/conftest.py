@@ -0,0 +1,103 @@
+"""
+Shared pytest setup
+Points the app at throwaway SQLite/cache/archive paths before any src module is
+imported, so unit tests never touch kodibot.db. The live-server scripts
+(test_chat.py, test_integration.py) are unaffected.
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_TEST_DIR = tempfile.mkdtemp(prefix="kodibot-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_DIR, 'kodibot_test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["INTENT_CACHE_DB"] = os.path.join(_TEST_DIR, "intent_cache.db")
+os.environ["CHAT_LOG_ARCHIVE_DIR"] = os.path.join(_TEST_DIR, "archive")
+os.environ["LOCAL_INTENT_MODEL_PATH"] = os.path.join(_TEST_DIR, "intent_model.json")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+@pytest.fixture
+def db_engine(tmp_path):
+    """Fresh SQLite database file with every table created from the models"""
+    from sqlalchemy import create_engine
+    from src.database import Base
+    engine = create_engine(f"sqlite:///{tmp_path / 'unit.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def session_factory(db_engine):
+    from sqlalchemy.orm import sessionmaker
+    return sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+@pytest.fixture
+def db_session(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+@pytest.fixture(scope="session")
+def app_client():
+    """TestClient over the FastAPI app (backed by the throwaway DATABASE_URL)"""
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture
+def linked_citizen():
+    """A citizen with a tax row, linked to a phone number no other test uses"""
+    from src.database import SessionLocal, Citizens, LinkedUsers, Taxes
+    number = f"{uuid.uuid4().int % 10**9:09d}"
+    citizen = {"phone_number": f"+243{number}", "citizen_id": f"CIT{number}", "first_name": "Patrick", "last_name": "Daudi"}
+    db = SessionLocal()
+    try:
+        db.add(Citizens(**citizen))
+        db.add(Taxes(citizen_id=citizen["citizen_id"], tax_type="foncière", amount_due=150000.0,
+                     amount_paid=50000.0, status="pending", tax_year=2024))
+        db.add(LinkedUsers(phone_number=citizen["phone_number"], citizen_id=citizen["citizen_id"], is_linked=True))
+        db.commit()
+    finally:
+        db.close()
+    return citizen
+
+@pytest.fixture
+def kcaf_payload():
+    """Factory of valid K-CAF submissions (JSON-ready dicts) for unique parcel numbers"""
+    def make(parcel_number=None, **overrides):
+        payload = {
+            "parcel_number": parcel_number or f"KIN-{uuid.uuid4().hex[:10].upper()}",
+            "nature_propriete": "Bâtie",
+            "usage_principal": "résidentiel",
+            "nom_proprietaire": "Patrick Daudi",
+            "nationalite_proprietaire": "National",
+            "type_possession": "titre foncier",
+            "adresse_commune": "Gombe",
+            "adresse_quartier": "Batetela",
+            "adresse_avenue": "Av. Lumumba",
+            "adresse_numero": "12",
+            "type_personne": "Physique",
+            "type_batiment": "Maison principale",
+            "nombre_etages": "R+1",
+            "nombre_appartements": 2,
+            "nombre_appartements_vides": 0,
+            "plaque_identification": True,
+            "raccordements": {"eau": True, "electricite": True},
+            "distance_sante": "<1KM",
+            "distance_education": "2KM",
+            "acces_eau_potable": {"reseau": True, "puits": False},
+            "gestion_dechets": {"collecte": True, "brulage": False},
+            "montant_a_payer": 250000.0,
+            "etat": "soumis",
+            "numero_collecteur": "COL-007",
+        }
+        payload.update(overrides)
+        return payload
+    return make
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the chat log archive (retention, resume after interruption, reading back)
+"""
+
+import gzip
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from src.archive import ChatLogArchive
+from src.database import ChatLogs
+
+DAY = date(2025, 6, 18)
+
+def _log(db, created_at, phone_number="+243810000001", direction="IN", text="Bonjour"):
+    row = ChatLogs(phone_number=phone_number, message_text=text, direction=direction, created_at=created_at)
+    db.add(row)
+    return row
+
+@pytest.fixture
+def archive(tmp_path):
+    return ChatLogArchive(str(tmp_path / "archive"))
+
+@pytest.fixture
+def history(db_session):
+    """Three logs on DAY, one the day after"""
+    at = datetime(2025, 6, 18, 9, 30)
+    _log(db_session, at, text="Quel est mon solde ?")
+    _log(db_session, at + timedelta(seconds=2), direction="OUT", text="Votre solde est de 100 000 FC.")
+    _log(db_session, at + timedelta(hours=12), phone_number="+243810000002", text="Mes parcelles")
+    _log(db_session, datetime(2025, 6, 19, 8, 0), text="Merci")
+    db_session.commit()
+    return db_session
+
+def _remaining(db):
+    return [row.message_text for row in db.query(ChatLogs).order_by(ChatLogs.id)]
+
+def test_a_day_is_moved_to_a_compressed_file(archive, history):
+    assert archive.archive_day(history, DAY) == 3
+    assert _remaining(history) == ["Merci"]
+
+    [part] = archive.manifest()["2025-06-18"]
+    assert part["file"] == "chat_logs-2025-06-18.jsonl.gz" and part["rows"] == 3
+    with gzip.open(os.path.join(archive.directory, part["file"]), "rt", encoding="utf-8") as handle:
+        assert sum(1 for _ in handle) == 3
+    assert not [name for name in os.listdir(archive.directory) if name.endswith(".tmp")]
+
+def test_interrupted_run_is_resumed_without_duplicates(archive, history, monkeypatch):
+    save_manifest = ChatLogArchive._save_manifest
+
+    def save_then_crash(self, manifest):
+        save_manifest(self, manifest)
+        raise RuntimeError("processus interrompu")
+
+    monkeypatch.setattr(ChatLogArchive, "_save_manifest", save_then_crash)
+    with pytest.raises(RuntimeError):
+        archive.archive_day(history, DAY)
+    history.rollback()
+    assert len(_remaining(history)) == 4  # written and recorded, not yet deleted
+    monkeypatch.setattr(ChatLogArchive, "_save_manifest", save_manifest)
+
+    # A late row of the same day arrives before the next run
+    _log(history, datetime(2025, 6, 18, 23, 59), text="Au revoir")
+    history.commit()
+
+    assert archive.archive_day(history, DAY) == 4
+    assert _remaining(history) == ["Merci"]
+    parts = archive.manifest()["2025-06-18"]
+    assert [(part["file"], part["rows"]) for part in parts] == [
+        ("chat_logs-2025-06-18.jsonl.gz", 3), ("chat_logs-2025-06-18.1.jsonl.gz", 1)
+    ]
+    texts = [record["message_text"] for record in archive.iter_archived()]
+    assert len(texts) == len(set(texts)) == 4
+
+def test_dry_run_only_counts(archive, db_session):
+    old = datetime.utcnow() - timedelta(days=40)
+    _log(db_session, old)
+    _log(db_session, old)
+    _log(db_session, datetime.utcnow())
+    db_session.commit()
+
+    assert archive.archive_older_than(db_session, retention_days=30, dry_run=True) == {old.date().isoformat(): 2}
+    assert len(_remaining(db_session)) == 3
+    assert archive.archive_older_than(db_session, retention_days=30) == {old.date().isoformat(): 2}
+    assert len(_remaining(db_session)) == 1
+    assert archive.archive_older_than(db_session, retention_days=30) == {}
+
+def test_archived_rows_can_be_filtered(archive, history):
+    archive.archive_day(history, DAY)
+    archive.archive_day(history, date(2025, 6, 19))
+
+    records = list(archive.iter_archived(phone_number="+243810000001", direction="IN"))
+    assert [record["message_text"] for record in records] == ["Quel est mon solde ?", "Merci"]
+    assert records[0]["created_at"] == "2025-06-18T09:30:00"
+    assert [record["message_text"] for record in archive.iter_archived(start_day="2025-06-19")] == ["Merci"]
+    assert len(list(archive.iter_archived(end_day="2025-06-18"))) == 3
+
+    stats = archive.stats()
+    assert (stats["days"], stats["files"], stats["rows"]) == (2, 2, 4)
+    assert (stats["oldest_day"], stats["newest_day"]) == ("2025-06-18", "2025-06-19")
+
+def test_empty_archive(archive):
+    assert archive.stats()["rows"] == 0
+    assert list(archive.iter_archived()) == []
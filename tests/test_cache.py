@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the TTL/LRU cache and the answer cache
+"""
+
+import pytest
+
+import src.cache as cache_module
+import src.model as model
+from src.cache import TTLCache, normalize_message, fingerprint
+from src.model import QUOTA_MESSAGE, ERROR_MESSAGE
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cache_module.time, "monotonic", fake)
+    return fake
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLCache("t", max_size=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=5)
+    clock.now += 10
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache("t", max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_rejected_entries_are_dropped(clock):
+    cache = TTLCache("t")
+    cache.set("a", 1)
+    assert cache.get("a", validate=lambda value: value == 2) is None
+    assert "a" not in cache._data
+    assert cache.stats()["invalidations"] == 1
+
+def test_invalidate_where_matches_keys(clock):
+    cache = TTLCache("t")
+    for key in [("c1", "profile"), ("c1", "taxes"), ("c2", "profile")]:
+        cache.set(key, 1)
+    assert cache.invalidate_where(lambda key: key[0] == "c1") == 2
+    assert len(cache) == 1
+
+def test_normalize_message_folds_case_accents_and_punctuation():
+    assert normalize_message("  Quel est mon SOLDE d'impôt ?? ") == "quel est mon solde d impot"
+
+def test_fingerprint_ignores_key_order():
+    assert fingerprint({"a": 1, "b": [1, 2]}) == fingerprint({"b": [1, 2], "a": 1})
+    assert fingerprint({"a": 1}) != fingerprint({"a": 2})
+
+@pytest.fixture
+def answers(monkeypatch):
+    fresh = TTLCache("answers", max_size=10, ttl=60)
+    monkeypatch.setattr(model, "answer_cache", fresh)
+    monkeypatch.setattr(model, "ANSWER_CACHE_ENABLED", True)
+    return fresh
+
+def test_answer_is_served_while_context_is_unchanged(answers):
+    context = {"solde": 100}
+    model.cache_answer("CIT1", "tax_info", "Mon solde ?", context, "Votre solde est de 100 FC")
+    assert model.get_cached_answer("CIT1", "tax_info", "mon solde", {"solde": 100}) == "Votre solde est de 100 FC"
+    assert model.get_cached_answer("CIT2", "tax_info", "mon solde", context) is None
+
+def test_answer_is_dropped_when_context_changes(answers):
+    model.cache_answer("CIT1", "tax_info", "mon solde", {"solde": 100}, "100 FC")
+    assert model.get_cached_answer("CIT1", "tax_info", "mon solde", {"solde": 0}) is None
+    assert len(answers) == 0
+
+def test_answer_is_only_reused_in_the_same_conversation(answers):
+    history = [{"role": "user", "content": "Requête utilisateur: Mes parcelles"},
+               {"role": "assistant", "content": "Vous avez 2 parcelles."}]
+    model.cache_answer("CIT1", "procedures", "et pour celle-ci ?", {}, "La première parcelle…", history)
+    assert model.get_cached_answer("CIT1", "procedures", "et pour celle-ci ?", {}, list(history)) == "La première parcelle…"
+    assert model.get_cached_answer("CIT1", "procedures", "et pour celle-ci ?", {}) is None
+    assert model.get_cached_answer("CIT1", "procedures", "et pour celle-ci ?", {}, history[:1]) is None
+
+def test_error_and_quota_messages_are_not_cached(answers):
+    for message in (QUOTA_MESSAGE, ERROR_MESSAGE, ""):
+        model.cache_answer("CIT1", "tax_info", "mon solde", {}, message)
+    assert len(answers) == 0
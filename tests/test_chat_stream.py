@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Tests for the /chat/stream Server-Sent Events endpoint (LLM calls are faked)
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import main
+import src.model as model
+from src.database import SessionLocal, ChatLogs
+from src.log_writer import chat_log_writer
+from src.model import StreamInterrupted
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    async def get_intent(message):
+        return {"intent": "procedures", "confidence": 0.95, "slots": {}, "source": "llm"}
+    
+    async def stream_answer(user_prompt, system_prompt, phone_number=None):
+        for chunk in ("Pour renouveler ", "votre permis, ", "rendez-vous à la DGI."):
+            yield chunk
+    
+    monkeypatch.setattr(main, "get_intent_async", get_intent)
+    monkeypatch.setattr(main, "stream_answer_async", stream_answer)
+    monkeypatch.setattr(main, "CHAT_PIPELINE", "classic")
+
+def test_answer_is_streamed_as_deltas_then_done(app_client, linked_citizen, fake_llm):
+    response = app_client.post("/chat/stream", json={
+        "phone_number": linked_citizen["phone_number"], "message": "Comment renouveler mon permis ?"
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    
+    events = _events(response.text)
+    deltas = [data["content"] for event, data in events if event == "delta"]
+    assert deltas == ["Pour renouveler ", "votre permis, ", "rendez-vous à la DGI."]
+    event, done = events[-1]
+    assert event == "done"
+    assert done["response"] == "".join(deltas) and done["error"] is None
+    assert len(main.phone_locks) == 0
+    
+    # The streamed answer is logged like a /chat reply
+    assert chat_log_writer.flush()
+    db = SessionLocal()
+    try:
+        logged = db.query(ChatLogs.message_text).filter(
+            ChatLogs.phone_number == linked_citizen["phone_number"], ChatLogs.direction == "OUT"
+        ).all()
+    finally:
+        db.close()
+    assert logged == [(done["response"],)]
+
+def test_unlinked_phone_gets_a_single_done_event(app_client, fake_llm):
+    response = app_client.post("/chat/stream", json={"phone_number": "+243999000111", "message": "bonjour"})
+    events = _events(response.text)
+    assert [event for event, _ in events] == ["done"]
+    assert events[0][1]["requires_linking"] is True
+    assert len(main.phone_locks) == 0
+
+def _outbound(phone_number):
+    assert chat_log_writer.flush()
+    db = SessionLocal()
+    try:
+        return [text for (text,) in db.query(ChatLogs.message_text).filter(
+            ChatLogs.phone_number == phone_number, ChatLogs.direction == "OUT"
+        )]
+    finally:
+        db.close()
+
+def test_interrupted_stream_is_not_a_complete_answer(app_client, linked_citizen, fake_llm, monkeypatch):
+    calls = []
+
+    async def broken_stream(user_prompt, system_prompt, phone_number=None):
+        calls.append(user_prompt)
+        yield "Pour renouveler "
+        raise StreamInterrupted("Pour renouveler ", ConnectionError("connexion coupée"))
+
+    monkeypatch.setattr(main, "stream_answer_async", broken_stream)
+    body = {"phone_number": linked_citizen["phone_number"], "message": "Comment renouveler mon permis ?"}
+    events = _events(app_client.post("/chat/stream", json=body).text)
+    event, done = events[-1]
+    assert event == "done"
+    assert done["response"] == "Pour renouveler " and done["error"] == main.STREAM_INTERRUPTED_MESSAGE
+    assert len(main.phone_locks) == 0
+
+    # Neither cached nor replayed: the same question is asked to the LLM again
+    _events(app_client.post("/chat/stream", json=body).text)
+    assert len(calls) == 2
+    assert _outbound(linked_citizen["phone_number"]) == ["Pour renouveler ", "Pour renouveler "]
+
+def test_failure_after_the_stream_still_ends_with_done(app_client, linked_citizen, fake_llm, monkeypatch):
+    def broken_cache(*args):
+        raise RuntimeError("cache indisponible")
+
+    monkeypatch.setattr(main, "cache_answer", broken_cache)
+    events = _events(app_client.post("/chat/stream", json={
+        "phone_number": linked_citizen["phone_number"], "message": "Comment renouveler mon permis ?"
+    }).text)
+    event, done = events[-1]
+    assert event == "done" and done["error"] and done["response"] is None
+    assert len(main.phone_locks) == 0
+    assert _outbound(linked_citizen["phone_number"]) == [done["error"]]
+
+def test_stream_breaking_midway_raises_with_the_partial_answer(monkeypatch):
+    def chunk(text):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    async def broken(label, **params):
+        yield chunk("Pour renouveler ")
+        raise ConnectionError("connexion coupée")
+
+    recorded = []
+    monkeypatch.setattr(model, "astream_completion", broken)
+    monkeypatch.setattr(model, "_record_answer", lambda *args: recorded.append(args))
+
+    async def consume():
+        received = []
+        with pytest.raises(StreamInterrupted) as interrupted:
+            async for text in model.stream_answer_async("Comment renouveler mon permis ?", "Système", "+243810000001"):
+                received.append(text)
+        return received, interrupted.value
+
+    received, error = asyncio.run(consume())
+    assert received == ["Pour renouveler "] and error.partial == "Pour renouveler "
+    assert recorded == []  # the truncated answer stays out of the conversation history
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the OpenAI circuit breaker and its half-open probe
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import BadRequestError
+
+import src.openai_client as openai_client
+from src.metrics import render_prometheus
+from src.openai_client import CircuitBreaker, CircuitOpenError, circuit_breaker
+
+COMPLETION = SimpleNamespace(model="gpt-4o-mini", usage=None)
+
+def _bad_request():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return BadRequestError("invalid messages", response=httpx.Response(400, request=request), body=None)
+
+class ScriptedCompletions:
+    """Each call pops the next outcome: a completion, an exception, or "hang" (never answers)"""
+
+    def __init__(self):
+        self.outcomes = []
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def create(self, **params):
+        return self._next()
+
+class AsyncScriptedCompletions(ScriptedCompletions):
+    async def create(self, **params):
+        outcome = self._next()
+        if outcome == "hang":
+            await asyncio.Event().wait()
+        if params.get("stream"):
+            async def stream():
+                for _ in range(3):
+                    yield SimpleNamespace(usage=None, choices=[])
+            return stream()
+        return outcome
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """The global breaker, closed, opening after 2 failures and probing right away"""
+    for name, value in (("enabled", True), ("failure_threshold", 2), ("cooldown", 0.0),
+                        ("state", CircuitBreaker.CLOSED), ("failures", 0), ("_probe_in_flight", False)):
+        monkeypatch.setattr(circuit_breaker, name, value)
+    monkeypatch.setattr(openai_client, "LLM_SINGLE_FLIGHT", False)
+    monkeypatch.setattr(openai_client, "_record_usage", lambda *args, **kwargs: None)
+    sync_client, async_client = ScriptedCompletions(), AsyncScriptedCompletions()
+    monkeypatch.setattr(openai_client, "get_client",
+                        lambda: SimpleNamespace(chat=SimpleNamespace(completions=sync_client)))
+    monkeypatch.setattr(openai_client, "get_async_client",
+                        lambda: SimpleNamespace(chat=SimpleNamespace(completions=async_client)))
+    return SimpleNamespace(sync=sync_client, aio=async_client)
+
+def _open(breaker):
+    breaker.sync.outcomes.extend([RuntimeError("Connection reset"), RuntimeError("Connection reset")])
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            openai_client.create_completion("answer", model="gpt-4o-mini", messages=[])
+    assert circuit_breaker.state == CircuitBreaker.OPEN
+
+def test_consecutive_failures_open_the_circuit(breaker, monkeypatch):
+    _open(breaker)
+    monkeypatch.setattr(circuit_breaker, "cooldown", 60.0)
+    with pytest.raises(CircuitOpenError) as rejected:
+        openai_client.create_completion("answer", model="gpt-4o-mini", messages=[])
+    assert rejected.value.reason == "error" and rejected.value.retry_in > 0
+    assert breaker.sync.calls == 2
+
+def test_bad_requests_do_not_open_a_closed_circuit(breaker):
+    breaker.sync.outcomes.extend([_bad_request(), _bad_request(), _bad_request()])
+    for _ in range(3):
+        with pytest.raises(BadRequestError):
+            openai_client.create_completion("answer", model="gpt-4o-mini", messages=[])
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+
+def test_successful_probe_closes_the_circuit(breaker):
+    _open(breaker)
+    breaker.sync.outcomes.append(COMPLETION)
+    assert openai_client.create_completion("answer", model="gpt-4o-mini", messages=[]) is COMPLETION
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+    assert circuit_breaker.failures == 0
+
+def test_failed_probe_reopens_the_circuit(breaker):
+    _open(breaker)
+    breaker.sync.outcomes.append(RuntimeError("Error code: 429 - insufficient_quota"))
+    with pytest.raises(RuntimeError):
+        openai_client.create_completion("answer", model="gpt-4o-mini", messages=[])
+    assert circuit_breaker.state == CircuitBreaker.OPEN
+    assert circuit_breaker.last_failure_reason == "quota"
+    assert circuit_breaker._probe_in_flight is False
+
+def test_bad_request_probe_closes_the_circuit(breaker):
+    _open(breaker)
+    breaker.sync.outcomes.append(_bad_request())
+    with pytest.raises(BadRequestError):
+        openai_client.create_completion("answer", model="gpt-4o-mini", messages=[])
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+    assert circuit_breaker._probe_in_flight is False
+
+def test_only_one_probe_at_a_time(breaker):
+    _open(breaker)
+    assert circuit_breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_call()
+    circuit_breaker.abandon_probe()
+    assert circuit_breaker.before_call() is True
+
+def test_cancelled_probe_lets_the_next_call_probe(breaker):
+    _open(breaker)
+    breaker.aio.outcomes.extend(["hang", COMPLETION])
+
+    async def scenario():
+        probe = asyncio.ensure_future(openai_client.acreate_completion("answer", model="gpt-4o-mini", messages=[]))
+        await asyncio.sleep(0.01)
+        assert circuit_breaker.state == CircuitBreaker.HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert circuit_breaker._probe_in_flight is False
+        return await openai_client.acreate_completion("answer", model="gpt-4o-mini", messages=[])
+
+    assert asyncio.run(scenario()) is COMPLETION
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+
+def test_probe_stream_closed_early_lets_the_next_call_probe(breaker):
+    _open(breaker)
+    breaker.aio.outcomes.append(COMPLETION)
+
+    async def scenario():
+        stream = openai_client.astream_completion("stream", model="gpt-4o-mini", messages=[])
+        await stream.__anext__()
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    assert circuit_breaker.state == CircuitBreaker.HALF_OPEN
+    assert circuit_breaker._probe_in_flight is False
+    assert circuit_breaker.before_call() is True
+
+def test_breakers_share_one_metric_family():
+    other = CircuitBreaker(failure_threshold=1, cooldown=60)
+    other.record_failure(RuntimeError("boom"))
+    assert other.state == CircuitBreaker.OPEN
+    rendered = render_prometheus()
+    assert rendered.count("# TYPE kodibot_llm_circuit_transitions_total") == 1
+    assert rendered.count("# TYPE kodibot_llm_circuit_rejections_total") == 1
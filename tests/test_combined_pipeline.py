@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the combined (intent + answer) pipeline
+"""
+
+import asyncio
+import itertools
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import main
+import src.model as model
+import src.templates as templates
+from src.cache import TTLCache
+from src.model import _parse_combined_content, classify_without_llm
+from src.prompts import build_combined_prompt
+
+def test_null_answer_is_parsed_as_missing():
+    content = json.dumps({"intent": "parcels", "confidence": 0.9, "slots": {}, "answer": None})
+    result = _parse_combined_content(content, {})
+    assert result["intent"] == "parcels"
+    assert result["answer"] is None
+
+def test_blank_answer_is_parsed_as_missing():
+    content = json.dumps({"intent": "greeting", "confidence": 0.9, "slots": {}, "answer": "  "})
+    assert _parse_combined_content(content, {})["answer"] is None
+
+def test_prompt_asks_for_null_when_data_is_missing():
+    prompt = build_combined_prompt("Patrick", "CIT1", {"profil": {}}, ["greeting", "parcels"])
+    assert '"answer": null' in prompt
+
+def test_uncovered_intents_use_their_handlers():
+    for intent in ("parcels", "procedures", "etax_status", "fallback"):
+        assert not main._accept_combined_answer(intent, "Vous avez 2 parcelles.")
+
+def test_missing_answer_is_never_accepted():
+    assert not main._accept_combined_answer("greeting", None)
+    assert not main._accept_combined_answer("greeting", "")
+
+def test_greeting_uses_the_combined_answer():
+    assert main._accept_combined_answer("greeting", "Bonjour Patrick !")
+
+def test_template_intents_are_answered_by_the_template(monkeypatch):
+    monkeypatch.setattr(templates, "ANSWER_MODES", {})
+    monkeypatch.setattr(templates, "ANSWER_MODE_DEFAULT", "template")
+    assert not main._accept_combined_answer("tax_info", "Votre solde est de 100 FC.")
+    
+    monkeypatch.setattr(templates, "ANSWER_MODE_DEFAULT", "llm")
+    assert main._accept_combined_answer("tax_info", "Votre solde est de 100 FC.")
+
+@pytest.fixture
+def combined(monkeypatch):
+    """Combined pipeline with an empty intent memo, no local model and a recording combined call"""
+    calls = []
+
+    async def get_intent_and_answer(message, system_prompt):
+        calls.append(message)
+        return {"intent": "greeting", "confidence": 0.95, "slots": {}, "source": "llm", "answer": "Bonjour Patrick !"}
+
+    monkeypatch.setattr(main, "CHAT_PIPELINE", "combined")
+    monkeypatch.setattr(main, "get_intent_and_answer_async", get_intent_and_answer)
+    monkeypatch.setattr(model, "intent_cache", TTLCache("intents", max_size=10, ttl=60))
+    monkeypatch.setattr(model, "INTENT_CACHE_ENABLED", True)
+    monkeypatch.setattr(model, "classify_locally", lambda message: None)
+    return calls
+
+def _ask(client, phone_number, message, sent=itertools.count()):
+    return client.post("/chat", json={
+        "phone_number": phone_number, "message": message, "message_id": f"wamid.combined.{next(sent)}"
+    }).json()
+
+def test_free_classifications_skip_the_combined_call(app_client, linked_citizen, combined, monkeypatch):
+    phone = linked_citizen["phone_number"]
+    monkeypatch.setattr(main.kodibot, "handle_greeting", lambda: "Bonjour !")
+    monkeypatch.setattr(main.kodibot, "handle_goodbye", lambda: "Au revoir !")
+    assert _ask(app_client, phone, "Salut KodiBOT")["response"] == "Bonjour Patrick !"
+    assert combined == ["Salut KodiBOT"]
+
+    # Memoized classification: the canned greeting, no LLM call
+    model.intent_cache.set("bonjour kodibot", {"intent": "greeting", "confidence": 0.95, "slots": {}})
+    assert _ask(app_client, phone, "Bonjour KodiBOT !")["response"] == "Bonjour !"
+    # Confident local classifier
+    monkeypatch.setattr(model, "classify_locally", lambda message: ("goodbye", 0.97))
+    assert _ask(app_client, phone, "À la prochaine")["response"] == "Au revoir !"
+    assert combined == ["Salut KodiBOT"]
+
+def test_combined_classifications_are_memoized(combined, monkeypatch):
+    content = json.dumps({"intent": "parcels", "confidence": 0.9, "slots": {}, "answer": None})
+
+    async def acreate_completion(label, **params):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    monkeypatch.setattr(model, "acreate_completion", acreate_completion)
+    assert classify_without_llm("Mes parcelles") is None
+    asyncio.run(model.get_intent_and_answer_async("Mes parcelles", "Système"))
+    assert classify_without_llm("mes parcelles")["intent"] == "parcels"
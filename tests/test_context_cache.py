@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the per-citizen context cache and its write-driven invalidation
+"""
+
+import pytest
+
+import src.services as services
+from src.cache import TTLCache
+from src.database import Citizens, Taxes, Parcels, KCAF_Records
+from src.services import DataService
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    cache = TTLCache("citizen_context", max_size=100, ttl=600)
+    monkeypatch.setattr(services, "context_cache", cache)
+    monkeypatch.setattr(services, "CONTEXT_CACHE_ENABLED", True)
+    return cache
+
+@pytest.fixture
+def seeded(db_session):
+    for number, citizen_id in ((1, "CIT1"), (2, "CIT2")):
+        db_session.add(Citizens(citizen_id=citizen_id, phone_number=f"+24300{number}", first_name="A", last_name="B"))
+        db_session.add(Taxes(citizen_id=citizen_id, tax_type="foncière", amount_due=100.0, amount_paid=0.0, tax_year=2024))
+        db_session.add(Parcels(citizen_id=citizen_id, parcel_number=f"P{number}", property_type="terrain"))
+    db_session.commit()
+    return db_session
+
+def test_reads_are_served_from_cache(seeded, fresh_cache):
+    first = DataService.get_tax_data("CIT1", seeded)
+    assert DataService.get_tax_data("CIT1", seeded) is first
+    assert fresh_cache.hits == 1
+
+def test_commit_invalidates_only_the_written_citizen(seeded, fresh_cache):
+    DataService.get_tax_data("CIT1", seeded)
+    DataService.get_tax_data("CIT2", seeded)
+    
+    tax = seeded.query(Taxes).filter(Taxes.citizen_id == "CIT1").one()
+    tax.amount_paid = 100.0
+    seeded.commit()
+    
+    assert services.get_cached_context("CIT1", "taxes") is None
+    assert services.get_cached_context("CIT2", "taxes") is not None
+    assert DataService.get_tax_data("CIT1", seeded)["solde"] == 0
+
+def test_kcaf_write_invalidates_the_parcel_owner(seeded):
+    DataService.get_parcels_data("CIT2", seeded)
+    DataService.get_parcels_data("CIT1", seeded)
+    seeded.add(KCAF_Records(parcel_number="P2", nom_proprietaire="B"))
+    seeded.commit()
+    assert services.get_cached_context("CIT2", "parcels") is None
+    assert services.get_cached_context("CIT1", "parcels") is not None
+
+def test_bulk_update_clears_everything(seeded):
+    DataService.get_tax_data("CIT1", seeded)
+    DataService.get_tax_data("CIT2", seeded)
+    seeded.query(Taxes).update({Taxes.amount_paid: 50.0})
+    seeded.commit()
+    assert services.get_cached_context("CIT1", "taxes") is None
+    assert services.get_cached_context("CIT2", "taxes") is None
+
+def test_uncommitted_writes_keep_the_cache(seeded):
+    DataService.get_tax_data("CIT1", seeded)
+    tax = seeded.query(Taxes).filter(Taxes.citizen_id == "CIT1").one()
+    tax.amount_paid = 100.0
+    seeded.flush()
+    assert services.get_cached_context("CIT1", "taxes") is not None
+    seeded.rollback()
+
+def test_prefetch_aggregates_taxes_and_parcels(seeded):
+    prefetch = DataService.get_prefetch_context("CIT1", seeded)
+    assert prefetch["resume_fiscal"] == {"nombre_taxes": 1, "total_du": 100.0, "total_paye": 0.0, "solde": 100.0}
+    assert prefetch["nombre_parcelles"] == 1
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the compact, token-budgeted context serializer
+"""
+
+from src.context_serializer import serialize_context, estimate_tokens
+from src.prompts import build_contextualized_prompt
+
+def _tax(year, status, due=100.0, paid=0.0):
+    return {"type": "foncière", "montant_du": due, "montant_paye": paid, "statut": status, "annee": year}
+
+def test_rows_share_one_header_line():
+    result = serialize_context({"total_du": 200.0, "taxes": [_tax(2023, "pending"), _tax(2024, "pending")]})
+    lines = result.text.splitlines()
+    assert lines[0] == "total_du: 200"
+    assert lines[1] == "taxes (2): type | montant_du | montant_paye | statut | annee"
+    assert lines[2] == "- foncière | 100 | 0 | pending | 2024"
+    assert result.rows_kept == 2 and result.rows_dropped == 0
+
+def test_outstanding_and_recent_rows_come_first():
+    taxes = [_tax(2024, "paid", paid=100.0), _tax(2021, "pending"), _tax(2023, "pending")]
+    rows = [line for line in serialize_context({"taxes": taxes}).text.splitlines() if line.startswith("- ")]
+    assert [row.split(" | ")[-1] for row in rows] == ["2023", "2021", "2024"]
+
+def test_rows_past_the_budget_are_dropped_but_scalars_are_kept():
+    taxes = [_tax(2000 + year, "pending") for year in range(40)]
+    result = serialize_context({"solde": 4000.0, "taxes": taxes}, budget=80)
+    assert "solde: 4000" in result.text
+    assert 0 < result.rows_kept < 40
+    assert result.rows_kept + result.rows_dropped == 40
+    assert f"... {result.rows_dropped} autre(s) omise(s)" in result.text
+    # Newest years are the ones kept
+    assert "2039" in result.text and "| 2000" not in result.text
+
+def test_budget_bounds_the_serialized_size():
+    taxes = [_tax(2000 + year, "pending") for year in range(200)]
+    budget = 150
+    result = serialize_context({"taxes": taxes}, budget=budget)
+    # Only the forced header and omission lines may exceed the budget
+    assert result.tokens <= budget + 40
+    assert result.saved_tokens > 0
+
+def test_empty_context_has_a_placeholder():
+    assert serialize_context(None).text == "Aucune donnée spécifique"
+    assert serialize_context({}).rows_kept == 0
+
+def test_nested_dicts_and_empty_lists():
+    text = serialize_context({"profil": {"nom": "Patrick Daudi"}, "parcelles": []}).text
+    assert text.splitlines() == ["profil:", "  nom: Patrick Daudi", "parcelles: aucun"]
+
+def test_estimate_tokens_counts_words_and_punctuation():
+    assert estimate_tokens("solde: 100") == 4  # "solde" is two 4-character pieces
+    assert estimate_tokens("anticonstitutionnellement") == 7
+
+def test_prompt_embeds_the_compact_context():
+    prompt = build_contextualized_prompt("Patrick Daudi", "CIT1", {"solde": 100.0})
+    assert "CONTEXTE DATA:\nsolde: 100" in prompt
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the bounded per-phone conversation store
+"""
+
+import itertools
+
+import pytest
+
+import main
+import src.conversation_store as store_module
+import src.model as model
+from src.cache import TTLCache
+from src.conversation_store import ConversationStore, MAX_TURN_CHARS
+
+PHONE = "+243810000001"
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(store_module.time, "monotonic", fake)
+    return fake
+
+def test_each_phone_keeps_only_its_last_turns(clock):
+    store = ConversationStore(max_turns=4, ttl=60, max_phones=10)
+    for index in range(3):
+        store.record_exchange(PHONE, f"question {index}", f"réponse {index}")
+    history = store.history(PHONE, token_budget=1000)
+    assert [turn["content"] for turn in history] == ["question 1", "réponse 1", "question 2", "réponse 2"]
+    assert store.stats()["turns"] == 4
+
+def test_long_turns_are_truncated(clock):
+    store = ConversationStore(max_turns=4, ttl=60, max_phones=10)
+    store.append(PHONE, "user", "x" * (MAX_TURN_CHARS + 500))
+    assert len(store.history(PHONE, token_budget=10_000)[0]["content"]) == MAX_TURN_CHARS
+
+def test_empty_turns_and_phones_are_ignored(clock):
+    store = ConversationStore(max_turns=4, ttl=60, max_phones=10)
+    store.append(PHONE, "user", "")
+    store.append(None, "user", "Bonjour")
+    assert len(store) == 0
+    assert store.history(None) == []
+
+def test_least_recently_active_phone_is_evicted(clock):
+    store = ConversationStore(max_turns=4, ttl=60, max_phones=2)
+    store.append("+243810000001", "user", "un")
+    store.append("+243810000002", "user", "deux")
+    store.append("+243810000001", "user", "encore un")
+    store.append("+243810000003", "user", "trois")
+    assert store.history("+243810000002", token_budget=100) == []
+    assert len(store.history("+243810000001", token_budget=100)) == 2
+    assert store.stats()["evictions"] == 1
+
+def test_idle_conversations_expire(clock):
+    store = ConversationStore(max_turns=4, ttl=60, max_phones=10)
+    store.record_exchange(PHONE, "Bonjour", "Bonjour ! Comment puis-je vous aider ?")
+    store.append("+243810000002", "user", "Salut")
+    clock.now += 30
+    store.append("+243810000002", "user", "Toujours là ?")
+    clock.now += 31
+    assert store.history(PHONE) == []
+    assert store.purge_expired() == 0  # PHONE already expired lazily, the other one is still active
+    clock.now += 60
+    assert store.purge_expired() == 1
+    assert store.stats()["expirations"] == 2 and len(store) == 0
+
+def test_history_fits_the_token_budget_and_starts_with_a_user_turn(clock):
+    store = ConversationStore(max_turns=10, ttl=60, max_phones=10)
+    store.record_exchange(PHONE, "première question " * 20, "première réponse")
+    store.record_exchange(PHONE, "deuxième question", "deuxième réponse " * 20)
+    store.record_exchange(PHONE, "troisième question", "troisième réponse")
+    history = store.history(PHONE, token_budget=60)
+    assert [turn["content"] for turn in history] == ["troisième question", "troisième réponse"]
+    assert store.history(PHONE, token_budget=0) == []
+
+def test_answer_messages_include_the_phone_history(clock, monkeypatch):
+    store = ConversationStore(max_turns=4, ttl=60, max_phones=10)
+    monkeypatch.setattr(model, "conversation_store", store)
+    model._record_answer("Votre solde est de 100 000 FC.", "Quel est mon solde ?", PHONE)
+
+    messages = model._build_answer_messages("Et ma date limite ?", "Système", PHONE)
+    assert [message["role"] for message in messages] == ["system", "user", "assistant", "user"]
+    assert messages[1]["content"] == "Quel est mon solde ?"
+    assert model._build_answer_messages("Bonjour", "Système")[1:] == [{"role": "user", "content": "Bonjour"}]
+
+def test_cached_answers_follow_the_conversation(app_client, linked_citizen, monkeypatch):
+    phone = linked_citizen["phone_number"]
+    store = ConversationStore(max_turns=10, ttl=600, max_phones=10)
+    calls = []
+
+    async def get_intent(message):
+        return {"intent": "procedures", "confidence": 0.95, "slots": {}, "source": "llm"}
+
+    async def generate_answer(user_prompt, system_prompt, phone_number=None):
+        calls.append(store.history(phone_number))
+        answer = f"Réponse {len(calls)}"
+        store.record_exchange(phone_number, user_prompt, answer)
+        return answer
+
+    monkeypatch.setattr(main, "conversation_store", store)
+    monkeypatch.setattr(main, "get_intent_async", get_intent)
+    monkeypatch.setattr(main, "generate_answer_async", generate_answer)
+    monkeypatch.setattr(main, "CHAT_PIPELINE", "classic")
+    monkeypatch.setattr(model, "answer_cache", TTLCache("answers", max_size=10, ttl=60))
+    monkeypatch.setattr(model, "ANSWER_CACHE_ENABLED", True)
+
+    sent = itertools.count()
+
+    def ask():
+        # Distinct provider ids: each send is a new message, not a redelivery
+        return app_client.post("/chat", json={
+            "phone_number": phone, "message": "Comment renouveler mon permis ?", "message_id": f"wamid.{next(sent)}"
+        }).json()
+
+    assert ask()["response"] == "Réponse 1"
+    # Same question later in the conversation: the first answer was written without this history
+    assert ask()["response"] == "Réponse 2"
+    assert len(calls) == 2
+
+    # A new conversation with the same opening question reuses the first answer, and records it
+    store.clear(phone)
+    assert ask()["response"] == "Réponse 1"
+    assert len(calls) == 2
+    assert [turn["content"] for turn in store.history(phone)] == [
+        "Requête utilisateur: Comment renouveler mon permis ?", "Réponse 1"
+    ]
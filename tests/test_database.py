@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the database URL helpers
+"""
+
+from sqlalchemy.engine import make_url
+
+from src.database import to_async_url
+from src.engine_profile import engine_options
+
+def test_sqlite_url_uses_aiosqlite():
+    assert to_async_url("sqlite:///kodibot.db") == "sqlite+aiosqlite:///kodibot.db"
+    assert to_async_url("sqlite:////tmp/k.db") == "sqlite+aiosqlite:////tmp/k.db"
+
+def test_postgresql_urls_use_asyncpg():
+    assert to_async_url("postgresql://u:p@db:5432/kodi") == "postgresql+asyncpg://u:p@db:5432/kodi"
+    assert to_async_url("postgres://u:p@db/kodi") == "postgresql+asyncpg://u:p@db/kodi"
+
+def test_explicit_driver_is_kept():
+    assert to_async_url("postgresql+psycopg://u@db/kodi") == "postgresql+psycopg://u@db/kodi"
+    assert to_async_url("sqlite+aiosqlite:///k.db") == "sqlite+aiosqlite:///k.db"
+
+def test_postgres_database_url_gets_an_asyncpg_engine():
+    async_url = make_url(to_async_url("postgresql://kodi:secret@db:5432/kodibot"))
+    # The async engine is created with the asyncpg dialect (and its connect arguments)
+    assert async_url.get_dialect().driver == "asyncpg"
+    assert async_url.get_dialect().is_async
+    options = engine_options(async_url.render_as_string(hide_password=False))
+    assert options["connect_args"] == {"server_settings": {"statement_timeout": "15000"}}
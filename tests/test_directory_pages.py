@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Tests for the keyset-paginated citizen directory (/test-users, /debug-db)
+"""
+
+import pytest
+
+import main
+from src.database import SessionLocal, Citizens, LinkedUsers
+from src.services import DataService
+
+def _citizen(db, number, linked=None):
+    citizen_id = f"CIT{number:09d}"
+    db.add(Citizens(phone_number=f"+243{number:09d}", citizen_id=citizen_id, first_name="Amani",
+                    last_name=f"Kabila{number}", address="Av. Lumumba, Kinshasa"))
+    for index, is_linked in enumerate(linked or ()):
+        db.add(LinkedUsers(phone_number=f"+2439{index}{number:07d}", citizen_id=citizen_id, is_linked=is_linked))
+    return citizen_id
+
+def test_pages_follow_the_id_order_without_duplicates(db_session):
+    for number in range(1, 6):
+        # Several link rows per citizen must not repeat the citizen
+        _citizen(db_session, number, linked=[False, True] if number == 2 else [False] if number == 3 else None)
+    db_session.commit()
+
+    first = DataService.get_citizen_directory_page(0, 3, db_session)
+    assert [row.citizen_id for row in first] == ["CIT000000001", "CIT000000002", "CIT000000003"]
+    assert [bool(row.is_linked) for row in first] == [False, True, False]
+
+    second = DataService.get_citizen_directory_page(first[-1].id, 3, db_session)
+    assert [row.citizen_id for row in second] == ["CIT000000004", "CIT000000005"]
+    assert DataService.has_citizens_after(first[-1].id, db_session)
+    assert not DataService.has_citizens_after(second[-1].id, db_session)
+
+def _all_pages(client, path, key, limit):
+    rows, after, pages = [], 0, 0
+    while True:
+        response = client.get(path, params={"limit": limit, "after": after})
+        assert response.status_code == 200
+        page = response.json()
+        assert page["limit"] == limit and len(page[key]) <= limit
+        rows.extend(page[key])
+        pages += 1
+        if page["next_cursor"] is None:
+            return rows, pages
+        after = page["next_cursor"]
+
+def test_test_users_are_streamed_page_by_page(app_client, linked_citizen, monkeypatch):
+    # Small chunks so one page is streamed from several queries
+    monkeypatch.setattr(main, "DIRECTORY_CHUNK_SIZE", 2)
+    db = SessionLocal()
+    try:
+        total = db.query(Citizens).count()
+    finally:
+        db.close()
+
+    users, pages = _all_pages(app_client, "/test-users", "test_users", limit=3)
+    assert len(users) == total
+    assert len({user["citizen_id"] for user in users}) == total
+    assert pages == max(1, -(-total // 3))
+    mine = next(user for user in users if user["citizen_id"] == linked_citizen["citizen_id"])
+    assert mine["is_linked"] is True and mine["name"] == "Patrick Daudi"
+
+def test_debug_db_reports_the_count_and_a_cursor(app_client, linked_citizen):
+    db = SessionLocal()
+    try:
+        _citizen(db, int(linked_citizen["citizen_id"][3:]) + 1)
+        db.commit()
+    finally:
+        db.close()
+
+    page = app_client.get("/debug-db", params={"limit": 1}).json()
+    assert page["status"] == "success" and page["citizen_count"] >= 2
+    assert len(page["citizens"]) == 1
+    following = app_client.get("/debug-db", params={"limit": 1, "after": page["next_cursor"]}).json()
+    assert following["citizens"][0]["citizen_id"] != page["citizens"][0]["citizen_id"]
+
+@pytest.mark.parametrize("params", [{"limit": 0}, {"limit": main.DIRECTORY_MAX_LIMIT + 1}, {"after": -1}])
+def test_page_parameters_are_checked(app_client, params):
+    assert app_client.get("/test-users", params=params).status_code == 400
+    assert app_client.get("/debug-db", params=params).status_code == 400
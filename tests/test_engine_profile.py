@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the SQLite/PostgreSQL engine profile
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+import src.engine_profile as engine_profile
+from src.database import check_upsert_support
+from src.engine_profile import sqlite_pragmas, engine_options, apply_engine_profile, engine_report
+
+def test_file_database_gets_wal_and_mmap():
+    pragmas = sqlite_pragmas(make_url("sqlite:///kodibot.db"))
+    assert list(pragmas) == ["busy_timeout", "journal_mode", "mmap_size", "synchronous", "cache_size"]
+    assert pragmas["journal_mode"] == "WAL" and pragmas["synchronous"] == "NORMAL"
+
+def test_memory_database_skips_journal_and_mmap():
+    assert "journal_mode" not in sqlite_pragmas(make_url("sqlite://"))
+    assert "mmap_size" not in sqlite_pragmas(make_url("sqlite:///:memory:"))
+    assert engine_options("sqlite:///:memory:") == {}
+
+def test_sqlite_driver_timeout_matches_the_busy_timeout():
+    assert engine_options("sqlite:///kodibot.db") == {"connect_args": {"timeout": 5.0}}
+    assert engine_options("sqlite+aiosqlite:///kodibot.db") == {"connect_args": {"timeout": 5.0}}
+
+def test_postgresql_pool_and_statement_timeout():
+    options = engine_options("postgresql://kodi:secret@db:5432/kodibot")
+    assert options["pool_size"] == 10 and options["max_overflow"] == 20 and options["pool_pre_ping"] is True
+    assert options["connect_args"] == {"options": "-c statement_timeout=15000"}
+
+def test_asyncpg_statement_timeout_is_a_server_setting():
+    options = engine_options("postgresql+asyncpg://kodi:secret@db:5432/kodibot")
+    assert options["connect_args"] == {"server_settings": {"statement_timeout": "15000"}}
+
+def test_default_profile_keeps_sqlalchemy_defaults(monkeypatch):
+    monkeypatch.setattr(engine_profile, "DB_ENGINE_PROFILE", "default")
+    assert engine_options("postgresql://kodi:secret@db/kodibot") == {}
+
+def test_pragmas_are_applied_on_every_connection(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'profile.db'}", **engine_options(f"sqlite:///{tmp_path / 'profile.db'}"))
+    apply_engine_profile(engine)
+    report = engine_report(engine)
+    assert report["journal_mode"] == "wal"
+    assert report["synchronous"] == 1  # NORMAL
+    assert report["busy_timeout"] == 5000
+    assert report["cache_size"] == -65536
+    engine.dispose()
+
+def test_default_profile_leaves_sqlite_connections_alone(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine_profile, "DB_ENGINE_PROFILE", "default")
+    engine = create_engine(f"sqlite:///{tmp_path / 'plain.db'}")
+    apply_engine_profile(engine)
+    assert engine_report(engine)["journal_mode"] == "delete"
+    engine.dispose()
+
+def test_backends_without_upserts_stop_startup():
+    check_upsert_support(create_engine("sqlite://"))
+    with pytest.raises(RuntimeError, match="mysql.*SQLite or PostgreSQL"):
+        check_upsert_support(SimpleNamespace(dialect=SimpleNamespace(name="mysql")))
+    old_sqlite = SimpleNamespace(name="sqlite", dbapi=SimpleNamespace(sqlite_version_info=(3, 31, 1)))
+    with pytest.raises(RuntimeError, match="SQLite 3.31.1 is too old"):
+        check_upsert_support(SimpleNamespace(dialect=old_sqlite))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Unit tests for linked-citizen resolution and the identity cache
+"""
+
+import pytest
+
+import src.services as services
+from src.cache import TTLCache
+from src.database import Citizens, LinkedUsers
+from src.services import AuthService
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    cache = TTLCache("identities", max_size=100, ttl=60)
+    monkeypatch.setattr(services, "identity_cache", cache)
+    monkeypatch.setattr(services, "IDENTITY_CACHE_ENABLED", True)
+    return cache
+
+@pytest.fixture
+def seeded(db_session):
+    db_session.add(Citizens(citizen_id="CIT1", phone_number="+243001", first_name="Patrick", last_name="Daudi"))
+    db_session.add(Citizens(citizen_id="CIT2", phone_number="+243002", first_name="Bienvenu", last_name="Faraja"))
+    db_session.add(LinkedUsers(phone_number="+243001", citizen_id="CIT1", is_linked=True))
+    db_session.add(LinkedUsers(phone_number="+243009", citizen_id="CIT404", is_linked=True))
+    db_session.commit()
+    return db_session
+
+def test_linked_phone_resolves_to_its_citizen(seeded):
+    identity = AuthService.resolve_linked_citizen("+243001", seeded)
+    assert identity.citizen_id == "CIT1"
+    assert identity.full_name == "Patrick Daudi"
+    assert identity.citizen_found
+
+def test_link_to_a_missing_citizen_is_reported(seeded):
+    identity = AuthService.resolve_linked_citizen("+243009", seeded)
+    assert identity.citizen_id == "CIT404"
+    assert not identity.citizen_found
+
+def test_unlinked_results_are_cached_too(seeded, fresh_cache):
+    assert AuthService.resolve_linked_citizen("+243002", seeded) is None
+    assert AuthService.resolve_linked_citizen("+243002", seeded) is None
+    assert fresh_cache.hits == 1
+
+def test_completing_a_link_refreshes_the_cached_identity(seeded):
+    assert AuthService.resolve_linked_citizen("+243002", seeded) is None
+    otp = AuthService.initiate_linking("+243002", "CIT2", seeded)["otp"]
+    assert AuthService.resolve_linked_citizen("+243002", seeded) is None  # OTP pending
+    assert AuthService.verify_otp("+243002", otp, seeded)["success"]
+    assert AuthService.resolve_linked_citizen("+243002", seeded).citizen_id == "CIT2"
+
+def test_citizen_update_clears_cached_names(seeded):
+    AuthService.resolve_linked_citizen("+243001", seeded)
+    citizen = seeded.query(Citizens).filter(Citizens.citizen_id == "CIT1").one()
+    citizen.first_name = "Pat"
+    seeded.commit()
+    assert AuthService.resolve_linked_citizen("+243001", seeded).full_name == "Pat Daudi"
+
+def test_rolled_back_writes_do_not_invalidate(seeded, fresh_cache):
+    AuthService.resolve_linked_citizen("+243001", seeded)
+    citizen = seeded.query(Citizens).filter(Citizens.citizen_id == "CIT1").one()
+    citizen.first_name = "Pat"
+    seeded.flush()
+    seeded.rollback()
+    seeded.commit()
+    assert len(fresh_cache) == 1
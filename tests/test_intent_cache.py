@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the intent memo and its SQLite store
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import src.model as model
+from src.cache import TTLCache, SQLiteCacheStore
+
+def _completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+@pytest.fixture
+def memo(monkeypatch):
+    fresh = TTLCache("intents", max_size=100, ttl=3600)
+    monkeypatch.setattr(model, "intent_cache", fresh)
+    monkeypatch.setattr(model, "INTENT_CACHE_ENABLED", True)
+    monkeypatch.setattr(model, "_intent_cache_store", None)
+    monkeypatch.setattr(model, "classify_locally", lambda message: None)
+    return fresh
+
+@pytest.fixture
+def llm(monkeypatch):
+    calls = []
+    def create_completion(operation, **params):
+        calls.append(params["messages"][-1]["content"])
+        return _completion(json.dumps({"intent": "tax_info", "confidence": 0.93, "slots": {}}))
+    monkeypatch.setattr(model, "create_completion", create_completion)
+    return calls
+
+def test_normalized_repeat_skips_the_llm(memo, llm):
+    first = model.get_intent("Quel est mon solde ?")
+    second = model.get_intent("quel est MON solde")
+    assert len(llm) == 1
+    assert second["intent"] == first["intent"] == "tax_info"
+    assert second["source"] == "llm"
+
+def test_disabled_memo_always_calls_the_llm(memo, llm, monkeypatch):
+    monkeypatch.setattr(model, "INTENT_CACHE_ENABLED", False)
+    model.get_intent("mes impôts")
+    model.get_intent("mes impôts")
+    assert len(llm) == 2
+    assert len(memo) == 0
+
+def test_llm_failures_are_not_memoized(memo, monkeypatch):
+    def failing(operation, **params):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(model, "create_completion", failing)
+    assert model.get_intent("bonjour")["source"] == "rules"
+    assert len(memo) == 0
+
+def test_sqlite_store_round_trip(tmp_path):
+    store = SQLiteCacheStore(str(tmp_path / "cache.db"), "intent_cache")
+    store.save("bonjour", {"intent": "greeting", "confidence": 0.9, "slots": {}}, ttl=60)
+    store.save("expired", {"intent": "fallback"}, ttl=-1)
+    loaded = list(store.load(limit=10))
+    store.close()
+    assert [key for key, _, _ in loaded] == ["bonjour"]
+    key, value, remaining = loaded[0]
+    assert value["intent"] == "greeting"
+    assert 0 < remaining <= 60
+
+def test_memo_is_persisted_and_warmed(memo, llm, monkeypatch, tmp_path):
+    path = str(tmp_path / "intent_cache.db")
+    monkeypatch.setenv("INTENT_CACHE_PERSIST", "true")
+    monkeypatch.setenv("INTENT_CACHE_DB", path)
+    model.load_intent_cache()
+    model.get_intent("mes impôts")
+    model._intent_cache_store.close()
+    
+    warmed = TTLCache("intents", max_size=100, ttl=3600)
+    monkeypatch.setattr(model, "intent_cache", warmed)
+    model.load_intent_cache()
+    model._intent_cache_store.close()
+    assert warmed.get("mes impots")["intent"] == "tax_info"
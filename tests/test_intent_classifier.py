@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the local intent classifier and its training data
+"""
+
+from collections import Counter
+
+from src.database import ChatLogs
+from src.intent_classifier import LocalIntentClassifier, load_training_samples, evaluate
+from src.model import get_intent_fallback, _parse_intent_content
+
+SAMPLES = [
+    ("bonjour", "greeting"), ("bonsoir", "greeting"), ("salut kodibot", "greeting"), ("bonjour à vous", "greeting"),
+    ("quel est mon solde de taxe", "tax_info"), ("combien je dois en impôts", "tax_info"),
+    ("mes taxes impayées", "tax_info"), ("solde fiscal", "tax_info"),
+    ("mes parcelles", "parcels"), ("liste de mes terrains", "parcels"),
+    ("mes biens cadastraux", "parcels"), ("parcelle à gombe", "parcels"),
+]
+
+def test_train_predict_and_roundtrip(tmp_path):
+    model = LocalIntentClassifier.train(SAMPLES, epochs=30)
+    assert model.predict("bonjour kodibot")[0] == "greeting"
+    assert model.predict("mon solde de taxe")[0] == "tax_info"
+    
+    path = tmp_path / "model.json"
+    model.save(str(path))
+    loaded = LocalIntentClassifier.load(str(path))
+    assert loaded.labels == model.labels
+    assert loaded.predict("mes parcelles")[0] == "parcels"
+    assert evaluate(loaded, SAMPLES, threshold=0.0)["accuracy"] >= 0.9
+
+def _log(db, text, intent, source, confidence=0.95, direction="IN"):
+    db.add(ChatLogs(phone_number="+243000", message_text=text, direction=direction,
+                    intent=intent, confidence=confidence, intent_source=source))
+
+def test_training_samples_only_use_llm_and_human_labels(db_session):
+    _log(db_session, "bonjour", "greeting", "llm")
+    _log(db_session, "mes parcelles svp", "parcels", "human")
+    _log(db_session, "solde", "tax_info", "rules")
+    _log(db_session, "impots", "tax_info", "local")
+    _log(db_session, "ancien message", "greeting", None)
+    _log(db_session, "peu sûr", "greeting", "llm", confidence=0.3)
+    _log(db_session, "Bonjour Patrick", "greeting", "llm", direction="OUT")
+    db_session.commit()
+    
+    samples = load_training_samples(db_session, min_confidence=0.7)
+    assert sorted(samples) == [("bonjour", "greeting"), ("mes parcelles svp", "parcels")]
+    
+    assert load_training_samples(db_session, sources=("rules",)) == [("solde", "tax_info")]
+
+def test_legacy_rows_are_an_explicit_opt_in(db_session):
+    _log(db_session, "bonjour", "greeting", "llm")
+    _log(db_session, "ancien message", "greeting", None)
+    _log(db_session, "ancien sans confiance", "greeting", None, confidence=None)
+    _log(db_session, "solde", "tax_info", "rules")
+    db_session.commit()
+
+    counts = Counter()
+    samples = load_training_samples(db_session, include_legacy=True, source_counts=counts)
+    assert sorted(samples) == [("ancien message", "greeting"), ("bonjour", "greeting")]
+    assert counts == {"llm": 1, "legacy": 1}
+
+    counts = Counter()
+    assert load_training_samples(db_session, source_counts=counts) == [("bonjour", "greeting")]
+    assert counts == {"llm": 1}
+
+def test_duplicate_messages_take_the_majority_label(db_session):
+    for intent in ("greeting", "greeting", "fallback"):
+        _log(db_session, "Bonjour", intent, "llm")
+    db_session.commit()
+    assert load_training_samples(db_session) == [("Bonjour", "greeting")]
+
+def test_classifications_record_their_source():
+    assert get_intent_fallback("bonjour")["source"] == "rules"
+    parsed = _parse_intent_content('{"intent": "greeting", "confidence": 0.9, "slots": {}}', {})
+    assert parsed["source"] == "llm"
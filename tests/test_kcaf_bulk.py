@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for bulk K-CAF ingestion (JSON array and NDJSON, chunked multi-row inserts)
+"""
+
+import json
+
+import main
+from src.models import KCAF_RecordCreate
+from src.services import DataService
+
+def _bulk(client, items, ndjson=False, **params):
+    if ndjson:
+        body = "\n".join(item if isinstance(item, str) else json.dumps(item) for item in items)
+        return client.post("/kcaf-records/bulk", params=params, content=body.encode("utf-8"),
+                           headers={"Content-Type": "application/x-ndjson"})
+    return client.post("/kcaf-records/bulk", params=params, json=items)
+
+def test_json_array_rows_are_reported_one_by_one(app_client, kcaf_payload):
+    first, second = kcaf_payload(), kcaf_payload()
+    missing = kcaf_payload()
+    del missing["nom_proprietaire"]
+    response = _bulk(app_client, [first, second, missing, "pas un objet", first])
+    assert response.status_code == 200
+    body = response.json()
+
+    assert (body["total"], body["created"], body["duplicate"], body["invalid"]) == (5, 2, 1, 2)
+    assert [result["status"] for result in body["results"]] == ["created", "created", "invalid", "invalid", "duplicate"]
+    assert "nom_proprietaire" in body["results"][2]["error"]
+    assert body["results"][2]["parcel_number"] == missing["parcel_number"]
+    assert app_client.get(f"/kcaf-records/{first['parcel_number']}").json()["id"] == body["results"][0]["id"]
+
+def test_existing_parcels_are_duplicates(app_client, kcaf_payload):
+    record = kcaf_payload()
+    assert app_client.post("/kcaf-records", json=record).status_code == 201
+    body = _bulk(app_client, [record]).json()
+    assert body["duplicate"] == 1 and body["created"] == 0
+
+def test_ndjson_is_read_line_by_line(app_client, kcaf_payload):
+    records = [kcaf_payload(), kcaf_payload()]
+    body = _bulk(app_client, [records[0], "{pas du json", "", records[1]], ndjson=True).json()
+    assert [result["status"] for result in body["results"]] == ["created", "invalid", "created"]
+    assert body["results"][1]["error"].startswith("JSON invalide")
+    assert body["results"][2]["index"] == 2  # blank lines are not counted
+
+def test_rows_are_written_in_chunks(app_client, kcaf_payload, monkeypatch):
+    monkeypatch.setattr(main, "KCAF_BULK_CHUNK_SIZE", 2)
+    chunks = []
+    write = DataService.bulk_create_kcaf_records
+
+    def recording_write(records, db):
+        chunks.append([index for index, _ in records])
+        return write(records, db)
+
+    monkeypatch.setattr(DataService, "bulk_create_kcaf_records", staticmethod(recording_write))
+    records = [kcaf_payload() for _ in range(5)]
+    invalid = dict(records[2], nombre_appartements="beaucoup")
+    body = _bulk(app_client, records[:2] + [invalid] + records[3:]).json()
+
+    assert chunks == [[0, 1], [3, 4]]
+    assert [result["index"] for result in body["results"]] == [0, 1, 2, 3, 4]
+    assert body["created"] == 4 and body["invalid"] == 1
+
+def test_bad_bodies_are_rejected(app_client, kcaf_payload):
+    assert _bulk(app_client, {"parcel_number": "KIN-1"}).status_code == 400
+    assert app_client.post("/kcaf-records/bulk", content=b"[{", headers={"Content-Type": "application/json"}).status_code == 400
+    assert _bulk(app_client, [kcaf_payload()], mode="remplacer").status_code == 400
+
+def test_one_chunk_is_one_insert(db_session, kcaf_payload):
+    records = [(index, KCAF_RecordCreate(**kcaf_payload())) for index in range(3)]
+    results = DataService.bulk_create_kcaf_records(records + [(3, records[0][1])], db_session)
+    assert [result["status"] for result in results] == ["created", "created", "created", "duplicate"]
+    assert len({result["id"] for result in results[:3]}) == 3
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for K-CAF upserts (version ordering, resent submissions, created vs updated) and idempotent creates
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+
+from src.database import KCAF_Records, begin_write
+from src.models import KCAF_RecordCreate
+from src.services import DataService
+
+def _upsert(client, items):
+    return [result["status"] for result in
+            client.post("/kcaf-records/bulk", params={"mode": "upsert"}, json=items).json()["results"]]
+
+def test_identical_resend_is_unchanged(app_client, kcaf_payload):
+    record = kcaf_payload()
+    assert _upsert(app_client, [record]) == ["created"]
+    assert _upsert(app_client, [record]) == ["unchanged"]
+    # A real edit without a version still lands
+    assert _upsert(app_client, [dict(record, etat="validé")]) == ["updated"]
+    assert app_client.get(f"/kcaf-records/{record['parcel_number']}").json()["etat"] == "validé"
+
+def test_versions_decide_the_update(app_client, kcaf_payload):
+    record = kcaf_payload(client_version=2)
+    assert _upsert(app_client, [record]) == ["created"]
+    assert _upsert(app_client, [dict(record, client_version=3, montant_a_payer=300000.0)]) == ["updated"]
+    assert _upsert(app_client, [dict(record, client_version=1, montant_a_payer=1.0)]) == ["unchanged"]
+    stored = app_client.get(f"/kcaf-records/{record['parcel_number']}").json()
+    assert stored["montant_a_payer"] == 300000.0
+
+def test_replayed_token_and_older_edit_are_unchanged(app_client, kcaf_payload):
+    edited_at = datetime.utcnow() - timedelta(hours=1)
+    record = kcaf_payload(idempotency_token="tok-1", updated_at=edited_at.isoformat())
+    assert _upsert(app_client, [record]) == ["created"]
+    assert _upsert(app_client, [dict(record, etat="validé")]) == ["unchanged"]
+    earlier = (edited_at - timedelta(minutes=10)).isoformat()
+    assert _upsert(app_client, [dict(record, idempotency_token="tok-2", etat="rejeté", updated_at=earlier)]) == ["unchanged"]
+    assert app_client.get(f"/kcaf-records/{record['parcel_number']}").json()["etat"] == "soumis"
+
+def test_created_and_updated_in_one_chunk(db_session, kcaf_payload):
+    first, second = kcaf_payload(), kcaf_payload()
+    DataService.upsert_kcaf_records([(0, KCAF_RecordCreate(**first))], db_session)
+    chunk = [
+        (0, KCAF_RecordCreate(**dict(first, etat="validé"))),
+        (1, KCAF_RecordCreate(**second)),
+        (2, KCAF_RecordCreate(**second)),
+    ]
+    results = DataService.upsert_kcaf_records(chunk, db_session)
+    assert [result["status"] for result in results] == ["updated", "created", "duplicate"]
+    assert db_session.query(KCAF_Records).count() == 2
+
+def test_single_upsert_reports_its_status(app_client, kcaf_payload):
+    record = kcaf_payload()
+    response = app_client.post("/kcaf-records", params={"mode": "upsert"}, json=record)
+    assert (response.status_code, response.headers["X-Upsert-Status"]) == (201, "created")
+    response = app_client.post("/kcaf-records", params={"mode": "upsert"}, json=record)
+    assert (response.status_code, response.headers["X-Upsert-Status"]) == (200, "unchanged")
+    response = app_client.post("/kcaf-records", params={"mode": "upsert"}, json=dict(record, etat="validé"))
+    assert (response.status_code, response.headers["X-Upsert-Status"]) == (200, "updated")
+    assert response.json()["etat"] == "validé"
+
+def test_create_retry_returns_the_stored_record(app_client, kcaf_payload):
+    record = kcaf_payload()
+    headers = {"Idempotency-Key": "sync-42"}
+    created = app_client.post("/kcaf-records", json=record, headers=headers)
+    assert created.status_code == 201
+    retry = app_client.post("/kcaf-records", json=record, headers=headers)
+    assert retry.status_code == 201 and retry.json()["id"] == created.json()["id"]
+    assert app_client.post("/kcaf-records", json=record).status_code == 409
+
+def test_postgres_upsert_returns_the_insert_marker():
+    db = SimpleNamespace(get_bind=lambda: SimpleNamespace(dialect=postgresql.dialect()))
+    compiled = str(DataService._kcaf_upsert_statement(db).compile(dialect=postgresql.dialect()))
+    assert "RETURNING kcaf_records.id, kcaf_records.parcel_number, xmax = 0 AS inserted" in compiled
+
+def test_sqlite_upsert_reads_under_the_write_lock(db_session, db_engine):
+    begin_write(db_session)
+    other = sqlite3.connect(db_engine.url.database, timeout=0)
+    try:
+        try:
+            other.execute("INSERT INTO kcaf_records (parcel_number) VALUES ('KIN-CONCURRENT')")
+            locked = False
+        except sqlite3.OperationalError as e:
+            locked = "locked" in str(e)
+        assert locked
+        db_session.commit()
+        other.execute("INSERT INTO kcaf_records (parcel_number) VALUES ('KIN-CONCURRENT')")
+    finally:
+        other.close()
+
+def test_idempotency_token_is_not_sent_back(app_client, kcaf_payload):
+    record = kcaf_payload(idempotency_token="jeton-interne")
+    created = app_client.post("/kcaf-records", json=record)
+    assert created.status_code == 201 and "idempotency_token" not in created.json()
+    stored = app_client.get(f"/kcaf-records/{record['parcel_number']}").json()
+    assert "idempotency_token" not in stored and stored["parcel_number"] == record["parcel_number"]
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Aho-Corasick keyword matcher and the rule-based intent fallback
+"""
+
+import random
+
+import pytest
+
+from src.keyword_matcher import KeywordMatcher
+from src.model import get_intent_fallback, _extract_slots
+
+def _naive_matches(patterns, text):
+    return sorted(
+        (start, pattern, payload)
+        for pattern, payload in patterns
+        for start in range(len(text) - len(pattern) + 1)
+        if text.startswith(pattern, start)
+    )
+
+def test_overlapping_and_nested_patterns():
+    patterns = [("he", 1), ("she", 2), ("his", 3), ("hers", 4)]
+    matcher = KeywordMatcher(patterns)
+    assert sorted(matcher.iter_matches("ushers")) == [(1, "she", 2), (2, "he", 1), (2, "hers", 4)]
+
+def test_matches_agree_with_naive_search():
+    rng = random.Random(7)
+    patterns = [("".join(rng.choice("abc") for _ in range(rng.randint(1, 4))), i) for i in range(25)]
+    patterns = list(dict(patterns).items())
+    matcher = KeywordMatcher(patterns)
+    for _ in range(50):
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 40)))
+        assert sorted(matcher.iter_matches(text)) == _naive_matches(patterns, text)
+
+def test_patterns_added_after_build_are_matched():
+    matcher = KeywordMatcher([("taxe", "tax")])
+    matcher.add("axe", "axe")
+    assert sorted(pattern for _, pattern, _ in matcher.iter_matches("ma taxe")) == ["axe", "taxe"]
+
+def test_empty_pattern_is_rejected():
+    with pytest.raises(ValueError):
+        KeywordMatcher([("", None)])
+
+def test_fallback_intent_sums_distinct_pattern_weights():
+    result = get_intent_fallback("Quel est mon solde de taxe ?")
+    assert result["intent"] == "tax_info"
+    assert result["confidence"] == 0.8
+
+def test_nested_match_is_ignored():
+    # "bien" inside "à bientôt" must not count as a parcels keyword
+    assert get_intent_fallback("Merci, à bientôt")["intent"] == "goodbye"
+
+def test_unknown_message_is_fallback():
+    assert get_intent_fallback("xyz")["intent"] == "fallback"
+
+def test_procedure_slot_takes_first_keyword_in_list_order():
+    assert _extract_slots("carte et permis à renouveler")["procedure_name"] == "permis"
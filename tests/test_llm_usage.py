@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Unit tests for OpenAI usage accounting (tokens, latency, cost)
+"""
+
+import asyncio
+import contextvars
+from types import SimpleNamespace
+
+import pytest
+
+import src.openai_client as openai_client
+from src.metrics import LLMUsageTracker, LLM_CALLS, estimate_cost, llm_usage, set_llm_context
+
+def _usage(prompt=0, completion=0, cached=0):
+    return SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion,
+                           prompt_tokens_details=SimpleNamespace(cached_tokens=cached))
+
+class FakeCompletions:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def create(self, **params):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    """Point the global OpenAI client at a canned completion or error"""
+    def install(outcome):
+        client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(outcome)))
+        monkeypatch.setattr(openai_client, "get_client", lambda: client)
+    monkeypatch.setattr(openai_client, "LLM_SINGLE_FLIGHT", False)
+    monkeypatch.setattr(openai_client.circuit_breaker, "enabled", False)
+    llm_usage.reset()
+    yield install
+    llm_usage.reset()
+
+def test_cost_uses_cached_input_price():
+    # gpt-4o-mini: 0.15 input, 0.075 cached input, 0.60 output per million tokens
+    cost = estimate_cost("gpt-4o-mini", prompt_tokens=1_000_000, completion_tokens=1_000_000, cached_tokens=400_000)
+    assert cost == pytest.approx(0.6 * 0.15 + 0.4 * 0.075 + 0.60)
+
+def test_dated_snapshot_shares_the_base_price():
+    assert estimate_cost("gpt-4o-mini-2024-07-18", 1000, 100) == estimate_cost("gpt-4o-mini", 1000, 100)
+    # gpt-4o-mini must not be priced as gpt-4o
+    assert estimate_cost("gpt-4o-mini", 1000, 0) < estimate_cost("gpt-4o", 1000, 0)
+
+def test_unknown_model_costs_nothing():
+    assert estimate_cost("modele-inconnu", 1000, 1000) == 0.0
+
+def test_summary_groups_calls_by_label():
+    tracker = LLMUsageTracker(persist=False)
+
+    def call(endpoint, intent, operation, tokens):
+        set_llm_context(endpoint=endpoint, intent=intent)
+        tracker.record(operation, "gpt-4o-mini", "success", 0.2, prompt_tokens=tokens, completion_tokens=10)
+
+    contextvars.copy_context().run(call, "/chat", "tax_info", "answer", 1000)
+    contextvars.copy_context().run(call, "/chat", "tax_info", "intent", 200)
+    contextvars.copy_context().run(call, "/chat/stream", "greeting", "answer", 100)
+
+    by_intent = tracker.summary("intent")
+    assert by_intent["total"]["calls"] == 3
+    assert by_intent["total"]["prompt_tokens"] == 1300
+    assert [group["intent"] for group in by_intent["groups"]] == ["tax_info", "greeting"]
+    assert by_intent["groups"][0]["calls"] == 2
+    assert by_intent["groups"][0]["latency_seconds"]["count"] == 2
+
+    by_endpoint = tracker.summary("endpoint")
+    assert {group["endpoint"]: group["calls"] for group in by_endpoint["groups"]} == {"/chat": 2, "/chat/stream": 1}
+
+    with pytest.raises(ValueError):
+        tracker.summary("phone_number")
+
+def test_calls_outside_a_request_are_labelled_internal():
+    tracker = LLMUsageTracker(persist=False)
+    contextvars.copy_context().run(tracker.record, "intent", "gpt-4o-mini", "success", 0.1)
+    group = tracker.summary("endpoint")["groups"][0]
+    assert group["endpoint"] == "internal"
+
+def test_successful_completion_is_accounted(fake_client):
+    fake_client(SimpleNamespace(model="gpt-4o-mini-2024-07-18", usage=_usage(120, 30, 100)))
+    before = LLM_CALLS.value("answer", "success")
+
+    openai_client.create_completion("answer", model="gpt-4o-mini", messages=[{"role": "user", "content": "Bonjour"}])
+
+    total = llm_usage.summary("model")["total"]
+    assert total["calls"] == 1
+    assert (total["prompt_tokens"], total["completion_tokens"], total["cached_tokens"]) == (120, 30, 100)
+    assert total["cost_usd"] == pytest.approx(estimate_cost("gpt-4o-mini", 120, 30, 100), abs=1e-6)
+    # The model reported by OpenAI wins over the requested one
+    assert llm_usage.summary("model")["groups"][0]["model"] == "gpt-4o-mini-2024-07-18"
+    assert LLM_CALLS.value("answer", "success") == before + 1
+
+@pytest.mark.parametrize("error, outcome", [
+    (RuntimeError("Error code: 429 - insufficient_quota"), "quota"),
+    (RuntimeError("Connection reset"), "error"),
+])
+def test_failed_completion_is_accounted_and_reraised(fake_client, error, outcome):
+    fake_client(error)
+
+    with pytest.raises(RuntimeError):
+        openai_client.create_completion("intent", model="gpt-4o-mini", messages=[])
+
+    total = llm_usage.summary()["total"]
+    assert total["outcomes"] == {outcome: 1}
+    assert total["prompt_tokens"] == 0
+
+def test_accounting_errors_never_fail_the_call(fake_client, monkeypatch):
+    fake_client(SimpleNamespace(model="gpt-4o-mini", usage=_usage(10, 5)))
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("tracker cassé")
+    monkeypatch.setattr(openai_client.llm_usage, "record", broken)
+
+    completion = openai_client.create_completion("answer", model="gpt-4o-mini", messages=[])
+    assert completion.usage.prompt_tokens == 10
+
+def test_stream_usage_comes_from_the_final_chunk(fake_client, monkeypatch):
+    chunks = [SimpleNamespace(usage=None), SimpleNamespace(usage=None), SimpleNamespace(usage=_usage(80, 2))]
+
+    class FakeStream:
+        async def create(self, **params):
+            assert params["stream_options"] == {"include_usage": True}
+            async def stream():
+                for chunk in chunks:
+                    yield chunk
+            return stream()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=FakeStream()))
+    monkeypatch.setattr(openai_client, "get_async_client", lambda: client)
+
+    async def consume():
+        return [chunk async for chunk in openai_client.astream_completion("answer", model="gpt-4o-mini", messages=[])]
+
+    assert len(asyncio.run(consume())) == 3
+    total = llm_usage.summary()["total"]
+    assert (total["calls"], total["prompt_tokens"], total["completion_tokens"]) == (1, 80, 2)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the write-behind chat log writer
+"""
+
+import time
+
+import pytest
+from sqlalchemy import func
+
+from src.database import ChatLogs, ChatLogRollup, Citizens
+from src.log_writer import ChatLogWriter
+
+@pytest.fixture
+def writer(session_factory):
+    instance = ChatLogWriter(session_factory=session_factory, flush_ms=20, batch_size=100, max_queue=100)
+    yield instance
+    instance.stop()
+
+@pytest.fixture
+def paused(writer, monkeypatch):
+    """Writer whose flusher thread never starts: items stay queued until _drain()"""
+    monkeypatch.setattr(writer, "start", lambda: None)
+    return writer
+
+def _messages(db):
+    return db.query(func.sum(ChatLogRollup.message_count)).scalar() or 0
+
+def test_logs_are_written_with_ids_and_rollups(writer, db_session):
+    first = writer.log("+243001", "bonjour", "IN", intent="greeting", confidence=0.9)
+    second = writer.log("+243001", "Bonjour !", "OUT")
+    assert writer.flush()
+    assert first.id is not None and second.id is not None
+    assert db_session.query(ChatLogs).count() == 2
+    assert _messages(db_session) == 2
+
+def test_update_after_write_moves_the_rollup(writer, db_session):
+    entry = writer.log("+243001", "mes taxes", "IN")
+    assert writer.flush()
+    writer.update(entry, intent="tax_info", confidence=0.95, intent_source="llm")
+    assert writer.flush()
+    row = db_session.get(ChatLogs, entry.id)
+    assert (row.intent, row.confidence, row.intent_source) == ("tax_info", 0.95, "llm")
+    counts = dict(db_session.query(ChatLogRollup.intent, ChatLogRollup.message_count).all())
+    assert counts == {"": 0, "tax_info": 1}
+
+def test_update_of_a_queued_row_is_folded_into_the_insert(paused, db_session):
+    entry = paused.log("+243001", "mes parcelles", "IN")
+    paused.update(entry, intent="parcels", confidence=0.9)
+    paused._drain()
+    row = db_session.get(ChatLogs, entry.id)
+    assert row.intent == "parcels"
+    assert entry.intent == "parcels"
+    assert db_session.query(ChatLogRollup.intent).all() == [("parcels",)]
+
+def test_full_queue_drops_instead_of_blocking(session_factory, monkeypatch):
+    writer = ChatLogWriter(session_factory=session_factory, max_queue=1)
+    monkeypatch.setattr(writer, "start", lambda: None)
+    writer.log("+243001", "un", "IN")
+    started = time.monotonic()
+    writer.log("+243001", "deux", "IN")
+    assert time.monotonic() - started < 0.5
+    assert writer.stats()["dropped"] == 1
+    assert writer.stats()["enqueued"] == 1
+    writer._drain()
+
+def test_bad_row_does_not_lose_the_rest_of_the_batch(paused, db_session):
+    before = paused.log("+243001", "avant", "IN", intent="greeting", confidence=0.9)
+    paused.insert(Citizens, {"citizen_id": "CIT1", "phone_number": "+243777"})
+    paused.insert(Citizens, {"citizen_id": "CIT2", "phone_number": "+243777"})  # unique violation
+    after = paused.log("+243001", "après", "OUT")
+    paused.update(before, intent="goodbye")
+    paused._drain()
+    
+    stats = paused.stats()
+    assert stats["failed"] == 1 and stats["retried_batches"] == 1
+    assert {row.message_text for row in db_session.query(ChatLogs)} == {"avant", "après"}
+    assert db_session.query(Citizens).count() == 1
+    assert db_session.get(ChatLogs, before.id).intent == "goodbye"
+    assert after.id is not None
+    counts = dict(db_session.query(ChatLogRollup.intent, ChatLogRollup.message_count).all())
+    assert counts == {"greeting": 0, "goodbye": 1, "": 1}
+
+def test_update_of_a_lost_row_is_counted(session_factory, db_session, monkeypatch):
+    writer = ChatLogWriter(session_factory=session_factory, max_queue=1)
+    monkeypatch.setattr(writer, "start", lambda: None)
+    writer.log("+243001", "un", "IN")
+    lost = writer.log("+243001", "deux", "IN")  # queue full: never written
+    writer._drain()
+    writer.update(lost, intent="greeting", confidence=0.9)
+    writer._drain()
+    stats = writer.stats()
+    assert stats["dropped"] == 1 and stats["orphaned_updates"] == 1 and stats["updates"] == 0
+    assert db_session.query(ChatLogs).count() == 1
+
+def test_stopped_writer_is_not_restarted(writer, db_session):
+    writer.log("+243001", "avant l'arrêt", "IN")
+    writer.stop()
+    late = writer.log("+243001", "après l'arrêt", "IN")
+    assert not writer.stats()["running"]
+    assert late.id is None and writer.stats()["queue_depth"] == 1
+    # Written by the next drain (flush, or the exit hook's stop)
+    assert writer.flush()
+    assert late.id is not None and db_session.query(ChatLogs).count() == 2
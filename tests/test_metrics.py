@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the in-process metrics and the /metrics endpoint
+"""
+
+import re
+
+import pytest
+
+import main
+from src.metrics import (
+    Histogram, Counter, LabeledHistogram, CallbackMetric, REGISTRY, render_prometheus,
+    CHAT_STAGE_SECONDS, CHAT_REQUESTS
+)
+
+@pytest.fixture
+def registry():
+    """Drop the metrics a test registers from the global registry afterwards"""
+    size = len(REGISTRY)
+    yield
+    del REGISTRY[size:]
+
+def _sample(text: str, name: str) -> float:
+    match = re.search(rf"^{re.escape(name)} (\S+)$", text, re.MULTILINE)
+    assert match, f"{name} missing from /metrics"
+    return float(match.group(1))
+
+def test_quantiles_are_bucket_upper_bounds():
+    histogram = Histogram(buckets=(0.1, 0.5, 1.0))
+    assert histogram.quantile(0.5) is None
+    for value in (0.05, 0.05, 0.3, 0.8, 4.0):
+        histogram.observe(value)
+    assert histogram.quantile(0.4) == 0.1
+    assert histogram.quantile(0.6) == 0.5
+    assert histogram.quantile(0.99) == float("inf")
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5 and snapshot["avg"] == pytest.approx(1.04)
+
+def test_counter_renders_escaped_labels(registry):
+    counter = Counter("kodibot_test_total", "Test counter", ("intent",))
+    counter.inc('tax "info"')
+    counter.inc('tax "info"', amount=2)
+    assert counter.value('tax "info"') == 3
+    assert counter.render() == [
+        "# HELP kodibot_test_total Test counter",
+        "# TYPE kodibot_test_total counter",
+        'kodibot_test_total{intent="tax \\"info\\""} 3',
+    ]
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = LabeledHistogram("kodibot_test_seconds", "Test histogram", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "llm")
+    histogram.observe(0.5, "llm")
+    histogram.observe(2.0, "llm")
+    lines = histogram.render()
+    assert 'kodibot_test_seconds_bucket{stage="llm",le="0.1"} 1' in lines
+    assert 'kodibot_test_seconds_bucket{stage="llm",le="1"} 2' in lines
+    assert 'kodibot_test_seconds_bucket{stage="llm",le="+Inf"} 3' in lines
+    assert 'kodibot_test_seconds_count{stage="llm"} 3' in lines
+    assert 'kodibot_test_seconds_sum{stage="llm"} 2.55' in lines
+
+def test_a_failing_callback_does_not_break_the_scrape(registry):
+    def collect():
+        raise RuntimeError("base indisponible")
+    CallbackMetric("kodibot_test_broken", "Broken gauge", (), collect)
+    text = render_prometheus()
+    assert "# kodibot_test_broken unavailable: base indisponible" in text
+    assert "# TYPE kodibot_chat_stage_seconds histogram" in text
+
+def test_chat_request_updates_stage_timings_and_counters(app_client, linked_citizen, monkeypatch):
+    async def get_intent(message):
+        return {"intent": "greeting", "confidence": 0.99, "slots": {}, "source": "rules"}
+    monkeypatch.setattr(main, "get_intent_async", get_intent)
+    monkeypatch.setattr(main, "CHAT_PIPELINE", "classic")
+
+    link_checks = CHAT_STAGE_SECONDS.labels("link_check").count
+    canned = CHAT_REQUESTS.value("/chat", "greeting", "canned")
+
+    response = app_client.post("/chat", json={"phone_number": linked_citizen["phone_number"], "message": "Bonjour"})
+    assert response.status_code == 200
+
+    assert CHAT_STAGE_SECONDS.labels("link_check").count == link_checks + 1
+    assert CHAT_REQUESTS.value("/chat", "greeting", "canned") == canned + 1
+
+    scrape = app_client.get("/metrics")
+    assert scrape.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert _sample(scrape.text, 'kodibot_chat_requests_total{endpoint="/chat",intent="greeting",outcome="canned"}') == canned + 1
+    assert _sample(scrape.text, 'kodibot_chat_stage_seconds_count{stage="link_check"}') == link_checks + 1
+    assert 'kodibot_chat_request_seconds_bucket{endpoint="/chat",le="+Inf"}' in scrape.text
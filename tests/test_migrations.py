@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the versioned schema migration runner
+"""
+
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import IntegrityError
+
+import src.migrations as migrations
+from src.database import Base
+from src.migrations import (
+    Migration, MigrationError, create_index, ensure_unique, migration_status, run_migrations
+)
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    yield engine
+    engine.dispose()
+
+def _versions(engine):
+    return [item["version"] for item in migration_status(engine) if item["applied_at"] is not None]
+
+def _indexes(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+def test_fresh_database_records_every_version(engine):
+    Base.metadata.create_all(bind=engine)
+    applied = run_migrations(engine)
+    assert applied == [item.version for item in migrations.MIGRATIONS]
+    assert run_migrations(engine) == []
+    assert "ix_chat_logs_created_at" in _indexes(engine, "chat_logs")
+
+def test_older_database_gets_the_new_columns_and_rollups(engine):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ALTER TABLE chat_logs DROP COLUMN intent_source")
+        connection.exec_driver_sql("INSERT INTO chat_logs (phone_number, message_text, direction) VALUES ('+243810000001', 'Bonjour', 'IN')")
+
+    run_migrations(engine)
+
+    assert "intent_source" in {column["name"] for column in inspect(engine).get_columns("chat_logs")}
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT message_text FROM chat_logs").scalar() == "Bonjour"
+        # The logged history is seeded into the analytics rollups
+        assert connection.exec_driver_sql("SELECT SUM(message_count) FROM chat_log_rollups").scalar() == 1
+
+def test_target_stops_at_a_version(engine):
+    Base.metadata.create_all(bind=engine)
+    assert run_migrations(engine, target=2) == [1, 2]
+    assert _versions(engine) == [1, 2]
+    assert run_migrations(engine) == [item.version for item in migrations.MIGRATIONS if item.version > 2]
+
+@pytest.fixture
+def parcels(engine, monkeypatch):
+    """A parcels table with a duplicated parcel number, and a registry of test migrations"""
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE parcels (id INTEGER PRIMARY KEY, parcel_number VARCHAR)")
+        connection.exec_driver_sql("INSERT INTO parcels (parcel_number) VALUES ('KIN-001'), ('KIN-001'), ('KIN-002')")
+    registry = []
+    monkeypatch.setattr(migrations, "MIGRATIONS", registry)
+    return registry
+
+def test_duplicates_stop_the_unique_index_migration(engine, parcels):
+    def unique_parcels(connection):
+        ensure_unique(connection, "parcels", "parcel_number")
+        create_index(connection, "ix_parcels_parcel_number", "parcels", ["parcel_number"], unique=True)
+    parcels.extend([
+        Migration(1, "index", lambda connection: create_index(connection, "ix_parcels_id", "parcels", ["id"])),
+        Migration(2, "unique parcels", unique_parcels),
+        Migration(3, "later", lambda connection: None),
+    ])
+
+    with pytest.raises(MigrationError, match=r"KIN-001 \(x2\)"):
+        run_migrations(engine)
+    # Version 1 stays applied; 2 and the ones after it are still pending
+    assert _versions(engine) == [1]
+    assert "ix_parcels_parcel_number" not in _indexes(engine, "parcels")
+
+def test_constraint_failure_in_an_upgrade_is_not_swallowed(engine, parcels):
+    parcels.append(Migration(1, "unique parcels", lambda connection: create_index(
+        connection, "ix_parcels_parcel_number", "parcels", ["parcel_number"], unique=True
+    )))
+    with pytest.raises(IntegrityError):
+        run_migrations(engine)
+    assert _versions(engine) == []
+
+def test_version_recorded_by_another_worker_is_skipped(engine, parcels):
+    def raced(connection):
+        # Another worker finishes the same migration while this one runs it
+        with engine.begin() as other:
+            other.exec_driver_sql(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (1, 'raced', CURRENT_TIMESTAMP)"
+            )
+    parcels.extend([Migration(1, "raced", raced), Migration(2, "next", lambda connection: None)])
+
+    assert run_migrations(engine) == [2]
+    assert _versions(engine) == [1, 2]
+
+def test_duplicate_versions_are_rejected(parcels):
+    migrations.migration(7, "first")(lambda connection: None)
+    with pytest.raises(ValueError):
+        migrations.migration(7, "second")(lambda connection: None)
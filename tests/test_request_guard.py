@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-phone locks and the replay of redelivered chat messages
+"""
+
+import asyncio
+
+import pytest
+
+import main
+from src.model import QUOTA_MESSAGE
+from src.request_guard import (
+    KeyedLocks, reply_cache, idempotency_key, store_reply, get_stored_reply, forget_replies
+)
+
+@pytest.fixture(autouse=True)
+def empty_reply_cache():
+    reply_cache.clear()
+    yield
+    reply_cache.clear()
+
+def test_messages_of_one_phone_run_one_at_a_time():
+    locks = KeyedLocks()
+    order = []
+
+    async def handle(phone, name, delay):
+        async with locks.hold(phone):
+            order.append(f"{name}:start")
+            await asyncio.sleep(delay)
+            order.append(f"{name}:end")
+
+    async def scenario():
+        await asyncio.gather(
+            handle("+243810000001", "a", 0.02),
+            handle("+243810000001", "b", 0),
+            handle("+243810000002", "c", 0),
+        )
+
+    asyncio.run(scenario())
+    assert order.index("a:end") < order.index("b:start")
+    assert order.index("c:end") < order.index("a:end")  # other phones are not blocked
+    assert len(locks) == 0
+
+def test_cancelled_waiter_does_not_leak_its_lock():
+    locks = KeyedLocks()
+
+    async def scenario():
+        await locks.acquire("+243810000001")
+        waiter = asyncio.ensure_future(locks.acquire("+243810000001"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        locks.release("+243810000001")
+
+    asyncio.run(scenario())
+    assert len(locks) == 0
+
+def test_key_is_the_message_id_or_the_normalized_text():
+    assert idempotency_key("+243810000001", "Bonjour", "wamid.1") == ("+243810000001", "id", "wamid.1")
+    assert idempotency_key("+243810000001", "  Quel est mon SOLDE ? ") == idempotency_key("+243810000001", "quel est mon solde ?")
+    assert idempotency_key("+243810000001", "solde") != idempotency_key("+243810000002", "solde")
+
+@pytest.mark.parametrize("outcome, stored", [
+    ("answered", True), ("template", True), ("linking", True),
+    ("degraded", False), ("fallback", False), ("no_data", False), ("error", False), (None, False),
+])
+def test_only_successful_replies_are_stored(outcome, stored):
+    key = idempotency_key("+243810000001", "solde")
+    store_reply(key, {"response": "Votre solde est de 100 000 FC."}, outcome)
+    assert (get_stored_reply(key) is not None) is stored
+
+def test_forget_replies_only_drops_that_phone():
+    store_reply(idempotency_key("+243810000001", "solde"), {"response": "a"}, "answered")
+    store_reply(idempotency_key("+243810000001", "bonjour", "wamid.1"), {"response": "b"}, "canned")
+    store_reply(idempotency_key("+243810000002", "solde"), {"response": "c"}, "answered")
+    assert forget_replies("+243810000001") == 2
+    assert get_stored_reply(idempotency_key("+243810000002", "solde")) == {"response": "c"}
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Classify every message as a procedures question and answer from a script"""
+    answers = []
+
+    async def get_intent(message):
+        return {"intent": "procedures", "confidence": 0.95, "slots": {}, "source": "llm"}
+
+    async def generate_answer(user_prompt, system_prompt, phone_number=None):
+        return answers.pop(0)
+
+    monkeypatch.setattr(main, "get_intent_async", get_intent)
+    monkeypatch.setattr(main, "generate_answer_async", generate_answer)
+    monkeypatch.setattr(main, "CHAT_PIPELINE", "classic")
+    return answers
+
+def test_redelivered_message_gets_the_stored_reply(app_client, linked_citizen, fake_llm):
+    fake_llm.extend(["Rendez-vous à la DGI avec votre pièce d'identité."])
+    body = {"phone_number": linked_citizen["phone_number"], "message": "Comment payer ?", "message_id": "wamid.42"}
+    first = app_client.post("/chat", json=body).json()
+    second = app_client.post("/chat", json=body).json()
+    assert second == first
+    assert fake_llm == []  # the pipeline ran once
+
+def test_degraded_reply_is_not_replayed(app_client, linked_citizen, fake_llm):
+    fake_llm.extend([QUOTA_MESSAGE, "Rendez-vous à la DGI avec votre pièce d'identité."])
+    body = {"phone_number": linked_citizen["phone_number"], "message": "Comment payer ?", "message_id": "wamid.43"}
+    assert app_client.post("/chat", json=body).json()["response"] == QUOTA_MESSAGE
+    assert app_client.post("/chat", json=body).json()["response"] == "Rendez-vous à la DGI avec votre pièce d'identité."
+
+def test_linking_drops_replies_built_for_the_unlinked_phone(app_client, linked_citizen, fake_llm):
+    fake_llm.extend(["Rendez-vous à la DGI avec votre pièce d'identité."])
+    phone = "+243" + linked_citizen["phone_number"][-9:][::-1]
+    body = {"phone_number": phone, "message": "Comment payer ?"}
+    assert app_client.post("/chat", json=body).json()["requires_linking"] is True
+
+    linking = app_client.post("/link-account", json={"phone_number": phone, "citizen_id": linked_citizen["citizen_id"]}).json()
+    verified = app_client.post("/verify-otp", json={"phone_number": phone, "otp_code": linking["otp"]}).json()
+    assert verified["success"] is True
+
+    reply = app_client.post("/chat", json=body).json()
+    assert reply["requires_linking"] is False
+    assert reply["response"] == "Rendez-vous à la DGI avec votre pièce d'identité."
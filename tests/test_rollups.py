@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the hourly chat log rollups, their backfill and seeding, and the analytics queries
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.database import ChatLogs, ChatLogRollup
+from src.rollups import (
+    RollupDelta, apply_rollups, backfill_rollups, seed_rollups, hour_bucket, is_fallback,
+    popular_intents, intent_summary, daily_intents
+)
+
+NOW = hour_bucket(datetime.utcnow())
+
+def _log(db, created_at, direction="IN", intent=None, confidence=None):
+    db.add(ChatLogs(phone_number="+243810000001", message_text="Bonjour", direction=direction,
+                    intent=intent, confidence=confidence, created_at=created_at))
+
+def _rollups(db):
+    return {
+        (row.bucket_hour, row.intent, row.direction): (row.message_count, row.fallback_count)
+        for row in db.query(ChatLogRollup).all()
+    }
+
+def _by_intent(popular):
+    return {item["intent"]: item["count"] for item in popular}
+
+def _add(db, created_at, direction="IN", intent=None, confidence=None):
+    """A chat log and its live rollup update, as the logging service writes them"""
+    _log(db, created_at, direction, intent, confidence)
+    delta = RollupDelta()
+    delta.add(created_at, direction, intent, confidence)
+    apply_rollups(db, delta)
+
+def test_fallback_rule_matches_the_chat_flow():
+    assert is_fallback("IN", "fallback", 0.9)
+    assert is_fallback("IN", "tax_info", 0.4)
+    assert not is_fallback("IN", "tax_info", 0.6)
+    assert not is_fallback("IN", None, 0.1)
+    assert not is_fallback("OUT", "fallback", 0.1)
+
+def test_reclassification_moves_the_count():
+    delta = RollupDelta()
+    delta.add(NOW, "IN", None, None)
+    delta.move(NOW, "IN", None, None, "tax_info", 0.9)
+    rows = delta.rows()
+    assert [(row["intent"], row["message_count"], row["confidence_count"]) for row in rows] == [("tax_info", 1, 1)]
+
+def test_deltas_are_added_to_existing_rollups(db_session):
+    for confidence in (0.9, 0.5):
+        delta = RollupDelta()
+        delta.add(NOW + timedelta(minutes=10), "IN", "tax_info", confidence)
+        apply_rollups(db_session, delta)
+    db_session.commit()
+    row = db_session.query(ChatLogRollup).one()
+    assert (row.bucket_hour, row.message_count, row.fallback_count, row.confidence_count) == (NOW, 2, 1, 2)
+    assert row.confidence_sum == pytest.approx(1.4)
+
+def test_analytics_queries_read_the_rollups(db_session):
+    _add(db_session, NOW - timedelta(hours=3), "IN", "tax_info", 0.9)
+    _add(db_session, NOW - timedelta(hours=3), "OUT")
+    _add(db_session, NOW - timedelta(hours=1), "IN", "tax_info", 0.5)
+    _add(db_session, NOW - timedelta(hours=1), "IN", "greeting", 0.99)
+    _add(db_session, NOW - timedelta(days=3), "IN", "parcels", 0.8)
+    db_session.commit()
+
+    popular = popular_intents(db_session)
+    assert popular[0] == {"intent": "tax_info", "count": 2}
+    assert _by_intent(popular) == {"tax_info": 2, "greeting": 1, "parcels": 1}
+    assert _by_intent(popular_intents(db_session, hours=2)) == {"greeting": 1, "tax_info": 1}
+
+    summary = intent_summary(db_session, hours=24)
+    assert summary["total"]["messages"] == 3
+    assert summary["intents"]["tax_info"] == {"messages": 2, "fallbacks": 1, "fallback_rate": 0.5, "avg_confidence": 0.7}
+
+    days = {day["day"]: day for day in daily_intents(db_session, days=7)}
+    three_days_ago = (NOW - timedelta(days=3)).strftime("%Y-%m-%d")
+    assert days[three_days_ago]["intents"] == {"parcels": 1}
+    assert sum(day["outbound"] for day in days.values()) == 1
+
+def test_backfill_rebuilds_closed_hours_only(db_session):
+    old_hour = NOW - timedelta(hours=5)
+    _log(db_session, old_hour + timedelta(minutes=1), "IN", "tax_info", 0.9)
+    _log(db_session, old_hour + timedelta(minutes=2), "IN", "fallback", 0.2)
+    # A stale rollup for the old hour, and live traffic in the current hour
+    db_session.add(ChatLogRollup(bucket_hour=old_hour, intent="tax_info", direction="IN", message_count=7,
+                                 fallback_count=0, confidence_sum=0.0, confidence_count=0))
+    _add(db_session, datetime.utcnow(), "IN", "greeting", 0.99)
+    _add(db_session, datetime.utcnow(), "IN", "greeting", 0.99)
+    db_session.commit()
+
+    assert backfill_rollups(db_session) == 2
+
+    rollups = _rollups(db_session)
+    assert rollups[(old_hour, "tax_info", "IN")] == (1, 0)
+    assert rollups[(old_hour, "fallback", "IN")] == (1, 1)
+    # The current hour is left to the live writers
+    current = hour_bucket(datetime.utcnow() - timedelta(minutes=5))
+    assert sum(count for (hour, _, _), (count, _) in rollups.items() if hour >= current) == 2
+
+def test_backfill_keeps_the_rollups_of_archived_days(db_session):
+    archived_hour = NOW - timedelta(days=90)
+    db_session.add(ChatLogRollup(bucket_hour=archived_hour, intent="parcels", direction="IN", message_count=12,
+                                 fallback_count=0, confidence_sum=0.0, confidence_count=0))
+    _log(db_session, NOW - timedelta(hours=2), "IN", "tax_info", 0.9)
+    db_session.commit()
+
+    backfill_rollups(db_session)
+    assert _rollups(db_session)[(archived_hour, "parcels", "IN")] == (12, 0)
+
+def test_seeding_completes_the_first_live_hour(db_session):
+    live_hour = NOW - timedelta(hours=2)
+    _log(db_session, NOW - timedelta(days=2), "IN", "tax_info", 0.9)
+    _log(db_session, NOW - timedelta(days=2), "OUT")
+    # The first rolled-up hour: one log written before live updates started, one after
+    _log(db_session, live_hour + timedelta(minutes=1), "IN", "greeting", 0.99)
+    _add(db_session, live_hour + timedelta(minutes=5), "IN", "greeting", 0.99)
+    _add(db_session, datetime.utcnow(), "IN", "parcels", 0.9)
+    db_session.commit()
+
+    assert seed_rollups(db_session.connection()) == 5
+    db_session.commit()
+
+    rollups = _rollups(db_session)
+    assert rollups[(NOW - timedelta(days=2), "tax_info", "IN")] == (1, 0)
+    assert rollups[(NOW - timedelta(days=2), "", "OUT")] == (1, 0)
+    assert rollups[(live_hour, "greeting", "IN")] == (2, 0)
+    # Live deltas are recounted, not added on top
+    assert rollups[(hour_bucket(datetime.utcnow()), "parcels", "IN")] == (1, 0)
+
+def test_seeding_keeps_the_rollups_of_archived_days(db_session):
+    archived_hour = NOW - timedelta(days=90)
+    db_session.add(ChatLogRollup(bucket_hour=archived_hour, intent="parcels", direction="IN", message_count=12,
+                                 fallback_count=0, confidence_sum=0.0, confidence_count=0))
+    _log(db_session, NOW - timedelta(hours=2), "IN", "tax_info", 0.9)
+    db_session.commit()
+
+    assert seed_rollups(db_session.connection()) == 1
+    db_session.commit()
+    assert _rollups(db_session)[(archived_hour, "parcels", "IN")] == (12, 0)
+
+def test_seeding_an_empty_rollup_table_counts_everything(db_session):
+    _log(db_session, NOW - timedelta(days=2), "IN", "tax_info", 0.9)
+    _log(db_session, NOW, "IN", "greeting", 0.99)
+    db_session.commit()
+
+    assert seed_rollups(db_session.connection()) == 2
+    db_session.commit()
+    assert _by_intent(popular_intents(db_session)) == {"greeting": 1, "tax_info": 1}
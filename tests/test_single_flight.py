@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Unit tests for coalescing identical in-flight OpenAI requests (single-flight)
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import src.openai_client as openai_client
+from src.openai_client import LLM_COALESCED, _flight_key
+
+MESSAGES = [{"role": "user", "content": "Quel est mon solde ?"}]
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Fake _create_completion/_acreate_completion that block until released"""
+    state = SimpleNamespace(calls=0, release=threading.Event(), async_release=None, error=None)
+
+    def create(operation, **params):
+        state.calls += 1
+        state.release.wait(5)
+        if state.error is not None:
+            raise state.error
+        return {"answer": params["messages"][-1]["content"], "call": state.calls}
+
+    async def acreate(operation, **params):
+        state.calls += 1
+        await state.async_release.wait()
+        if state.error is not None:
+            raise state.error
+        return {"answer": params["messages"][-1]["content"], "call": state.calls}
+
+    monkeypatch.setattr(openai_client, "LLM_SINGLE_FLIGHT", True)
+    monkeypatch.setattr(openai_client, "_create_completion", create)
+    monkeypatch.setattr(openai_client, "_acreate_completion", acreate)
+    return state
+
+def test_flight_key_ignores_parameter_order():
+    first = _flight_key({"model": "gpt-4o-mini", "messages": MESSAGES, "temperature": 0})
+    second = _flight_key({"temperature": 0, "messages": MESSAGES, "model": "gpt-4o-mini"})
+    assert first == second
+    assert first != _flight_key({"model": "gpt-4o-mini", "messages": MESSAGES, "temperature": 0.2})
+
+def _run_threads(count, target):
+    results, errors = [None] * count, [None] * count
+
+    def worker(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+def _wait_for_followers(before, count):
+    for _ in range(500):
+        if LLM_COALESCED.value("intent") >= before + count:
+            return
+        threading.Event().wait(0.01)
+
+def test_identical_sync_calls_share_one_upstream_call(upstream):
+    before = LLM_COALESCED.value("intent")
+    threads, results, errors = _run_threads(
+        4, lambda: openai_client.create_completion("intent", model="gpt-4o-mini", messages=MESSAGES)
+    )
+    _wait_for_followers(before, 3)
+    upstream.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert upstream.calls == 1
+    assert errors == [None] * 4
+    assert all(result is results[0] for result in results)
+    assert LLM_COALESCED.value("intent") == before + 3
+    assert openai_client._sync_flights == {}
+
+def test_sync_followers_get_the_leader_error(upstream):
+    upstream.error = RuntimeError("Error code: 429 - insufficient_quota")
+    before = LLM_COALESCED.value("intent")
+    threads, results, errors = _run_threads(
+        3, lambda: openai_client.create_completion("intent", model="gpt-4o-mini", messages=MESSAGES)
+    )
+    _wait_for_followers(before, 2)
+    upstream.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert upstream.calls == 1
+    assert all(error is upstream.error for error in errors)
+    # The next call is a new flight
+    upstream.error = None
+    assert openai_client.create_completion("intent", model="gpt-4o-mini", messages=MESSAGES)["call"] == 2
+
+def test_different_requests_are_not_coalesced(upstream):
+    upstream.release.set()
+    openai_client.create_completion("intent", model="gpt-4o-mini", messages=MESSAGES)
+    openai_client.create_completion("intent", model="gpt-4o-mini", messages=[{"role": "user", "content": "Bonjour"}])
+    assert upstream.calls == 2
+
+def test_identical_async_calls_share_one_upstream_call(upstream):
+    async def scenario():
+        upstream.async_release = asyncio.Event()
+        calls = [openai_client.acreate_completion("answer", model="gpt-4o-mini", messages=MESSAGES) for _ in range(3)]
+        gathered = asyncio.gather(*calls)
+        await asyncio.sleep(0)
+        upstream.async_release.set()
+        return await gathered
+
+    results = asyncio.run(scenario())
+    assert upstream.calls == 1
+    assert results[0] is results[1] is results[2]
+    assert openai_client._async_flights == {}
+
+def test_cancelled_caller_does_not_cancel_the_shared_call(upstream):
+    async def scenario():
+        upstream.async_release = asyncio.Event()
+        first = asyncio.ensure_future(openai_client.acreate_completion("answer", model="gpt-4o-mini", messages=MESSAGES))
+        second = asyncio.ensure_future(openai_client.acreate_completion("answer", model="gpt-4o-mini", messages=MESSAGES))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        upstream.async_release.set()
+        return first, await second
+
+    first, result = asyncio.run(scenario())
+    assert first.cancelled()
+    assert result["call"] == 1 and upstream.calls == 1
+
+def test_disabled_single_flight_calls_upstream_each_time(upstream, monkeypatch):
+    monkeypatch.setattr(openai_client, "LLM_SINGLE_FLIGHT", False)
+    upstream.release.set()
+    openai_client.create_completion("intent", model="gpt-4o-mini", messages=MESSAGES)
+    openai_client.create_completion("intent", model="gpt-4o-mini", messages=MESSAGES)
+    assert upstream.calls == 2
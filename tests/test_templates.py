@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the French answer templates of the data-lookup intents
+"""
+
+import pytest
+
+import main
+import src.templates as templates
+from src.templates import format_amount, render_answer, answer_mode, _parse_modes
+
+TAXES = {
+    "taxes": [
+        {"type": "foncière", "annee": 2023, "statut": "paid", "montant_du": 100000, "montant_paye": 100000, "echeance": "31/03/2023"},
+        {"type": "foncière", "annee": 2024, "statut": "pending", "montant_du": 150000, "montant_paye": 50000, "echeance": "31/03/2024"},
+        {"type": "véhicule", "annee": 2022, "statut": "overdue", "montant_du": 75000.5, "montant_paye": 0, "echeance": "31/03/2022"},
+    ],
+    "total_du": 325000.5,
+    "total_paye": 150000,
+    "solde": 175000.5,
+}
+
+@pytest.mark.parametrize("value, expected", [
+    (1250000, "1 250 000 FC"),
+    (1250000.0, "1 250 000 FC"),
+    (1250.5, "1 250,50 FC"),
+    (0, "0 FC"),
+    (None, "Non défini"),
+])
+def test_amounts_are_formatted_the_congolese_way(value, expected):
+    assert format_amount(value) == expected
+
+def test_outstanding_taxes_come_first():
+    answer = render_answer("tax_info", TAXES, "Patrick Daudi")
+    lines = [line for line in answer.splitlines() if line.startswith("• ")]
+    assert lines == [
+        "• foncière (2024) : ⏳ En attente",
+        "• véhicule (2022) : ⚠️ En retard",
+        "• foncière (2023) : ✅ Payée",
+    ]
+    assert "  Dû : 75 000,50 FC | Payé : 0 FC | Échéance : 31/03/2022" in answer
+    assert "🧾 Solde restant : 175 000,50 FC" in answer
+    assert "💡 Vous pouvez régler votre solde en ligne sur Kodinet." in answer
+
+def test_settled_citizen_is_thanked():
+    answer = render_answer("tax_info", {"taxes": TAXES["taxes"][:1], "total_du": 100000, "total_paye": 100000, "solde": 0},
+                           "Patrick Daudi")
+    assert answer.endswith("🎉 Vous êtes à jour dans vos paiements. Merci !")
+
+def test_empty_lists_get_a_personal_sentence():
+    assert render_answer("tax_info", {"taxes": []}, "Patrick Daudi") == \
+        "📊 Patrick Daudi, aucune taxe n'est enregistrée à votre nom pour le moment."
+    assert render_answer("parcels", {"parcelles": []}, "Patrick Daudi") == \
+        "🏠 Patrick Daudi, aucune parcelle n'est enregistrée à votre nom."
+
+def test_parcels_and_profile():
+    parcels = render_answer("parcels", {"nombre_total": 1, "parcelles": [{
+        "numero_parcelle": "KIN-0042", "type": "résidentielle", "statut": "active",
+        "adresse": "Av. Kasa-Vubu 12", "superficie": "500 m²", "valeur_estimee": 45000000
+    }]}, "Patrick Daudi")
+    assert "🏠 **Vos parcelles** (1)" in parcels
+    assert "• KIN-0042 - résidentielle (✅ Active)" in parcels
+    assert "  Valeur estimée : 45 000 000 FC" in parcels
+
+    profile = render_answer("profile", {"nom": None, "adresse": "Av. Kasa-Vubu 12"}, "Patrick Daudi")
+    assert "• Nom : Patrick Daudi" in profile
+    assert "• Email : Non définie" in profile
+
+def test_etax_payment_methods_are_listed():
+    answer = render_answer("etax_status", {"payment_methods": ["M-Pesa", "Airtel Money"], "notifications_enabled": True},
+                           "Patrick Daudi")
+    assert "• Moyens de paiement : M-Pesa, Airtel Money" in answer
+    assert "• Notifications : ✅ Oui" in answer
+    assert "• Paiement automatique : ❌ Non" in answer
+
+def test_unusable_data_falls_back_to_the_llm():
+    assert render_answer("procedures", {"etapes": []}, "Patrick Daudi") is None
+    assert render_answer("tax_info", None, "Patrick Daudi") is None
+    assert render_answer("tax_info", {"taxes": [{"statut": "paid", "annee": "2024"}, {"statut": "paid", "annee": 2023}]},
+                         "Patrick Daudi") is None
+
+def test_answer_modes_are_configurable(monkeypatch):
+    assert _parse_modes("profile=template, tax_info=HYBRID,parcels=magique,=llm") == {
+        "profile": "template", "tax_info": "hybrid"
+    }
+    monkeypatch.setattr(templates, "ANSWER_MODES", {"tax_info": "hybrid"})
+    monkeypatch.setattr(templates, "ANSWER_MODE_DEFAULT", "template")
+    assert answer_mode("tax_info") == "hybrid"
+    assert answer_mode("parcels") == "template"
+    assert answer_mode("procedures") == "llm"
+    monkeypatch.setattr(templates, "ANSWER_MODE_DEFAULT", "inconnu")
+    assert answer_mode("parcels") == "llm"
+
+def test_tax_question_is_answered_from_the_template(app_client, linked_citizen, monkeypatch):
+    async def get_intent(message):
+        return {"intent": "tax_info", "confidence": 0.95, "slots": {}, "source": "llm"}
+
+    async def generate_answer(*args, **kwargs):
+        raise AssertionError("the LLM must not be called for a templated answer")
+
+    monkeypatch.setattr(main, "get_intent_async", get_intent)
+    monkeypatch.setattr(main, "generate_answer_async", generate_answer)
+    monkeypatch.setattr(main, "CHAT_PIPELINE", "classic")
+    monkeypatch.setattr(templates, "ANSWER_MODES", {})
+    monkeypatch.setattr(templates, "ANSWER_MODE_DEFAULT", "template")
+
+    reply = app_client.post("/chat", json={"phone_number": linked_citizen["phone_number"], "message": "Quel est mon solde ?"})
+    answer = reply.json()["response"]
+    assert "• foncière (2024) : ⏳ En attente" in answer
+    assert "🧾 Solde restant : 100 000 FC" in answer